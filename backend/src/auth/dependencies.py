@@ -1,19 +1,24 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from jwt import PyJWTError
-from src.database import get_db
+from src.database import get_db, get_async_db
+from src.exceptions import PermissionDenied
 from src.gestion.models import Usuario
 from src.utils.jwt import decode_access_token
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _user_id_from_token(token: str) -> str:
+    credentials_exception = _credentials_exception()
     try:
         payload = decode_access_token(token)
         if payload is None:
@@ -23,7 +28,23 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             raise credentials_exception
     except PyJWTError:
         raise credentials_exception
+    return user_id
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    user_id = _user_id_from_token(token)
     user = db.query(Usuario).filter(Usuario.id == user_id).first()
     if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+        raise _credentials_exception()
+    return user
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    user_id = _user_id_from_token(token)
+    user = await db.get(Usuario, int(user_id))
+    if user is None:
+        raise _credentials_exception()
+    return user
+
+def get_current_admin(user: Usuario = Depends(get_current_user)):
+    if user.rol is None or user.rol.nombre != "administrador":
+        raise PermissionDenied()
+    return user
@@ -1,12 +1,65 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 load_dotenv()
 
-engine = create_engine(os.getenv("DB_URL"), connect_args={"check_same_thread": False})
+DB_URL = os.getenv("DB_URL")
+
+
+def _env_bool(nombre: str, defecto: str) -> bool:
+    return os.getenv(nombre, defecto).lower() in ("1", "true", "si", "yes")
+
+# Configuración del pool (servidores como PostgreSQL)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", "true")
+
+# Pragmas de SQLite. Con WAL las lecturas no se bloquean por una escritura
+# en curso y busy_timeout hace esperar a los escritores concurrentes en lugar
+# de fallar con "database is locked".
+PRAGMAS_SQLITE = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")),  # milisegundos
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),  # bytes
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-64000")),  # negativo: KiB
+}
+
+
+def opciones_motor(url: str) -> dict:
+    """Argumentos de create_engine según el motor de la URL."""
+    if url.startswith("sqlite"):
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": POOL_PRE_PING,
+    }
+
+
+def configurar_sqlite(motor) -> None:
+    """Aplica los pragmas a cada conexión nueva del motor si es SQLite."""
+    if motor.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(motor, "connect")
+    def aplicar_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, valor in PRAGMAS_SQLITE.items():
+            cursor.execute(f"PRAGMA {pragma}={valor}")
+        cursor.close()
+
+
+engine = create_engine(DB_URL, **opciones_motor(DB_URL))
+configurar_sqlite(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Dependency
@@ -15,4 +68,28 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def url_asincrona(url: str) -> str:
+    """Traduce la URL sincrónica al driver asíncrono equivalente."""
+    if url.startswith("sqlite"):
+        return "sqlite+aiosqlite" + url[url.index(":"):]
+    if url.startswith(("postgresql", "postgres")):
+        return "postgresql+asyncpg" + url[url.index(":"):]
+    return url
+
+# Motor asíncrono sobre la misma base. ASYNC_DB_URL permite indicarlo
+# explícitamente (por ejemplo, si la URL lleva parámetros propios de psycopg2).
+ASYNC_DB_URL = os.getenv("ASYNC_DB_URL") or url_asincrona(DB_URL)
+
+async_engine = create_async_engine(ASYNC_DB_URL, **opciones_motor(ASYNC_DB_URL))
+configurar_sqlite(async_engine.sync_engine)
+# Sin expirar al confirmar: los objetos devueltos se serializan fuera de la
+# sesión y no pueden recargar atributos de forma perezosa
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# Dependency asíncrona
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
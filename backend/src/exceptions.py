@@ -23,6 +23,10 @@ class UnprocessableEntity(DetailedHTTPException):
     STATUS_CODE = status.HTTP_422_UNPROCESSABLE_ENTITY
     DETAIL = "Unprocessable entity"
 
+class Conflict(DetailedHTTPException):
+    STATUS_CODE = status.HTTP_409_CONFLICT
+    DETAIL = "Conflict"
+
 class NotAuthenticated(DetailedHTTPException):
     STATUS_CODE = status.HTTP_401_UNAUTHORIZED
     DETAIL = "User not authenticated"
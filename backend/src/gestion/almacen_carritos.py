@@ -0,0 +1,479 @@
+"""
+Almacenes de carritos.
+
+El carrito es la ruta de escritura más usada: cada click en agregar, cambiar
+cantidad o quitar un producto. `AlmacenCarritosBD` escribe cada cambio en la
+base, como siempre. `AlmacenCarritosMemoria` mantiene los carritos de los
+usuarios activos en memoria, registra cada cambio en un diario JSONL y los
+vuelca a `carritos`/`carritodetalles` cada pocos segundos o antes del
+checkout. Se elige con la variable de entorno CARRITO_STORE (`db` o `memoria`).
+
+El almacén en memoria vive en el proceso: sólo sirve con un único worker (o
+con sesiones pegadas a un worker), porque cada proceso tendría su copia.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, TypeVar
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+from src.gestion import schemas, services
+from src.gestion.models import CarritoDetalle
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CARRITO_STORE = os.getenv("CARRITO_STORE", "db").lower()
+# Diario de cambios todavía no volcados; se relee al arrancar tras una caída
+CARRITOS_DIARIO = os.getenv("CARRITOS_DIARIO", "carritos_diario.jsonl")
+# Con fsync el diario también sobrevive a un corte de energía, a costa de latencia
+CARRITOS_DIARIO_FSYNC = os.getenv("CARRITOS_DIARIO_FSYNC", "false").lower() in ("1", "true", "si", "yes")
+# Segundos sin uso tras los cuales un carrito ya volcado sale de memoria
+CARRITOS_INACTIVIDAD = float(os.getenv("CARRITOS_INACTIVIDAD", "1800"))
+
+
+class AlmacenCarritos(ABC):
+    """Operaciones sobre el carrito del usuario que usan las rutas."""
+
+    # Con locks de hilo, las rutas asíncronas lo llaman desde el threadpool
+    usa_hilos = False
+
+    @abstractmethod
+    def agregar(self, db: Session, usuario_id: int, producto_id: int, cantidad: int):
+        ...
+
+    @abstractmethod
+    def actualizar_cantidad(self, db: Session, usuario_id: int, producto_id: int, cantidad: int):
+        ...
+
+    @abstractmethod
+    def eliminar(self, db: Session, usuario_id: int, producto_id: int) -> None:
+        ...
+
+    @abstractmethod
+    def vaciar(self, db: Session, usuario_id: int) -> None:
+        ...
+
+    @abstractmethod
+    def aplicar_operaciones(self, db: Session, usuario_id: int, operaciones: list) -> list:
+        """Aplica varias operaciones juntas y devuelve el carrito resultante."""
+
+    @abstractmethod
+    def listar(self, db: Session, usuario_id: int) -> list:
+        ...
+
+    def volcar(self, db: Session, usuario_id: Optional[int] = None) -> int:
+        """Escribe en la base los cambios pendientes (de un usuario o de todos)."""
+        return 0
+
+    def confirmar_pedido(self, db: Session, usuario_id: int, crear: Callable[[Session], T]) -> T:
+        """
+        Crea el pedido con `crear(db)` a partir del carrito en la base. El
+        almacén en memoria vuelca el carrito antes y lo descarta después.
+        """
+        return crear(db)
+
+    def descartar(self, usuario_id: int) -> None:
+        """Olvida la copia del usuario; la base pasa a ser la referencia."""
+
+    def recuperar(self, db: Session) -> int:
+        """Aplica lo que quedó en el diario si el proceso terminó sin volcar."""
+        return 0
+
+    def usuarios_en_memoria(self) -> set:
+        """Usuarios cuyo carrito vive en el almacén y no debe tocarse desde la base."""
+        return set()
+
+    def barrer_abandonados(self, db: Session, dias: Optional[int] = None) -> int:
+        """Borra de la base los carritos abandonados que el almacén no tiene en uso."""
+        return services.barrer_carritos_abandonados(db, dias, excluir_usuarios=self.usuarios_en_memoria())
+
+    def estadisticas(self) -> dict:
+        return {"nombre": "carritos", "almacen": "db"}
+
+
+class AlmacenCarritosBD(AlmacenCarritos):
+    """Cada cambio se escribe en la base en el momento."""
+
+    def agregar(self, db, usuario_id, producto_id, cantidad):
+        carrito = services.obtener_carrito_o_crear(db, usuario_id)
+        return services.agregar_producto_al_carrito(
+            db, carrito.id, producto_id, schemas.CarritoDetalleBase(cantidad=cantidad, subtotal=0)
+        )
+
+    def actualizar_cantidad(self, db, usuario_id, producto_id, cantidad):
+        carrito = services.obtener_carrito_o_crear(db, usuario_id)
+        return services.actualizar_cantidad_producto(db, carrito.id, producto_id, cantidad)
+
+    def eliminar(self, db, usuario_id, producto_id):
+        carrito = services.obtener_carrito_o_crear(db, usuario_id)
+        services.eliminar_producto_del_carrito(db, carrito.id, producto_id)
+
+    def vaciar(self, db, usuario_id):
+        carrito = services.obtener_carrito_por_usuario(db, usuario_id)
+        if not carrito:
+            raise HTTPException(status_code=404, detail="Carrito no encontrado")
+        services.vaciar_carrito(db, carrito.id)
+
+    def aplicar_operaciones(self, db, usuario_id, operaciones):
+        carrito = services.obtener_carrito_o_crear(db, usuario_id)
+        return services.aplicar_operaciones_carrito(db, carrito.id, operaciones)
+
+    def listar(self, db, usuario_id):
+        carrito = services.obtener_carrito_o_crear(db, usuario_id)
+        return services.listar_detalles(db, carrito.id)
+
+
+class _CarritoEnMemoria:
+    __slots__ = ("carrito_id", "lineas", "ids", "sucio", "ultimo_uso")
+
+    def __init__(self, carrito_id: int):
+        self.carrito_id = carrito_id
+        self.lineas: Dict[int, List[float]] = {}  # producto_id -> [cantidad, subtotal]
+        self.ids: Dict[int, int] = {}             # producto_id -> id del detalle en la base
+        self.sucio = False
+        self.ultimo_uso = time.monotonic()
+
+
+class AlmacenCarritosMemoria(AlmacenCarritos):
+    """
+    Aplica los cambios en memoria y los anota en el diario antes de responder.
+    Cada registro del diario lleva el estado completo de la línea (no la
+    diferencia), así releerlo más de una vez da el mismo resultado.
+    """
+
+    usa_hilos = True
+
+    def __init__(self, ruta_diario: str, fsync: bool = False, inactividad: float = 1800):
+        self.ruta_diario = ruta_diario
+        self.ruta_volcando = ruta_diario + ".volcando"
+        self.fsync = fsync
+        self.inactividad = inactividad
+        self._carritos: Dict[int, _CarritoEnMemoria] = {}
+        self._lock = threading.RLock()
+        # Un solo volcado a la vez, de la instantánea al commit. También lo
+        # toman el checkout y descartar, así un volcado en curso no puede
+        # reescribir líneas que el pedido ya vació, y el barrido y la carga
+        # de carritos desde la base, así no se carga uno que se está borrando
+        self._volcado = threading.RLock()
+        self._diario = None
+        self.operaciones = 0
+        self.volcados = 0
+        self.cargas = 0
+
+    # Diario
+    def _anotar(self, registro: dict) -> None:
+        if self._diario is None:
+            self._diario = open(self.ruta_diario, "a", encoding="utf-8")
+        self._diario.write(json.dumps(registro) + "\n")
+        self._diario.flush()
+        if self.fsync:
+            os.fsync(self._diario.fileno())
+
+    def _rotar_diario(self) -> None:
+        """Pasa el diario actual a `.volcando`; se borra cuando el volcado termina bien."""
+        if self._diario is not None:
+            self._diario.close()
+            self._diario = None
+        if not os.path.exists(self.ruta_diario):
+            return
+        if os.path.exists(self.ruta_volcando):
+            # Un volcado anterior falló: se acumula detrás de lo que quedó pendiente
+            with open(self.ruta_volcando, "a", encoding="utf-8") as destino, \
+                 open(self.ruta_diario, encoding="utf-8") as origen:
+                destino.write(origen.read())
+            os.remove(self.ruta_diario)
+        else:
+            os.replace(self.ruta_diario, self.ruta_volcando)
+
+    # Carritos en memoria
+    def _cargar(self, db: Session, usuario_id: int) -> _CarritoEnMemoria:
+        with self._lock:
+            carrito = self._carritos.get(usuario_id)
+        if carrito is None:
+            with self._volcado:
+                with self._lock:
+                    carrito = self._carritos.get(usuario_id)
+                if carrito is None:
+                    carrito_bd = services.obtener_carrito_o_crear(db, usuario_id)
+                    nuevo = _CarritoEnMemoria(carrito_bd.id)
+                    for detalle in services.listar_detalles(db, carrito_bd.id, limit=None):
+                        nuevo.lineas[detalle.producto_id] = [detalle.cantidad, detalle.subtotal]
+                        nuevo.ids[detalle.producto_id] = detalle.id
+                    with self._lock:
+                        carrito = self._carritos.setdefault(usuario_id, nuevo)
+                        self.cargas += 1
+        carrito.ultimo_uso = time.monotonic()
+        return carrito
+
+    def _guardar_linea(self, usuario_id: int, carrito: _CarritoEnMemoria, producto_id: int, cantidad: int, subtotal: float) -> None:
+        """Aplica el estado de una línea (cantidad 0 la quita) y lo anota en el diario."""
+        if cantidad > 0:
+            carrito.lineas[producto_id] = [cantidad, subtotal]
+        else:
+            carrito.lineas.pop(producto_id, None)
+        carrito.sucio = True
+        self.operaciones += 1
+        self._anotar({"u": usuario_id, "c": carrito.carrito_id, "p": producto_id, "n": cantidad, "s": subtotal})
+
+    def _detalle(self, carrito: _CarritoEnMemoria, producto_id: int) -> dict:
+        cantidad, subtotal = carrito.lineas.get(producto_id, [0, 0])
+        return {
+            # Id negativo: la línea todavía no se volcó a la base
+            "id": carrito.ids.get(producto_id, -producto_id),
+            "carrito_id": carrito.carrito_id,
+            "producto_id": producto_id,
+            "cantidad": cantidad,
+            "subtotal": subtotal,
+        }
+
+    @staticmethod
+    def _precio(db: Session, producto_id: int) -> float:
+        producto = services.obtener_producto_cacheado(db, producto_id)
+        return producto.precio_final if producto.precio_final is not None else producto.precio
+
+    def agregar(self, db, usuario_id, producto_id, cantidad):
+        precio = self._precio(db, producto_id)
+        carrito = self._cargar(db, usuario_id)
+        with self._lock:
+            actual_cantidad, actual_subtotal = carrito.lineas.get(producto_id, [0, 0])
+            self._guardar_linea(usuario_id, carrito, producto_id, actual_cantidad + cantidad, actual_subtotal + precio * cantidad)
+            return self._detalle(carrito, producto_id)
+
+    def actualizar_cantidad(self, db, usuario_id, producto_id, cantidad):
+        carrito = self._cargar(db, usuario_id)
+        if producto_id not in carrito.lineas:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado en el carrito")
+        precio = self._precio(db, producto_id)
+        with self._lock:
+            self._guardar_linea(usuario_id, carrito, producto_id, cantidad, precio * cantidad)
+            return self._detalle(carrito, producto_id)
+
+    def eliminar(self, db, usuario_id, producto_id):
+        carrito = self._cargar(db, usuario_id)
+        with self._lock:
+            if producto_id not in carrito.lineas:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado en el carrito")
+            self._guardar_linea(usuario_id, carrito, producto_id, 0, 0)
+
+    def vaciar(self, db, usuario_id):
+        carrito = self._cargar(db, usuario_id)
+        with self._lock:
+            carrito.lineas.clear()
+            carrito.sucio = True
+            self.operaciones += 1
+            self._anotar({"u": usuario_id, "c": carrito.carrito_id, "vaciar": True})
+
+    def aplicar_operaciones(self, db, usuario_id, operaciones):
+        # Los precios se buscan todos antes de tocar el carrito: si falta un producto no se aplica nada
+        precios = services.precios_vigentes(db, (operacion.producto_id for operacion in operaciones))
+        carrito = self._cargar(db, usuario_id)
+        with self._lock:
+            for operacion in operaciones:
+                cantidad = carrito.lineas.get(operacion.producto_id, [0, 0])[0]
+                if operacion.tipo == schemas.TipoOperacionCarrito.AGREGAR:
+                    cantidad += operacion.cantidad
+                elif operacion.tipo == schemas.TipoOperacionCarrito.ACTUALIZAR:
+                    cantidad = operacion.cantidad
+                elif cantidad == 0:
+                    continue
+                else:
+                    cantidad = 0
+                subtotal = round(precios[operacion.producto_id] * cantidad, 2)
+                self._guardar_linea(usuario_id, carrito, operacion.producto_id, cantidad, subtotal)
+            return [self._detalle(carrito, producto_id) for producto_id in carrito.lineas]
+
+    def listar(self, db, usuario_id):
+        carrito = self._cargar(db, usuario_id)
+        # Los subtotales se rehacen con el precio vigente por si cambió desde que se agregó la línea
+        precios = services.precios_vigentes(db, list(carrito.lineas), estricto=False)
+        with self._lock:
+            for producto_id, linea in carrito.lineas.items():
+                if producto_id in precios:
+                    linea[1] = precios[producto_id] * linea[0]
+            return [self._detalle(carrito, producto_id) for producto_id in carrito.lineas]
+
+    # Volcado a la base
+    def volcar(self, db, usuario_id=None):
+        with self._volcado:
+            return self._volcar(db, usuario_id)
+
+    def _volcar(self, db, usuario_id):
+        with self._lock:
+            if usuario_id is None:
+                pendientes = {u: c for u, c in self._carritos.items() if c.sucio}
+                self._rotar_diario()
+            else:
+                carrito = self._carritos.get(usuario_id)
+                pendientes = {usuario_id: carrito} if carrito is not None and carrito.sucio else {}
+            instantanea = {u: (c.carrito_id, {p: list(l) for p, l in c.lineas.items()}) for u, c in pendientes.items()}
+            for carrito in pendientes.values():
+                carrito.sucio = False
+
+        try:
+            nuevos = self._escribir(db, instantanea)
+        except Exception:
+            db.rollback()
+            with self._lock:
+                for carrito in pendientes.values():
+                    carrito.sucio = True
+            raise
+
+        with self._lock:
+            for usuario, ids in nuevos.items():
+                # Sólo si sigue siendo el mismo carrito (no se descartó ni se volvió a cargar)
+                if self._carritos.get(usuario) is pendientes[usuario]:
+                    self._carritos[usuario].ids = ids
+            if usuario_id is None:
+                if os.path.exists(self.ruta_volcando):
+                    os.remove(self.ruta_volcando)
+                limite = time.monotonic() - self.inactividad
+                for usuario in [u for u, c in self._carritos.items() if not c.sucio and c.ultimo_uso < limite]:
+                    del self._carritos[usuario]
+            self.volcados += len(instantanea)
+        return len(instantanea)
+
+    def confirmar_pedido(self, db, usuario_id, crear):
+        # Volcado, pedido y descarte sin que otro volcado se meta en el medio
+        with self._volcado:
+            self._volcar(db, usuario_id)
+            pedido = crear(db)
+            self.descartar(usuario_id)
+            return pedido
+
+    @staticmethod
+    def _escribir(db: Session, instantanea: dict) -> Dict[int, Dict[int, int]]:
+        """
+        Deja cada carrito de la instantánea igual a su copia: actualiza las
+        líneas existentes, inserta las nuevas y borra las que ya no están.
+        Devuelve los ids de los detalles por usuario.
+        """
+        if not instantanea:
+            return {}
+        carritos = {carrito_id: usuario for usuario, (carrito_id, _) in instantanea.items()}
+        # Los subtotales se escriben con el precio vigente: si el precio cambió
+        # mientras la línea estaba en memoria, la base ya se repreció
+        precios = services.precios_vigentes(db, {
+            producto_id for _, lineas in instantanea.values() for producto_id in lineas
+        }, estricto=False)
+        existentes: Dict[int, Dict[int, CarritoDetalle]] = {carrito_id: {} for carrito_id in carritos}
+        for detalle in db.query(CarritoDetalle).filter(CarritoDetalle.carrito_id.in_(carritos)):
+            existentes[detalle.carrito_id][detalle.producto_id] = detalle
+
+        for usuario, (carrito_id, lineas) in instantanea.items():
+            actuales = existentes[carrito_id]
+            for producto_id, detalle in list(actuales.items()):
+                if producto_id not in lineas:
+                    db.delete(detalle)
+                    del actuales[producto_id]
+            for producto_id, (cantidad, subtotal) in lineas.items():
+                detalle = actuales.get(producto_id)
+                if detalle is None:
+                    detalle = CarritoDetalle(carrito_id=carrito_id, producto_id=producto_id)
+                    db.add(detalle)
+                    actuales[producto_id] = detalle
+                detalle.cantidad = cantidad
+                detalle.subtotal = precios[producto_id] * cantidad if producto_id in precios else subtotal
+            services.marcar_carrito_modificado(db, carrito_id)
+        db.commit()
+        return {
+            carritos[carrito_id]: {producto_id: detalle.id for producto_id, detalle in detalles.items()}
+            for carrito_id, detalles in existentes.items()
+        }
+
+    def descartar(self, usuario_id):
+        with self._volcado, self._lock:
+            self._carritos.pop(usuario_id, None)
+            # Al releer el diario, lo anterior de este usuario ya no se aplica
+            self._anotar({"u": usuario_id, "descartar": True})
+
+    def recuperar(self, db):
+        """
+        Relee `.volcando` y el diario, en ese orden, y vuelca el estado final
+        de cada carrito. Se llama al arrancar, antes de atender solicitudes.
+        """
+        registros = []
+        for ruta in (self.ruta_volcando, self.ruta_diario):
+            if os.path.exists(ruta):
+                with open(ruta, encoding="utf-8") as archivo:
+                    for linea in archivo:
+                        try:
+                            registros.append(json.loads(linea))
+                        except ValueError:
+                            # Última línea a medio escribir cuando se cortó el proceso
+                            logger.warning("Registro inválido en el diario de carritos: %r", linea)
+        if not registros:
+            return 0
+
+        # usuario -> (carrito_id, vaciado, {producto_id: [cantidad, subtotal]})
+        pendientes: Dict[int, tuple] = {}
+        for registro in registros:
+            usuario = registro["u"]
+            if registro.get("descartar"):
+                pendientes.pop(usuario, None)
+                continue
+            carrito_id, vaciado, lineas = pendientes.get(usuario, (registro["c"], False, {}))
+            if registro.get("vaciar"):
+                pendientes[usuario] = (carrito_id, True, {})
+                continue
+            lineas[registro["p"]] = [registro["n"], registro["s"]]
+            pendientes[usuario] = (carrito_id, vaciado, lineas)
+
+        instantanea = {}
+        for usuario, (carrito_id, vaciado, cambios) in pendientes.items():
+            lineas = {} if vaciado else {
+                detalle.producto_id: [detalle.cantidad, detalle.subtotal]
+                for detalle in services.listar_detalles(db, carrito_id, limit=None)
+            }
+            for producto_id, (cantidad, subtotal) in cambios.items():
+                if cantidad > 0:
+                    lineas[producto_id] = [cantidad, subtotal]
+                else:
+                    lineas.pop(producto_id, None)
+            instantanea[usuario] = (carrito_id, lineas)
+
+        self._escribir(db, instantanea)
+        with self._lock:
+            if self._diario is not None:
+                self._diario.close()
+                self._diario = None
+            for ruta in (self.ruta_volcando, self.ruta_diario):
+                if os.path.exists(ruta):
+                    os.remove(ruta)
+        return len(instantanea)
+
+    def usuarios_en_memoria(self):
+        with self._lock:
+            return set(self._carritos)
+
+    def barrer_abandonados(self, db, dias=None):
+        # Mientras dura el barrido no se cargan carritos nuevos en memoria:
+        # la lista de excluidos no puede quedar vieja
+        with self._volcado:
+            return super().barrer_abandonados(db, dias)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "nombre": "carritos",
+                "almacen": "memoria",
+                "carritos": len(self._carritos),
+                "sucios": sum(1 for c in self._carritos.values() if c.sucio),
+                "operaciones": self.operaciones,
+                "volcados": self.volcados,
+                "cargas": self.cargas,
+            }
+
+
+def crear_almacen() -> AlmacenCarritos:
+    if CARRITO_STORE == "memoria":
+        return AlmacenCarritosMemoria(CARRITOS_DIARIO, CARRITOS_DIARIO_FSYNC, CARRITOS_INACTIVIDAD)
+    return AlmacenCarritosBD()
+
+
+# Almacén compartido por todo el proceso
+almacen_carritos = crear_almacen()
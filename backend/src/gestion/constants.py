@@ -6,4 +6,9 @@ class ErrorCode:
     CREDENCIALES_INCORRECTAS = "Credenciales incorrectas."
     ROL_NO_ENCONTRADO = "Rol no encontrado"
     TELEFONO_YA_REGISTRADO = "El teléfono ya se encuentra registrado."
-    NombreUsuarioYaRegistrado = "El nombre de usuario ya se encuentra registrado."
\ No newline at end of file
+    NombreUsuarioYaRegistrado = "El nombre de usuario ya se encuentra registrado."
+    CARRITO_VACIO = "El carrito está vacío o no existe."
+    STOCK_INSUFICIENTE = "Stock insuficiente para uno o más productos del pedido."
+    CLAVE_IDEMPOTENCIA_REUTILIZADA = "La clave de idempotencia ya se usó con otra solicitud."
+    SOLICITUD_IDEMPOTENTE_EN_CURSO = "Todavía se está procesando una solicitud con la misma clave de idempotencia."
+    PRODUCTO_NO_ENCONTRADO = "Uno o más productos no existen."
@@ -1,6 +1,6 @@
 from typing import Dict, Any, List, Union
 from src.gestion.constants import ErrorCode
-from src.exceptions import NotFound, BadRequest, PermissionDenied
+from src.exceptions import NotFound, BadRequest, PermissionDenied, UnprocessableEntity, Conflict
 
 class UsuarioNoEncontrado(NotFound):
     DETAIL = ErrorCode.USUARIO_NO_ENCONTRADO
@@ -24,4 +24,28 @@ class CredencialesIncorrectas(PermissionDenied):
     DETAIL = ErrorCode.CREDENCIALES_INCORRECTAS
 
 class RolNoEncontrado(NotFound):
-    DETAIL = ErrorCode.ROL_NO_ENCONTRADO
\ No newline at end of file
+    DETAIL = ErrorCode.ROL_NO_ENCONTRADO
+
+class CarritoVacio(BadRequest):
+    DETAIL = ErrorCode.CARRITO_VACIO
+
+class StockInsuficiente(BadRequest):
+    DETAIL = ErrorCode.STOCK_INSUFICIENTE
+
+    def __init__(self, productos: List[int]) -> None:
+        super().__init__()
+        # Se informan los productos que no alcanzan para que el cliente los ajuste
+        self.detail = {"mensaje": self.DETAIL, "productos": productos}
+
+class ProductoNoEncontrado(NotFound):
+    DETAIL = ErrorCode.PRODUCTO_NO_ENCONTRADO
+
+    def __init__(self, productos: List[int]) -> None:
+        super().__init__()
+        self.detail = {"mensaje": self.DETAIL, "productos": productos}
+
+class ClaveIdempotenciaReutilizada(UnprocessableEntity):
+    DETAIL = ErrorCode.CLAVE_IDEMPOTENCIA_REUTILIZADA
+
+class SolicitudIdempotenteEnCurso(Conflict):
+    DETAIL = ErrorCode.SOLICITUD_IDEMPOTENTE_EN_CURSO
@@ -1,5 +1,5 @@
 from typing import List, Optional
-from sqlalchemy import Column, Integer, Boolean, String, DateTime, Float, ForeignKey, Enum as SQLAlchemyEnum,DateTime, func
+from sqlalchemy import Column, Integer, Boolean, String, DateTime, Float, ForeignKey, Index, Enum as SQLAlchemyEnum,DateTime, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime, UTC
 from src.models import BaseModel
@@ -36,12 +36,22 @@ class MetodoPagoEnum(Enum):
     TRANSFERENCIA = "TRANSFERENCIA"
     EFECTIVO = "EFECTIVO"
 
+class EstadoCorreo(Enum):
+    PENDIENTE = "PENDIENTE"
+    ENVIADO = "ENVIADO"
+    FALLIDO = "FALLIDO"  # Agotó los reintentos; queda para revisión manual
+
+class EstadoIdempotencia(Enum):
+    EN_CURSO = "EN_CURSO"
+    COMPLETADA = "COMPLETADA"
+
 class TipoActividad(Enum):
     CREACION_USUARIO = "CREACION_USUARIO"
     CREACION_PRODUCTO = "CREACION_PRODUCTO"
     CREACION_ENVIO = "CREACION_ENVIO"
     CREACION_PAGO = "CREACION_PAGO"
     CREACION_PEDIDO = "CREACION_PEDIDO"
+    ACTUALIZACION_PEDIDO = "ACTUALIZACION_PEDIDO"
     
 class TipoDescuento(Enum):
     PORCENTAJE = "PORCENTAJE"
@@ -101,6 +111,10 @@ class Carrito(BaseModel):
     id = Column(Integer, primary_key=True, index=True)
     fecha_creacion: Mapped[datetime] = mapped_column(DateTime, default=now)
     estado: Mapped[EstadoCarrito] = mapped_column(SQLAlchemyEnum(EstadoCarrito), default=EstadoCarrito.PENDIENTE)
+    # Se incrementa con cada cambio en los detalles; identifica los totales cacheados
+    version: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # Último cambio en los detalles; el barrido de carritos abandonados se guía por esta fecha
+    fecha_actualizacion: Mapped[Optional[datetime]] = mapped_column(DateTime, default=now, index=True)
     
     usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)  # Clave foránea a Usuario
     usuario = relationship("Usuario", back_populates="carrito")  # Relación bidireccional
@@ -108,6 +122,10 @@ class Carrito(BaseModel):
     
 class CarritoDetalle(BaseModel): 
     __tablename__ = "carritodetalles"
+    # Una sola línea por producto en cada carrito: el pedido suma por producto
+    __table_args__ = (
+        Index("ux_carritodetalles_carrito_producto", "carrito_id", "producto_id", unique=True),
+    )
         
     id = Column(Integer, primary_key=True, index=True)
     cantidad: Mapped[int] = mapped_column(Integer)
@@ -127,18 +145,21 @@ class Producto(BaseModel):
     nombre: Mapped[str] = mapped_column(String, index=True)
     descripcion: Mapped[str] = mapped_column(String, index=True)
     precio: Mapped[float] = mapped_column(Float, index=True)
+    # Precio con el descuento vigente aplicado; lo mantienen los servicios y
+    # el programador de ventanas de descuento (ver recalcular_precios_finales)
+    precio_final: Mapped[Optional[float]] = mapped_column(Float, nullable=True, index=True)
     stock: Mapped[int] = mapped_column(Integer, index=True)
     imagen: Mapped[str] = mapped_column(String, index=True)
     costo_compra: Mapped[float] = mapped_column(Float, nullable=True, default=None)  # Nuevo campo
     peso: Mapped[float] = mapped_column(Float, nullable=True, default=None)  # Nuevo campo para peso
     volumen: Mapped[float] = mapped_column(Float, nullable=True, default=None)  # Nuevo campo para volumen
     costo_envio: Mapped[float] = mapped_column(Float, nullable=True, default=None)
-    subcategoria_id = Column(Integer, ForeignKey("subcategorias.id"), nullable=True)  # Añadimos esto
+    subcategoria_id = Column(Integer, ForeignKey("subcategorias.id"), nullable=True, index=True)  # Añadimos esto
     descuento_id = Column(Integer, ForeignKey("descuentos.id"), nullable=True)
 
     comentarios = relationship("Comentario", back_populates="producto")  # Asegúrate de usar back_populates
     carritoDetalle = relationship("CarritoDetalle", back_populates="producto")
-    categoria_id = Column(Integer, ForeignKey("categorias.id"), nullable=False)
+    categoria_id = Column(Integer, ForeignKey("categorias.id"), nullable=False, index=True)
     categoria = relationship("CategoriaProducto", back_populates="productos")
     pedidoDetalle = relationship("PedidoDetalle", back_populates="producto")
     descuento = relationship(
@@ -184,6 +205,7 @@ class Empresa(BaseModel):
 # MODELO ENVIO
 class Envio(BaseModel):
     __tablename__ = "envios"
+    __table_args__ = {"sqlite_autoincrement": True}  # ver Pedido
 
     id = Column(Integer, primary_key=True, index=True)
     direccion: Mapped[str] = mapped_column(String, index=True)
@@ -198,6 +220,9 @@ class Envio(BaseModel):
     
 class Pedido(BaseModel):
     __tablename__ = "pedidos"
+    # Sin reutilizar ids: los de pedidos archivados (ver PedidoArchivado) no
+    # pueden volver a aparecer en la tabla activa
+    __table_args__ = {"sqlite_autoincrement": True}
     
     id = Column(Integer, primary_key=True, index=True)
     fecha_creacion: Mapped[datetime] = mapped_column(DateTime, default=now)
@@ -213,6 +238,7 @@ class Pedido(BaseModel):
     
 class PedidoDetalle(BaseModel): 
     __tablename__ = "pedidodetalles"
+    __table_args__ = {"sqlite_autoincrement": True}  # ver Pedido
         
     id = Column(Integer, primary_key=True, index=True)
     cantidad: Mapped[int] = mapped_column(Integer)
@@ -228,6 +254,7 @@ class PedidoDetalle(BaseModel):
 
 class Pago(BaseModel):
     __tablename__ = "pagos"
+    __table_args__ = {"sqlite_autoincrement": True}  # ver Pedido
 
     id = Column(Integer, primary_key=True, index=True)
     fecha_creacion: Mapped[datetime] = mapped_column(DateTime, default=now)
@@ -302,4 +329,122 @@ class Comentario(BaseModel):
     usuario = relationship("Usuario", back_populates="comentarios")
     
     producto_id = Column(Integer, ForeignKey("productos.id"), nullable=False)
-    producto = relationship("Producto", back_populates="comentarios")  # Usamos back_populates
\ No newline at end of file
+    producto = relationship("Producto", back_populates="comentarios")  # Usamos back_populates
+
+class VersionTabla(BaseModel):
+    __tablename__ = "versiones_tablas"
+
+    # Se incrementa en cada escritura de la tabla; alimenta los ETag del catálogo
+    tabla: Mapped[str] = mapped_column(String, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+
+class CorreoPendiente(BaseModel):
+    __tablename__ = "correos_pendientes"
+
+    # Bandeja de salida: el correo se guarda en la misma transacción que lo
+    # origina y un worker lo envía después (ver gestion/tareas.py)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    destinatario: Mapped[str] = mapped_column(String, nullable=False)
+    asunto: Mapped[str] = mapped_column(String, nullable=False)
+    cuerpo: Mapped[str] = mapped_column(String, nullable=False)
+    estado: Mapped[EstadoCorreo] = mapped_column(SQLAlchemyEnum(EstadoCorreo), default=EstadoCorreo.PENDIENTE, index=True)
+    intentos: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    proximo_intento: Mapped[datetime] = mapped_column(DateTime, default=now, index=True)
+    ultimo_error: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    fecha_creacion: Mapped[datetime] = mapped_column(DateTime, default=now)
+    fecha_envio: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+
+class ClaveIdempotencia(BaseModel):
+    __tablename__ = "claves_idempotencia"
+
+    # Una fila por cada `Idempotency-Key` recibida en una ruta: guarda la
+    # huella de la solicitud y la respuesta para devolverla en los reintentos
+    alcance: Mapped[str] = mapped_column(String, primary_key=True)
+    clave: Mapped[str] = mapped_column(String, primary_key=True)
+    huella: Mapped[str] = mapped_column(String, nullable=False)
+    estado: Mapped[EstadoIdempotencia] = mapped_column(SQLAlchemyEnum(EstadoIdempotencia), default=EstadoIdempotencia.EN_CURSO)
+    codigo_estado: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    respuesta: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    fecha_creacion: Mapped[datetime] = mapped_column(DateTime, default=now, index=True)
+    fecha_completada: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+
+class ReservaStock(BaseModel):
+    __tablename__ = "reservas_stock"
+
+    # Stock apartado entre la preferencia de pago y la creación del pedido.
+    # No descuenta `Producto.stock`: las reservas vigentes de otros usuarios se
+    # restan al verificar disponibilidad y vencen solas pasado `vence`
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    producto_id: Mapped[int] = mapped_column(Integer, ForeignKey("productos.id"), index=True, nullable=False)
+    usuario_id: Mapped[int] = mapped_column(Integer, ForeignKey("usuarios.id"), index=True, nullable=False)
+    cantidad: Mapped[int] = mapped_column(Integer, nullable=False)
+    vence: Mapped[datetime] = mapped_column(DateTime, index=True, nullable=False)
+    fecha_creacion: Mapped[datetime] = mapped_column(DateTime, default=now)
+
+
+class CarritosAbandonados(BaseModel):
+    __tablename__ = "carritos_abandonados"
+
+    # Lo que se llevó cada lote del barrido de carritos abandonados; los
+    # carritos se borran, así que los reportes salen de esta tabla
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    fecha: Mapped[datetime] = mapped_column(DateTime, default=now, index=True)
+    carritos: Mapped[int] = mapped_column(Integer, default=0)
+    carritos_con_productos: Mapped[int] = mapped_column(Integer, default=0)
+    lineas: Mapped[int] = mapped_column(Integer, default=0)
+    unidades: Mapped[int] = mapped_column(Integer, default=0)
+    valor: Mapped[float] = mapped_column(Float, default=0)
+
+
+# Archivo de pedidos: los pedidos terminados más viejos que el horizonte
+# configurado se mueven acá (ver services.archivar_pedidos) para que las
+# tablas e índices que usa la operación diaria se mantengan chicos. Las
+# columnas copian las de las tablas originales, sin claves foráneas.
+class PedidoArchivado(BaseModel):
+    __tablename__ = "pedidos_archivados"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    fecha_creacion: Mapped[datetime] = mapped_column(DateTime, index=True)
+    total: Mapped[float] = mapped_column(Float)
+    estado: Mapped[EstadoPedido] = mapped_column(SQLAlchemyEnum(EstadoPedido))
+    usuario_id: Mapped[int] = mapped_column(Integer, index=True)
+    fecha_archivado: Mapped[datetime] = mapped_column(DateTime, default=now)
+
+
+class PedidoDetalleArchivado(BaseModel):
+    __tablename__ = "pedidodetalles_archivados"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    cantidad: Mapped[int] = mapped_column(Integer)
+    subtotal: Mapped[float] = mapped_column(Float)
+    precio_unitario: Mapped[float] = mapped_column(Float)
+    pedido_id: Mapped[int] = mapped_column(Integer, index=True)
+    producto_id: Mapped[int] = mapped_column(Integer, index=True)
+    fecha_archivado: Mapped[datetime] = mapped_column(DateTime, default=now)
+
+
+class EnvioArchivado(BaseModel):
+    __tablename__ = "envios_archivados"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    direccion: Mapped[str] = mapped_column(String)
+    empresa_id: Mapped[int] = mapped_column(Integer)
+    codigoSeguimiento: Mapped[str] = mapped_column(String)
+    estado: Mapped[EstadoEnvio] = mapped_column(SQLAlchemyEnum(EstadoEnvio))
+    pedido_id: Mapped[int] = mapped_column(Integer, index=True)
+    fecha_archivado: Mapped[datetime] = mapped_column(DateTime, default=now)
+
+
+class PagoArchivado(BaseModel):
+    __tablename__ = "pagos_archivados"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    fecha_creacion: Mapped[datetime] = mapped_column(DateTime)
+    monto: Mapped[float] = mapped_column(Float)
+    estado: Mapped[EstadoPago] = mapped_column(SQLAlchemyEnum(EstadoPago))
+    pedido_id: Mapped[int] = mapped_column(Integer, index=True)
+    metodoPago_id: Mapped[int] = mapped_column(Integer)
+    fecha_archivado: Mapped[datetime] = mapped_column(DateTime, default=now)
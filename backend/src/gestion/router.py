@@ -1,16 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status, Form, File, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Form, File, UploadFile, Request, Response, Header
 from sqlalchemy.orm import Session
-from src.database import get_db
-from src.gestion import schemas, services, models
-from src.auth.dependencies import get_current_user
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database import get_db, get_async_db
+from src.gestion import schemas, services, services_async, models
+from src.gestion.almacen_carritos import almacen_carritos
+from src.auth.dependencies import get_current_user, get_current_user_async, get_current_admin
 from typing import List, Optional
 from datetime import datetime
 from src.gestion.models import MetodoPagoEnum
+from src.utils.etag import calcular_etag, coincide_etag
 import os
 import requests
 
 router = APIRouter()
 
+# ============================================================
+# Respuestas condicionales del catálogo
+# ============================================================
+def respuesta_no_modificada(request: Request, response: Response, versiones: dict) -> Optional[Response]:
+    """
+    Calcula el ETag de la respuesta a partir de la ruta, los parámetros y la
+    versión de las tablas de las que depende. Si el cliente ya lo tiene se
+    devuelve un 304 sin cuerpo, antes de consultar los datos.
+    """
+    etag = calcular_etag(
+        request.url.path,
+        sorted(request.query_params.multi_items()),
+        versiones
+    )
+    encabezados = {"ETag": etag, "Cache-Control": "no-cache"}
+    if coincide_etag(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=encabezados)
+    response.headers.update(encabezados)
+    return None
 
 
 # ============================================================
@@ -36,8 +58,8 @@ def registrar(usuario: schemas.UsuarioCreate, db: Session = Depends(get_db)):
 # ============================================================
 
 @router.post("/login", response_model=schemas.Token)
-def login(request: schemas.LoginRequest, db: Session = Depends(get_db)):
-    token = services.autenticar_usuario(db, request.nombreUsuario, request.password)
+async def login(request: schemas.LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    token = await services_async.autenticar_usuario(db, request.nombreUsuario, request.password)
     return {"access_token": token, "token_type": "bearer"}
 
 # Ruta para USUARIO
@@ -61,8 +83,8 @@ def obtener_usuario(usuario_id: int, db: Session = Depends(get_db)):
 # ============================================================
 
 @router.get("/usuarios")
-def listar_usuarios(pagina: int = 1, tamanio: int = 10, db: Session = Depends(get_db)):
-    return services.listar_usuarios(db, pagina, tamanio)
+def listar_usuarios(pagina: int = 1, tamanio: int = 10, after: Optional[str] = None, total: str = Query("exact", enum=["exact", "estimate"]), db: Session = Depends(get_db)):
+    return services.listar_usuarios(db, pagina, tamanio, after, total)
 
 # ============================================================
 # Ruta para actualizar usuario
@@ -154,9 +176,12 @@ def crear_categoria(
 # Ruta para listar categorias
 # ============================================================
 @router.get("/categorias")
-def listar_categorias(pagina: int = 1, tamanio: int = 3, db: Session = Depends(get_db)):
-    
-    return services.listar_categorias(db, pagina, tamanio)
+def listar_categorias(request: Request, response: Response, pagina: int = 1, tamanio: int = 3, after: Optional[str] = None, db: Session = Depends(get_db)):
+    versiones = services.obtener_versiones(db, "categorias")
+    no_modificada = respuesta_no_modificada(request, response, versiones)
+    if no_modificada:
+        return no_modificada
+    return services.listar_categorias(db, pagina, tamanio, after, versiones)
 
 # ============================================================
 # Ruta para obtener categoria por id
@@ -200,12 +225,19 @@ def crear_subcategoria(categoria_id: int, subcategoria: schemas.SubCategoriaBase
 # ============================================================
 @router.get("/subcategorias")
 def listar_subcategorias(
+    request: Request,
+    response: Response,
     pagina: int = 1,
     tamanio: int = 10,
     categoria_id: Optional[int] = None,
+    after: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    return services.listar_subcategorias(db, pagina, tamanio, categoria_id)
+    versiones = services.obtener_versiones(db, "subcategorias")
+    no_modificada = respuesta_no_modificada(request, response, versiones)
+    if no_modificada:
+        return no_modificada
+    return services.listar_subcategorias(db, pagina, tamanio, categoria_id, after, versiones)
 
 # ============================================================
 # Ruta para obtener una subcategoría por ID
@@ -267,6 +299,34 @@ def crear_producto(
         print.error(f"Error al procesar la creación: {str(e)}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
+# ============================================================
+# Ruta para importar productos en masa desde CSV o JSONL
+# ============================================================
+@router.post("/productos/importar", response_model=schemas.ImportacionProductosResponse)
+def importar_productos(
+    archivo: UploadFile = File(..., description="Archivo CSV o JSONL con una fila por producto"),
+    formato: Optional[str] = Query(None, enum=["csv", "jsonl"], description="Por defecto se deduce de la extensión"),
+    usuario_id: int = Form(..., description="ID del usuario que importa"),
+    db: Session = Depends(get_db)
+):
+    """
+    Las columnas son las de un producto nuevo (nombre, descripcion, precio,
+    stock, categoria_id, imagen como URL y los campos opcionales). Devuelve
+    cuántas filas se importaron y los errores de cada fila rechazada.
+    """
+    if formato is None:
+        formato = "jsonl" if (archivo.filename or "").lower().endswith((".jsonl", ".ndjson")) else "csv"
+    resultado = services.importar_productos(db, archivo.file, formato)
+
+    if resultado["importados"]:
+        services.registrar_actividad(db, schemas.ActividadCreate(
+            tipo_evento="CREACION_PRODUCTO",
+            descripcion=f"Se importaron {resultado['importados']} productos desde {archivo.filename}",
+            usuario_id=usuario_id
+        ))
+
+    return resultado
+
 
 @router.put("/productos/{producto_id}", response_model=schemas.Producto)
 def actualizar_producto(
@@ -303,16 +363,37 @@ def actualizar_producto(
 # ============================================================
 
 @router.get("/productos")
-def listar_productos(pagina: int = 1, tamanio: int = 10, categoria_id:Optional[int] = None, db: Session = Depends(get_db)):
-    return services.listar_productos(db, pagina, tamanio, categoria_id)
+async def listar_productos(
+    request: Request,
+    response: Response,
+    pagina: int = 1,
+    tamanio: int = 10,
+    categoria_id: Optional[int] = None,
+    after: Optional[str] = None,
+    q: Optional[str] = Query(None, description="Texto a buscar en el nombre"),
+    subcategoria_id: Optional[int] = None,
+    precio_min: Optional[float] = Query(None, ge=0),
+    precio_max: Optional[float] = Query(None, ge=0),
+    ordenar_por: Optional[str] = Query(None, enum=["precio-bajo", "precio-alto", "descuento"]),
+    db: AsyncSession = Depends(get_async_db)
+):
+    versiones = await services_async.obtener_versiones(db, "productos", "descuentos")
+    no_modificada = respuesta_no_modificada(request, response, versiones)
+    if no_modificada:
+        return no_modificada
+    return await services_async.listar_productos(
+        db, pagina, tamanio, categoria_id, after,
+        q=q, subcategoria_id=subcategoria_id, precio_min=precio_min,
+        precio_max=precio_max, ordenar_por=ordenar_por
+    )
 
 
 # ============================================================
 # Ruta para listar productos con descuento
 # ============================================================
 @router.get("/productos/descuento")
-def obtener_productos_descuento(pagina: int = 1, tamanio: int = 10, db: Session = Depends(get_db)):
-    return services.obtener_productos_descuento(db, pagina, tamanio)
+def obtener_productos_descuento(pagina: int = 1, tamanio: int = 10, after: Optional[str] = None, db: Session = Depends(get_db)):
+    return services.obtener_productos_descuento(db, pagina, tamanio, after)
 
 # ============================================================
 # Ruta para verificar si un nombre de producto ya existe
@@ -324,13 +405,28 @@ def verificar_nombre_producto(
 ):
     existe = services.verificar_nombre_producto(db, nombre)
     return {"existe": existe}
+
+# ============================================================
+# Ruta para buscar productos por texto completo
+# ============================================================
+@router.get("/productos/buscar", response_model=schemas.ProductoBusquedaResponse)
+async def buscar_productos(
+    q: str = Query(..., min_length=1, description="Texto a buscar en nombre y descripción"),
+    limite: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await services_async.buscar_productos(db, q, limite)
 # ============================================================
 # Ruta para obtener los productos por ID
 # ============================================================
 
 @router.get("/productos/{producto_id}", response_model=schemas.ProductoOut)
-def obtener_producto(producto_id: int, db: Session = Depends(get_db)):
-    return services.obtener_producto_por_id(db, producto_id)
+async def obtener_producto(request: Request, response: Response, producto_id: int, db: AsyncSession = Depends(get_async_db)):
+    versiones = await services_async.obtener_versiones(db, "productos", "descuentos")
+    no_modificada = respuesta_no_modificada(request, response, versiones)
+    if no_modificada:
+        return no_modificada
+    return await services_async.obtener_producto_cacheado(db, producto_id, versiones)
 
 # ============================================================
 # Ruta para eliminar productos
@@ -365,8 +461,8 @@ def crear_envio(usuario_id: int, envio: schemas.EnvioCreate, db: Session = Depen
 # Ruta para listar envios
 # ============================================================
 @router.get("/envios")
-def listar_envios(pagina: int = 1, tamanio: int = 10, db: Session = Depends(get_db)):
-    return services.listar_envios(db, pagina, tamanio)
+def listar_envios(pagina: int = 1, tamanio: int = 10, after: Optional[str] = None, total: str = Query("exact", enum=["exact", "estimate"]), db: Session = Depends(get_db)):
+    return services.listar_envios(db, pagina, tamanio, after, total)
 
 # ============================================================
 # Ruta para obtener los envios por ID
@@ -407,8 +503,8 @@ def crear_empresa(
 # Listar todas las empresas
 # ============================================================
 @router.get("/empresas")
-def listar_empresas(pagina: int = 1, tamanio: int = 10, db: Session = Depends(get_db)):
-    return services.listar_empresas(db, pagina, tamanio)
+def listar_empresas(pagina: int = 1, tamanio: int = 10, after: Optional[str] = None, db: Session = Depends(get_db)):
+    return services.listar_empresas(db, pagina, tamanio, after)
 
 # ============================================================
 # Obtener una empresa por ID
@@ -463,8 +559,8 @@ def crear_pago(usuario_id: int ,pago: schemas.PagoBase, db: Session = Depends(ge
 # Ruta para listar todos los pagos
 # ============================================================
 @router.get("/pagos")
-def listar_pagos(pagina: int = 1, tamanio: int = 10,db: Session = Depends(get_db)):
-    return services.listar_pagos(db, pagina, tamanio)
+def listar_pagos(pagina: int = 1, tamanio: int = 10, after: Optional[str] = None, total: str = Query("exact", enum=["exact", "estimate"]), db: Session = Depends(get_db)):
+    return services.listar_pagos(db, pagina, tamanio, after, total)
 
 # ============================================================
 # Ruta para obtener los pagos por ID
@@ -502,8 +598,8 @@ def crear_metodo_pago(
 # Ruta para listar todos los métodos de pago
 # ============================================================
 @router.get("/metodos-pago")
-def listar_metodos_pago(pagina: int = 1, tamanio: int = 10, db: Session = Depends(get_db)):
-    return services.listar_metodos_pago(db, pagina, tamanio)
+def listar_metodos_pago(pagina: int = 1, tamanio: int = 10, after: Optional[str] = None, db: Session = Depends(get_db)):
+    return services.listar_metodos_pago(db, pagina, tamanio, after)
 
 # ============================================================
 # Ruta para obtener un método de pago por ID
@@ -540,28 +636,75 @@ def actualizar_metodo_pago(
 # Ruta para crear pedido
 # ============================================================
 @router.post("/pedidos", response_model=schemas.Pedido, status_code=status.HTTP_201_CREATED)
-def crear_pedido(pedido: schemas.PedidoCreate, db: Session = Depends(get_db)):
-    print("Datos recibidos:", pedido.dict())
-    nuevo_pedido = services.crear_pedido(db, pedido)
-    usuario_id = pedido.usuario_id
-    services.registrar_actividad(db, schemas.ActividadCreate(
-        tipo_evento="CREACION_PEDIDO",
-        descripcion=f"Se registro pedido asociado al usuari identificado con el numero: {nuevo_pedido.usuario_id}",
-        referencia_id=nuevo_pedido.id,
-        usuario_id=usuario_id
-    ))
+async def crear_pedido(
+    pedido: schemas.PedidoCreate,
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    async def registrar(guardar=None):
+        # La respuesta idempotente se guarda en la misma transacción que el pedido
+        al_confirmar = None
+        if guardar:
+            al_confirmar = lambda sesion, nuevo: guardar(sesion, schemas.Pedido.model_validate(nuevo))
+        nuevo_pedido = await services_async.crear_pedido(db, pedido, al_confirmar)
+        usuario_id = pedido.usuario_id
+        await services_async.registrar_actividad(db, schemas.ActividadCreate(
+            tipo_evento="CREACION_PEDIDO",
+            descripcion=f"Se registro pedido asociado al usuari identificado con el numero: {nuevo_pedido.usuario_id}",
+            referencia_id=nuevo_pedido.id,
+            usuario_id=usuario_id
+        ))
+        return schemas.Pedido.model_validate(nuevo_pedido)
+
+    # Con la cabecera, un doble click o un reintento del cliente no crea otro pedido
+    if not idempotency_key:
+        return await registrar()
+    return await services_async.ejecutar_idempotente(
+        idempotency_key, "POST /pedidos", pedido.model_dump(mode="json"), registrar, status.HTTP_201_CREATED
+    )
+
+# ============================================================
+# Ruta para cambiar el estado de varios pedidos a la vez
+# ============================================================
+@router.post("/pedidos/estado-masivo", response_model=schemas.PedidosEstadoMasivoResponse)
+def actualizar_estado_pedidos(
+    cambio: schemas.PedidosEstadoMasivo,
+    db: Session = Depends(get_db),
+    current_user: schemas.Usuario = Depends(get_current_user)
+):
+    """
+    Cambia el estado de una lista de pedidos en una sola operación. Los
+    pedidos que no admiten la transición se informan en el resultado sin
+    frenar al resto.
+    """
+    return services.actualizar_estado_pedidos(db, cambio.pedido_ids, cambio.estado, current_user.id)
 
-    return nuevo_pedido
+# ============================================================
+# Ruta para archivar los pedidos terminados más viejos
+# ============================================================
+@router.post("/pedidos/archivar")
+def archivar_pedidos(
+    dias: Optional[int] = Query(None, ge=1, description="Antigüedad mínima; por defecto PEDIDOS_ARCHIVO_DIAS"),
+    db: Session = Depends(get_db),
+    current_user: schemas.Usuario = Depends(get_current_user)
+):
+    """
+    Mueve al archivo los pedidos entregados o cancelados más viejos que `dias`.
+    La misma tarea corre sola una vez por día; los reportes leen ambas tablas.
+    """
+    return {"archivados": services.archivar_pedidos(db, dias)}
 
 # ============================================================
 # Ruta para listar todos los pedidos
 # ============================================================
 @router.get("/pedidos")
-def listar_pedidos(pagina: int = 1, tamanio: int = 3, db: Session = Depends(get_db)):
+def listar_pedidos(pagina: int = 1, tamanio: int = 3, after: Optional[str] = None, total: str = Query("exact", enum=["exact", "estimate"]), db: Session = Depends(get_db)):
     """
     Retorna la lista de todos los pedidos.
+    Con `after` se pagina por cursor en lugar de por número de página y con
+    `total=estimate` el total sale de la estimación del motor.
     """
-    return services.listar_pedidos(db, pagina, tamanio)
+    return services.listar_pedidos(db, pagina, tamanio, after, total)
 
 # ============================================================
 # Ruta para obtener un pedido por su ID
@@ -569,9 +712,9 @@ def listar_pedidos(pagina: int = 1, tamanio: int = 3, db: Session = Depends(get_
 @router.get("/pedidos/{pedido_id}", response_model=schemas.Pedido)
 def obtener_pedido(pedido_id: int, db: Session = Depends(get_db)):
     """
-    Retorna los detalles de un pedido en particular.
+    Retorna los detalles de un pedido en particular, aunque esté archivado.
     """
-    pedido = services.obtener_pedido_por_id(db, pedido_id)
+    pedido = services.obtener_pedido_historico(db, pedido_id)
     return pedido
 
 # ============================================================
@@ -586,6 +729,25 @@ def obtener_pedidos_por_usuario(usuario_id: int, db: Session = Depends(get_db)):
     pedidos = services.obtener_pedidos_por_usuario(db, usuario_id)
     return pedidos
 
+# ============================================================
+# Ruta obtener el historial de pedidos de un usuario con sus detalles
+# ============================================================
+
+@router.get("/pedidos/usuario/{usuario_id}/completo", response_model=schemas.PedidoCompletoListResponse)
+def obtener_pedidos_completos_por_usuario(
+    usuario_id: int,
+    pagina: int = 1,
+    tamanio: int = 10,
+    after: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Retorna los pedidos del usuario, incluidos los archivados, con sus
+    detalles, el nombre e imagen de cada producto y el estado de los envíos
+    en una sola respuesta.
+    """
+    return services.listar_pedidos_completos_usuario(db, usuario_id, pagina, tamanio, after)
+
 # ============================================================
 # Ruta para actualizar un pedido existente
 # ============================================================
@@ -713,76 +875,115 @@ def agregar_detalle_a_pedido(pedido_id: int, detalle: schemas.PedidoDetalleBase,
 # Obtener el carrito del usuario autenticado (o crearlo si no existe)
 # ============================================================
 @router.get("/carritos", response_model=schemas.Carrito)
-def obtener_carrito(
-    current_user: schemas.Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def obtener_carrito(
+    current_user: schemas.Usuario = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    return services.obtener_carrito_o_crear(db, current_user.id)
+    return await services_async.obtener_carrito_o_crear(db, current_user.id)
 
 # ============================================================
 # Agregar un producto al carrito (fusionando carritos de sesión si es necesario)
 # ============================================================
 @router.post("/carritos/productos", response_model=schemas.CarritoDetalle, status_code=status.HTTP_201_CREATED)
-def agregar_producto_al_carrito(
+async def agregar_producto_al_carrito(
     detalle_data: schemas.CarritoDetalleBase,
     producto_id: int = Query(..., description="ID del producto a agregar"),
-    current_user: schemas.Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: schemas.Usuario = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    carrito = services.obtener_carrito_o_crear(db, current_user.id)
-    detalle = services.agregar_producto_al_carrito(db, carrito.id, producto_id, detalle_data)
-    return detalle
+    return await services_async.agregar_al_carrito(db, current_user.id, producto_id, detalle_data.cantidad)
 
 # ============================================================
 # Actualizar cantidad de un producto en el carrito
 # ============================================================
 @router.patch("/carritos/productos/{producto_id}", response_model=schemas.CarritoDetalle)
-def actualizar_cantidad_producto(
+async def actualizar_cantidad_producto(
     producto_id: int,
     nueva_cantidad: int = Query(..., description="Nueva cantidad para el producto"),
-    current_user: schemas.Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: schemas.Usuario = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    carrito = services.obtener_carrito_o_crear(db, current_user.id)
-    detalle = services.actualizar_cantidad_producto(db, carrito.id, producto_id, nueva_cantidad)
-    return detalle
+    return await services_async.actualizar_cantidad_en_carrito(db, current_user.id, producto_id, nueva_cantidad)
 
 # ============================================================
 # Eliminar un producto del carrito
 # ============================================================
 @router.delete("/carritos/productos/{producto_id}", status_code=status.HTTP_204_NO_CONTENT)
-def eliminar_producto_del_carrito(
+async def eliminar_producto_del_carrito(
     producto_id: int,
-    current_user: schemas.Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: schemas.Usuario = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    carrito = services.obtener_carrito_o_crear(db, current_user.id)
-    services.eliminar_producto_del_carrito(db, carrito.id, producto_id)
+    await services_async.eliminar_del_carrito(db, current_user.id, producto_id)
     return {"detail": "Producto eliminado del carrito"}
 
+# ============================================================
+# Aplicar varias operaciones al carrito en una sola solicitud
+# ============================================================
+@router.post("/carritos/operaciones", response_model=List[schemas.CarritoDetalle])
+async def aplicar_operaciones_carrito(
+    datos: schemas.OperacionesCarrito,
+    current_user: schemas.Usuario = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Agrega, actualiza o quita varios productos en una transacción (por
+    ejemplo, el carrito de invitado al iniciar sesión) y devuelve el carrito.
+    """
+    return await services_async.aplicar_operaciones_carrito(db, current_user.id, datos.operaciones)
+
 # ============================================================
 # Listar detalles del carrito del usuario autenticado
 # ============================================================
 @router.get("/carritos/detalles", response_model=List[schemas.CarritoDetalle])
-def listar_detalles(
-    current_user: schemas.Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def listar_detalles(
+    current_user: schemas.Usuario = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await services_async.listar_carrito(db, current_user.id)
+
+# ============================================================
+# Totales del carrito calculados por el servidor
+# ============================================================
+@router.get("/carritos/totales", response_model=schemas.TotalesCarrito)
+async def obtener_totales_carrito(
+    current_user: schemas.Usuario = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Subtotal, descuento, envío y total del carrito con los precios vigentes.
+    Es el mismo cálculo que usan el pedido y la preferencia de pago.
+    """
+    await services_async.volcar_carrito(db, current_user.id)
+    carrito = await services_async.obtener_carrito_o_crear(db, current_user.id)
+    return await services_async.calcular_totales_carrito(db, carrito.id)
+
+# ============================================================
+# Resumen del carrito: líneas con datos del producto y totales
+# ============================================================
+@router.get("/carritos/resumen", response_model=schemas.ResumenCarrito)
+async def obtener_resumen_carrito(
+    current_user: schemas.Usuario = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    carrito = services.obtener_carrito_o_crear(db, current_user.id)
-    return services.listar_detalles(db, carrito.id)
+    """
+    Todo lo necesario para mostrar el carrito en una sola respuesta: cada línea
+    con el nombre, la imagen, el precio vigente y el stock del producto, más
+    subtotal, descuento, envío y total.
+    """
+    await services_async.volcar_carrito(db, current_user.id)
+    carrito = await services_async.obtener_carrito_o_crear(db, current_user.id)
+    return await services_async.obtener_resumen_carrito(db, carrito.id)
 
 # ----------------------------------------------------
 # Vaciar Carrito
 # ----------------------------------------------------
 @router.delete("/carritos/vaciar", status_code=status.HTTP_204_NO_CONTENT)
-def vaciar_carrito(
-    current_user: schemas.Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def vaciar_carrito(
+    current_user: schemas.Usuario = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    carrito = services.obtener_carrito_por_usuario(db, current_user.id)
-    if not carrito:
-        raise HTTPException(status_code=404, detail="Carrito no encontrado")
-    services.vaciar_carrito(db, carrito.id)
+    await services_async.vaciar_carrito(db, current_user.id)
     return {"detail": "Carrito vaciado"}
 
 #ACTIVIDADES
@@ -800,8 +1001,52 @@ def registrar_actividad_api(
 # Obtener actividades recientes
 # ============================================================
 @router.get("/actividades")
-def listar_actividades(pagina: int = 1, tamanio: int = 10, db: Session = Depends(get_db)):
-    return services.listar_actividades(db, pagina, tamanio)
+def listar_actividades(pagina: int = 1, tamanio: int = 10, after: Optional[str] = None, total: str = Query("exact", enum=["exact", "estimate"]), db: Session = Depends(get_db)):
+    return services.listar_actividades(db, pagina, tamanio, after, total)
+
+# ============================================================
+# Bandeja de salida de correos
+# ============================================================
+@router.get("/correos")
+def listar_correos(
+    pagina: int = 1,
+    tamanio: int = 10,
+    estado: Optional[schemas.EstadoCorreoEnum] = None,
+    after: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: schemas.Usuario = Depends(get_current_admin)
+):
+    """
+    Lista los correos de la bandeja de salida. Con `estado=FALLIDO` se ven
+    los que agotaron sus reintentos.
+    """
+    return services.listar_correos(db, pagina, tamanio, models.EstadoCorreo(estado.value) if estado else None, after)
+
+@router.get("/correos/estadisticas")
+def obtener_estadisticas_correo(current_user: schemas.Usuario = Depends(get_current_admin)):
+    """
+    Contadores del pool SMTP de este proceso: conexiones, reconexiones,
+    enviados, fallidos y ritmo de envío.
+    """
+    return services.enviador.estadisticas()
+
+@router.post("/correos/{correo_id}/reintentar", response_model=schemas.CorreoPendiente)
+def reintentar_correo(
+    correo_id: int,
+    db: Session = Depends(get_db),
+    current_user: schemas.Usuario = Depends(get_current_admin)
+):
+    return services.reintentar_correo(db, correo_id)
+
+# ============================================================
+# Estadísticas de las caches en memoria
+# ============================================================
+@router.get("/cache/estadisticas")
+def obtener_estadisticas_cache():
+    """
+    Devuelve aciertos, fallos, desalojos e invalidaciones de cada cache.
+    """
+    return services.estadisticas_cache() + [almacen_carritos.estadisticas()]
 
 # ============================================================
 # Obtener Reportes
@@ -874,6 +1119,34 @@ def obtener_metricas_cancelaciones(
     """
     return services.calcular_metricas_cancelaciones(db, meses_historial)
 
+# ============================================================
+# Carritos abandonados
+# ============================================================
+@router.get("/reportes/carritos-abandonados", response_model=schemas.CarritosAbandonadosResponse)
+def obtener_carritos_abandonados(
+    dias: int = Query(30, ge=1, le=365),
+    db: Session = Depends(get_db),
+    current_user: schemas.Usuario = Depends(get_current_user)
+):
+    """
+    Carritos que el barrido borró por inactividad en los últimos `dias`,
+    con la cantidad de productos y el valor que tenían
+    """
+    return services.reporte_carritos_abandonados(db, dias)
+
+@router.post("/carritos/barrer-abandonados")
+def barrer_carritos_abandonados(
+    dias: Optional[int] = Query(None, ge=1, description="Inactividad mínima; por defecto CARRITOS_ABANDONO_DIAS"),
+    db: Session = Depends(get_db),
+    current_user: schemas.Usuario = Depends(get_current_user)
+):
+    """
+    Borra los carritos pendientes sin cambios hace más de `dias`.
+    La misma tarea corre sola una vez por hora.
+    """
+    borrados = almacen_carritos.barrer_abandonados(db, dias)
+    return {"borrados": borrados}
+
 
 
 # ============================================================
@@ -916,8 +1189,8 @@ def crear_descuento(
 # Listar Descuentos
 # ============================================================
 @router.get("/descuentos")
-def listar_descuentos(pagina: int = 1, tamanio: int = 10, db: Session = Depends(get_db)):
-    return services.listar_descuentos(db=db, pagina=pagina, tamanio=tamanio)
+def listar_descuentos(pagina: int = 1, tamanio: int = 10, after: Optional[str] = None, db: Session = Depends(get_db)):
+    return services.listar_descuentos(db=db, pagina=pagina, tamanio=tamanio, after=after)
 
 
 
@@ -989,11 +1262,11 @@ def eliminar_descuento(descuento_id: int, db: Session = Depends(get_db)):
 
 
 @router.get("/productos/descuento", response_model=schemas.ProductoListResponse)
-def get_productos_descuento(pagina: int = 1, tamanio: int = 10, db: Session = Depends(get_db)):
+def get_productos_descuento(pagina: int = 1, tamanio: int = 10, after: Optional[str] = None, db: Session = Depends(get_db)):
     """
     Obtiene los productos que tienen descuento, incluyendo la información completa del descuento.
     """
-    return services.obtener_productos_descuento(db=db, pagina=pagina, tamanio=tamanio)
+    return services.obtener_productos_descuento(db=db, pagina=pagina, tamanio=tamanio, after=after)
 
 # ============================================================
 # Ruta para crear una dirección de envío
@@ -36,6 +36,14 @@ class EstadoPagoEnum(str, Enum):
     APROBADO = "APROBADO"
     RECHAZADO = "RECHAZADO"
 
+# ============================================================
+# Estado de un correo de la bandeja de salida
+# ============================================================
+class EstadoCorreoEnum(str, Enum):
+    PENDIENTE = "PENDIENTE"
+    ENVIADO = "ENVIADO"
+    FALLIDO = "FALLIDO"
+
 # ============================================================
 # Metodo de pago
 # ============================================================
@@ -228,6 +236,7 @@ class Producto(ProductoBase):
     id: int = Field(..., example=1)
     codigo: str = Field(..., example="PROD-001")
     categoria_id: int
+    precio_final: Optional[float] = Field(None, example=1080.45)  # Con el descuento vigente
 
     class Config:
         from_attributes = True
@@ -245,6 +254,26 @@ class ProductoOut(Producto):
 # Esquema para respuesta con paginación (lista de productos)
 # ============================================================
 class ProductoListResponse(BaseModel):
+    total: Optional[int] = None  # No se calcula en modo cursor
+    productos: List[ProductoOut]
+    next_cursor: Optional[str] = None
+
+# ============================================================
+# Esquemas para el resultado de la importación masiva
+# ============================================================
+class ErrorImportacion(BaseModel):
+    fila: int
+    errores: List[str]
+
+class ImportacionProductosResponse(BaseModel):
+    filas: int
+    importados: int  # Las filas con errores no se importan
+    errores: List[ErrorImportacion]
+
+# ============================================================
+# Esquema para respuesta de búsqueda (ordenada por relevancia)
+# ============================================================
+class ProductoBusquedaResponse(BaseModel):
     total: int
     productos: List[ProductoOut]
     
@@ -317,6 +346,58 @@ class CarritoDetalle(CarritoDetalleBase):
     class Config:
         from_attributes = True
 
+# Operaciones en lote sobre el carrito (por ejemplo, al pasar el carrito de invitado al iniciar sesión)
+class TipoOperacionCarrito(str, Enum):
+    AGREGAR = "agregar"          # suma la cantidad a la línea
+    ACTUALIZAR = "actualizar"    # fija la cantidad; 0 quita la línea
+    ELIMINAR = "eliminar"
+
+class OperacionCarrito(BaseModel):
+    tipo: TipoOperacionCarrito
+    producto_id: int = Field(..., example=1)
+    cantidad: int = Field(0, ge=0, example=2)
+
+    # always: sin cantidad, agregar quedaría con el 0 por defecto y no haría nada
+    @validator('cantidad', always=True)
+    def validar_cantidad(cls, value, values):
+        if values.get('tipo') == TipoOperacionCarrito.AGREGAR and value < 1:
+            raise ValueError('Para agregar, la cantidad debe ser al menos 1')
+        return value
+
+class OperacionesCarrito(BaseModel):
+    operaciones: List[OperacionCarrito] = Field(..., min_length=1, max_length=200)
+
+# ============================================================
+# Esquema para los totales calculados del carrito
+# ============================================================
+class TotalesCarrito(BaseModel):
+    carrito_id: int
+    lineas: int
+    unidades: int
+    subtotal_lista: float
+    descuento: float
+    subtotal: float
+    envio: float
+    total: float
+
+# ============================================================
+# Esquemas para el resumen del carrito (líneas con datos del producto)
+# ============================================================
+class LineaCarrito(BaseModel):
+    detalle_id: int
+    producto_id: int
+    nombre: str
+    imagen: Optional[str] = None
+    cantidad: int
+    precio: float
+    precio_final: float
+    subtotal: float
+    stock: int
+
+class ResumenCarrito(BaseModel):
+    items: List[LineaCarrito]
+    totales: TotalesCarrito
+
 # Pedido
 #------------------------------------------------------------------------------------------
 # ============================================================
@@ -338,11 +419,30 @@ class PedidoEstadoUpdate(BaseModel):
     id: int
     estado: EstadoPedidoEnum
         
+# ============================================================
+# Esquemas para el cambio de estado masivo de pedidos
+# ============================================================
+class PedidosEstadoMasivo(BaseModel):
+    pedido_ids: List[int] = Field(..., min_length=1, max_length=1000, example=[1, 2, 3])
+    estado: EstadoPedidoEnum
+
+class ResultadoEstadoPedido(BaseModel):
+    pedido_id: int
+    actualizado: bool
+    estado_anterior: Optional[EstadoPedidoEnum] = None
+    error: Optional[str] = None
+
+class PedidosEstadoMasivoResponse(BaseModel):
+    estado: EstadoPedidoEnum
+    actualizados: int
+    resultados: List[ResultadoEstadoPedido]
+
 # ============================================================
 # Esquema para crear un pedido
 # ============================================================
 class PedidoCreate(PedidoBase):
-    pass
+    # El total lo calcula el servidor a partir del carrito; si viene, se ignora
+    total: Optional[float] = Field(None, example=5000.75)
     
 # ============================================================
 # Esquema para actualizar pedido
@@ -385,6 +485,40 @@ class PedidoDetalle(PedidoDetalleBase):
     class Config:
         from_attributes = True
 
+# ============================================================
+# Esquemas para el historial de pedidos con sus detalles embebidos
+# ============================================================
+class ProductoResumen(BaseModel):
+    id: int
+    nombre: str
+    imagen: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class PedidoDetalleCompleto(PedidoDetalle):
+    producto: Optional[ProductoResumen] = None
+
+class EnvioResumen(BaseModel):
+    id: int
+    estado: EstadoEnvioEnum
+    codigoSeguimiento: str
+    empresa_id: int
+
+    class Config:
+        from_attributes = True
+
+class PedidoCompleto(Pedido):
+    detalles: List[PedidoDetalleCompleto] = Field(default=[], validation_alias="pedidoDetalle")
+    envios: List[EnvioResumen] = Field(default=[], validation_alias="envio")
+
+class PedidoCompletoListResponse(BaseModel):
+    total: Optional[int] = None  # No se calcula en modo cursor
+    pagina: Optional[int] = None
+    tamanio: int
+    pedidos: List[PedidoCompleto]
+    next_cursor: Optional[str] = None
+
 # ENVIO
 #---------------------------------------------------------------------------------
 # ============================================================
@@ -544,6 +678,22 @@ class PedidosCanceladosResponse(BaseModel):
     pedidos_cancelados: int
     porcentaje_cancelados: float
     ultimos_3_meses: Dict[str, float]  # {"2023-10": 15.2, ...}
+
+class CarritosAbandonadosDia(BaseModel):
+    fecha: str
+    carritos: int
+    carritos_con_productos: int
+    lineas: int
+    unidades: int
+    valor: float
+
+class CarritosAbandonadosResponse(BaseModel):
+    dias: int
+    carritos: int
+    carritos_con_productos: int
+    unidades: int
+    valor: float
+    por_dia: List[CarritosAbandonadosDia]
     
 
 
@@ -632,4 +782,21 @@ class CotizacionEnvio(BaseModel):
 
 class RespuestaEnvio(BaseModel):
     quotes: list[CotizacionEnvio]
-        
\ No newline at end of file
+        
+
+# ============================================================
+# Correo de la bandeja de salida
+# ============================================================
+class CorreoPendiente(BaseModel):
+    id: int
+    destinatario: str
+    asunto: str
+    estado: EstadoCorreoEnum
+    intentos: int
+    proximo_intento: datetime
+    ultimo_error: Optional[str] = None
+    fecha_creacion: datetime
+    fecha_envio: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
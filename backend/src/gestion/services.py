@@ -1,24 +1,76 @@
-from typing import List, Optional
-from sqlalchemy.orm import Session,joinedload
-from sqlalchemy import func, extract, case
-from sqlalchemy.exc import SQLAlchemyError
-from src.gestion.models import Usuario, Rol, CategoriaProducto, Descuento,Producto, Envio, Pago, Pedido,Comentario, PedidoDetalle, Carrito, CarritoDetalle, MetodoPago, Actividad, SubCategoria, Empresa, MetodoPagoEnum, DireccionEnvio, TipoDescuento
+from typing import Callable, List, Optional
+from sqlalchemy.orm import Session, joinedload, selectinload, aliased
+from sqlalchemy import func, extract, case, text, select, or_, and_, insert, update, union_all, literal, DateTime
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from src.gestion.models import Usuario, Rol, CategoriaProducto, Descuento,Producto, Envio, Pago, Pedido,Comentario, PedidoDetalle, Carrito, CarritoDetalle, MetodoPago, Actividad, SubCategoria, Empresa, MetodoPagoEnum, DireccionEnvio, EstadoPedido, TipoActividad, TipoDescuento, VersionTabla, CorreoPendiente, EstadoCorreo, ClaveIdempotencia, EstadoIdempotencia, ReservaStock, PedidoArchivado, PedidoDetalleArchivado, EnvioArchivado, PagoArchivado, CarritosAbandonados
 from src.gestion import schemas, exceptions
+from pydantic import ValidationError
 from src.utils.jwt import create_access_token
+from src.utils.paginacion import paginar, invalidar_conteos, conteos
+from src.utils.cache import CacheLRU
+from src.utils.time import now
+from src.utils.correo import enviador
+from src.database import SessionLocal
 from passlib.context import CryptContext
 from datetime import datetime, UTC, timedelta
 from fastapi import HTTPException, status, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 import cloudinary.uploader
 from collections import defaultdict
 from dateutil.relativedelta import relativedelta
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import re
+import csv
+import io
+import json
+import hashlib
+import time
+import os
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Caches de lectura del catálogo. Guardan esquemas (no instancias ORM) para
+# poder compartirse entre sesiones; los servicios que modifican cada sección
+# la invalidan al confirmar los cambios. Las claves incluyen la versión de las
+# tablas (versiones_tablas), la misma del ETag: un cambio hecho por otro
+# worker deja inalcanzables las entradas viejas de este.
+cache_productos = CacheLRU("productos", max_entradas=2048, ttl=300)
+cache_catalogo = CacheLRU("catalogo", max_entradas=512, ttl=300)
+# La clave incluye la versión del carrito y del catálogo; el ttl corto acota
+# el desfase cuando abre o cierra una ventana de descuento
+cache_totales_carrito = CacheLRU("totales_carrito", max_entradas=4096, ttl=60)
+
+def invalidar_catalogo(seccion: str):
+    """Descarta los listados cacheados de una sección del catálogo."""
+    cache_catalogo.invalidar_si(lambda clave: clave[0] == seccion)
+
+def invalidar_productos_cacheados(*producto_ids: int):
+    """Descarta los productos cacheados, de cualquier versión."""
+    ids = set(producto_ids)
+    if ids:
+        cache_productos.invalidar_si(lambda clave: clave[0] in ids)
+
+def estadisticas_cache() -> list[dict]:
+    return [cache.estadisticas() for cache in (cache_productos, cache_catalogo, cache_totales_carrito, conteos)]
+
+# Versiones por tabla, guardadas en la base para que todos los workers
+# coincidan. Se incrementan dentro de la transacción de la escritura.
+def incrementar_version(db: Session, *tablas: str):
+    for tabla in tablas:
+        actualizadas = db.query(VersionTabla).filter(VersionTabla.tabla == tabla).update(
+            {VersionTabla.version: VersionTabla.version + 1}, synchronize_session=False
+        )
+        if not actualizadas:
+            db.add(VersionTabla(tabla=tabla, version=1))
+
+def obtener_versiones(db: Session, *tablas: str) -> dict:
+    versiones = dict(
+        db.query(VersionTabla.tabla, VersionTabla.version).filter(VersionTabla.tabla.in_(tablas)).all()
+    )
+    return {tabla: versiones.get(tabla, 0) for tabla in tablas}
+
 # Para que se creen los roles automaticamente, si es que no existen
 ROLES_REQUERIDOS = ["cliente","administrador"] 
 def verificar_y_crear_roles(db: Session):
@@ -63,6 +115,7 @@ def registrar_usuario(db: Session, usuario: schemas.UsuarioCreate) -> Usuario:
     nuevo_usuario.set_password(usuario.password)
     db.add(nuevo_usuario)
     db.commit()
+    invalidar_conteos("usuarios")
     db.refresh(nuevo_usuario)
     return nuevo_usuario
 
@@ -89,13 +142,8 @@ def autenticar_usuario(db: Session, nombreUsuario: str, password: str):
     )
     return access_token
 
-def listar_usuarios(db: Session, pagina: int, tamanio: int) -> dict:
-    total = db.query(Usuario).count()
-    usuarios = (db.query(Usuario)
-                .offset((pagina - 1) * tamanio)
-                .limit(tamanio)
-                .all())
-    return {"total": total, "pagina": pagina, "tamanio": tamanio, "usuarios": usuarios}
+def listar_usuarios(db: Session, pagina: int, tamanio: int, after: Optional[str] = None, total: str = "exact") -> dict:
+    return paginar(db.query(Usuario), [(Usuario.id, False)], pagina, tamanio, after, "usuarios", total=total)
 
 
 def obtener_usuario_por_id(db: Session, usuario_id: int) -> Usuario:
@@ -127,6 +175,7 @@ def eliminar_usuario(db: Session, usuario_id: int) -> None:
     usuario = obtener_usuario_por_id(db, usuario_id)
     db.delete(usuario)
     db.commit()
+    invalidar_conteos("usuarios")
     
 # ROLES     
 # ----------------------------------------------------------------------------------------------
@@ -183,18 +232,22 @@ def crear_categoria( db: Session,
         imagen=image_url  # Guardar la URL del logo si se subió
     )
     db.add(nueva_categoria)
+    incrementar_version(db, "categorias")
     db.commit()
+    invalidar_conteos("categorias")
+    invalidar_catalogo("categorias")
     db.refresh(nueva_categoria)
     return nueva_categoria
 
 # Listar todas las categorías
-def listar_categorias(db: Session, pagina: int, tamanio: int) -> dict:
-    total = db.query(CategoriaProducto).count()
-    categorias = (db.query(CategoriaProducto)
-                  .offset((pagina - 1) * tamanio)
-                  .limit(tamanio)
-                  .all())
-    return {"total": total, "pagina": pagina, "tamanio": tamanio, "categorias": categorias}
+def listar_categorias(db: Session, pagina: int, tamanio: int, after: Optional[str] = None, versiones: Optional[dict] = None) -> dict:
+    versiones = versiones or obtener_versiones(db, "categorias")
+
+    def consultar():
+        resultado = paginar(db.query(CategoriaProducto), [(CategoriaProducto.id, False)], pagina, tamanio, after, "categorias")
+        resultado["categorias"] = [schemas.CategoriaProducto.model_validate(c) for c in resultado["categorias"]]
+        return resultado
+    return cache_catalogo.obtener_o_calcular(("categorias", versiones["categorias"], pagina, tamanio, after), consultar)
 
 # Obtener una categoría por ID
 def obtener_categoria_por_id(db: Session, categoria_id: int) -> CategoriaProducto:
@@ -229,7 +282,9 @@ def actualizar_categoria(db: Session,
         categoria.imagen = image_url  # Actualizar el atributo imagen con la URL
 
     # Guardar los cambios en la base de datos
+    incrementar_version(db, "categorias")
     db.commit()
+    invalidar_catalogo("categorias")
     db.refresh(categoria)
     
     return categoria
@@ -238,7 +293,10 @@ def actualizar_categoria(db: Session,
 def eliminar_categoria(db: Session, categoria_id: int):
     categoria = obtener_categoria_por_id(db, categoria_id)
     db.delete(categoria)
+    incrementar_version(db, "categorias")
     db.commit()
+    invalidar_conteos("categorias")
+    invalidar_catalogo("categorias")
     
 #SUBCATEGORIAS
 #------------------------------------------------------------------------------------------------
@@ -253,18 +311,30 @@ def crear_subcategoria(db: Session, subcategoria: schemas.SubCategoriaBase, cate
         categoria_id=categoria_id
     )
     db.add(db_subcategoria)
+    incrementar_version(db, "subcategorias")
     db.commit()
+    invalidar_conteos("subcategorias")
+    invalidar_catalogo("subcategorias")
     db.refresh(db_subcategoria)
     return db_subcategoria
 
 # Lista subcategorias 
-def listar_subcategorias(db: Session, pagina: int, tamanio: int, categoria_id: Optional[int] = None) -> dict:
+def listar_subcategorias(
+    db: Session, pagina: int, tamanio: int, categoria_id: Optional[int] = None, after: Optional[str] = None,
+    versiones: Optional[dict] = None,
+) -> dict:
+    versiones = versiones or obtener_versiones(db, "subcategorias")
     query = db.query(SubCategoria)
     if categoria_id:
         query = query.filter(SubCategoria.categoria_id == categoria_id)
-    total = query.count()
-    subcategorias = query.offset((pagina - 1) * tamanio).limit(tamanio).all()
-    return {"total": total, "pagina": pagina, "tamanio": tamanio, "subcategorias": subcategorias}
+
+    def consultar():
+        resultado = paginar(query, [(SubCategoria.id, False)], pagina, tamanio, after, "subcategorias", filtros=(categoria_id,))
+        resultado["subcategorias"] = [schemas.SubCategoria.model_validate(s) for s in resultado["subcategorias"]]
+        return resultado
+    return cache_catalogo.obtener_o_calcular(
+        ("subcategorias", versiones["subcategorias"], pagina, tamanio, categoria_id, after), consultar
+    )
 
 # Obtener una subcategoría por ID
 def obtener_subcategoria_por_id(db: Session, subcategoria_id: int) -> SubCategoria:
@@ -277,7 +347,9 @@ def obtener_subcategoria_por_id(db: Session, subcategoria_id: int) -> SubCategor
 def actualizar_subcategoria(db: Session, subcategoria_id: int, subcategoria_update: schemas.SubCategoriaBase) -> SubCategoria:
     subcategoria = obtener_subcategoria_por_id(db, subcategoria_id)
     subcategoria.nombre = subcategoria_update.nombre
+    incrementar_version(db, "subcategorias")
     db.commit()
+    invalidar_catalogo("subcategorias")
     db.refresh(subcategoria)
     return subcategoria
 
@@ -285,7 +357,10 @@ def actualizar_subcategoria(db: Session, subcategoria_id: int, subcategoria_upda
 def eliminar_subcategoria(db: Session, subcategoria_id: int):
     subcategoria = obtener_subcategoria_por_id(db, subcategoria_id)
     db.delete(subcategoria)
+    incrementar_version(db, "subcategorias")
     db.commit()
+    invalidar_conteos("subcategorias")
+    invalidar_catalogo("subcategorias")
 
 #PRODUCTOS
 #------------------------------------------------------------------------------------------------
@@ -355,13 +430,129 @@ def crear_producto(
             costo_envio=costo_envio
         )
         db.add(db_producto)
+        db.flush()
+        recalcular_precios_finales(db, Producto.id == db_producto.id)
+        incrementar_version(db, "productos")
         db.commit()
+        invalidar_conteos("productos")
         db.refresh(db_producto)
         return db_producto
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Error al guardar el producto: {str(e)}")
+
+# Importación masiva de productos
+TAMANIO_LOTE_IMPORTACION = 500
+
+def leer_filas_importacion(archivo, formato: str):
+    """
+    Recorre el archivo fila por fila sin cargarlo entero en memoria. En JSONL
+    devuelve cada línea sin decodificar para informar su error como el de
+    cualquier otra fila.
+    """
+    texto = io.TextIOWrapper(archivo, encoding="utf-8-sig", newline="")
+    if formato == "csv":
+        for fila in csv.DictReader(texto):
+            # En CSV una celda vacía equivale a un campo no informado
+            yield {campo: (valor if valor != "" else None) for campo, valor in fila.items()}
+    else:
+        for linea in texto:
+            if linea.strip():
+                yield linea
+
+def importar_productos(db: Session, archivo, formato: str) -> dict:
+    """
+    Importa productos desde un CSV o JSONL con las columnas de ProductoCreate.
+    La imagen se toma como URL ya publicada (no se sube a Cloudinary). Las
+    filas válidas se insertan en lotes; las inválidas se informan con su
+    número de fila y no interrumpen la importación. Todo el archivo se
+    confirma en una sola transacción: si no se puede leer hasta el final no
+    queda ningún producto importado.
+    """
+    categorias = {id for (id,) in db.query(CategoriaProducto.id)}
+    subcategorias = dict(db.query(SubCategoria.id, SubCategoria.categoria_id))
+    descuentos = {id for (id,) in db.query(Descuento.id)}
+
+    # Los códigos se asignan a partir del último ID, como en crear_producto
+    siguiente_numero = (db.query(func.max(Producto.id)).scalar() or 0) + 1
+
+    errores = []
+    lote = []  # (número de fila, valores)
+    filas = importados = 0
+
+    def insertar_lote():
+        # Cada lote va en un SAVEPOINT. Si choca con una restricción de la base
+        # (ej. un código ya usado) se reintenta fila por fila y solo se
+        # rechazan las que fallan
+        nonlocal importados
+        try:
+            with db.begin_nested():
+                db.execute(insert(Producto), [valores for _, valores in lote])
+            importados += len(lote)
+        except IntegrityError:
+            for fila, valores in lote:
+                try:
+                    with db.begin_nested():
+                        db.execute(insert(Producto), [valores])
+                    importados += 1
+                except IntegrityError as e:
+                    errores.append({"fila": fila, "errores": [f"No se pudo guardar: {e.orig}"]})
+        lote.clear()
+
+    try:
+        for filas, datos in enumerate(leer_filas_importacion(archivo, formato), start=1):
+            try:
+                if isinstance(datos, str):
+                    datos = json.loads(datos)
+                producto = schemas.ProductoCreate.model_validate(datos)
+            except json.JSONDecodeError as e:
+                errores.append({"fila": filas, "errores": [f"JSON inválido: {e.msg}"]})
+                continue
+            except ValidationError as e:
+                errores.append({"fila": filas, "errores": [
+                    f"{'.'.join(str(parte) for parte in error['loc'])}: {error['msg']}" for error in e.errors()
+                ]})
+                continue
+
+            problemas = []
+            if producto.categoria_id not in categorias:
+                problemas.append("categoria_id: Categoría no encontrada")
+            if producto.subcategoria_id and subcategorias.get(producto.subcategoria_id) != producto.categoria_id:
+                problemas.append("subcategoria_id: Subcategoría no encontrada o no pertenece a la categoría")
+            if producto.descuento_id and producto.descuento_id not in descuentos:
+                problemas.append("descuento_id: Descuento no encontrado")
+            if not producto.imagen:
+                problemas.append("imagen: Se requiere la URL de la imagen")
+            if problemas:
+                errores.append({"fila": filas, "errores": problemas})
+                continue
+
+            lote.append((filas, {
+                **producto.model_dump(),
+                "codigo": f"PROD-{siguiente_numero:03d}",
+                "precio_final": None,
+            }))
+            siguiente_numero += 1
+            if len(lote) >= TAMANIO_LOTE_IMPORTACION:
+                insertar_lote()
+    except (UnicodeDecodeError, csv.Error) as e:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"No se pudo leer la fila {filas + 1} del archivo: {str(e)}")
+
+    if lote:
+        insertar_lote()
+    if importados:
+        # Los productos nuevos no tienen precio final: el UPDATE los alcanza a
+        # todos y sube la versión de "productos"
+        recalcular_precios_finales(db, Producto.precio_final.is_(None))
+        db.commit()
+        invalidar_conteos("productos")
+
+    errores.sort(key=lambda error: error["fila"])
+    return {"filas": filas, "importados": importados, "errores": errores}
+
 def actualizar_producto(
     db: Session,
     producto_id: int,
@@ -400,42 +591,81 @@ def actualizar_producto(
                 raise Exception("No se obtuvo URL de la imagen")
             producto.imagen = image_url
 
+        db.flush()
+        recalcular_precios_finales(db, Producto.id == producto_id)
+        incrementar_version(db, "productos")
         db.commit()
+        invalidar_conteos("productos")
+        invalidar_productos_cacheados(producto_id)
         db.refresh(producto)
         return producto
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error al actualizar el producto: {str(e)}")
 
-def listar_productos(db: Session, pagina: int, tamanio: int, categoria_id: Optional[int] = None):
-    query = db.query(Producto)
+ORDENES_PRODUCTOS = {
+    "precio-bajo": [(Producto.precio_final, False), (Producto.id, False)],
+    "precio-alto": [(Producto.precio_final, True), (Producto.id, False)],
+    "descuento": [(func.coalesce(Descuento.valor, 0), True), (Producto.id, False)],
+}
+
+def listar_productos(
+    db: Session,
+    pagina: int,
+    tamanio: int,
+    categoria_id: Optional[int] = None,
+    after: Optional[str] = None,
+    q: Optional[str] = None,
+    subcategoria_id: Optional[int] = None,
+    precio_min: Optional[float] = None,
+    precio_max: Optional[float] = None,
+    ordenar_por: Optional[str] = None,
+):
+    """
+    Lista productos filtrando y ordenando en la base de datos, para que el
+    catálogo solo reciba las filas de la página que muestra.
+    """
+    query = db.query(Producto).options(selectinload(Producto.descuento))
     if categoria_id:
         query = query.filter(Producto.categoria_id == categoria_id)
-    total = query.count()
-    productos = query.offset((pagina - 1) * tamanio).limit(tamanio).all()
-    return {"total": total, "pagina": pagina, "tamanio": tamanio, "productos": productos}
-
-
-def obtener_productos_descuento(db: Session, pagina: int, tamanio: int):
-    # Filtra productos cuyo descuento_id no sea None
-    query = db.query(Producto).filter(Producto.descuento_id != None)
-    total = query.count()
-    productos = query.offset((pagina - 1) * tamanio).limit(tamanio).all()
-    return {"total": total, "pagina": pagina, "tamanio": tamanio, "productos": productos}
+    if subcategoria_id:
+        query = query.filter(Producto.subcategoria_id == subcategoria_id)
+    if q and q.strip():
+        query = query.filter(Producto.nombre.icontains(q.strip(), autoescape=True))
+    if precio_min is not None:
+        query = query.filter(Producto.precio_final >= precio_min)
+    if precio_max is not None:
+        query = query.filter(Producto.precio_final <= precio_max)
+    if ordenar_por == "descuento":
+        query = query.outerjoin(Descuento, Producto.descuento_id == Descuento.id)
+
+    orden = ORDENES_PRODUCTOS.get(ordenar_por, [(Producto.id, False)])
+    filtros = (categoria_id, subcategoria_id, q, precio_min, precio_max)
+    return paginar(query, orden, pagina, tamanio, after, "productos", filtros=filtros)
 
 # Obtener un producto por ID
 def obtener_producto_por_id(db: Session, producto_id: int) -> Producto:
-    producto = db.query(Producto).filter(Producto.id == producto_id).first()
+    producto = db.query(Producto).options(joinedload(Producto.descuento)).filter(Producto.id == producto_id).first()
     if not producto:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado")
     return producto
 
+# Obtener un producto por ID pasando por la cache de lectura
+def obtener_producto_cacheado(db: Session, producto_id: int, versiones: Optional[dict] = None) -> schemas.ProductoOut:
+    versiones = versiones or obtener_versiones(db, "productos", "descuentos")
+    return cache_productos.obtener_o_calcular(
+        (producto_id, versiones["productos"], versiones["descuentos"]),
+        lambda: schemas.ProductoOut.model_validate(obtener_producto_por_id(db, producto_id), from_attributes=True)
+    )
 
 # Eliminar un producto
 def eliminar_producto(db: Session, producto_id: int):
     producto = obtener_producto_por_id(db, producto_id)
     db.delete(producto)
+    incrementar_version(db, "productos")
     db.commit()
+    invalidar_conteos("productos")
+    invalidar_productos_cacheados(producto_id)
     
 # Verifica nombre del producto
 def verificar_nombre_producto(db: Session, nombre: str) -> bool:
@@ -444,7 +674,170 @@ def verificar_nombre_producto(db: Session, nombre: str) -> bool:
     nombre = nombre.strip()
     producto = db.query(Producto).filter(Producto.nombre == nombre).first()
     return producto is not None
-   
+
+#PRECIO FINAL
+#---------------------------------------------------------------------------------------------------------
+def ahora_local() -> datetime:
+    # Las fechas de los descuentos se guardan sin zona horaria, en hora de Argentina
+    return now().replace(tzinfo=None)
+
+def expresion_precio_final(ahora: datetime):
+    """
+    Precio del producto con su descuento vigente aplicado. Como en el carrito,
+    sólo los descuentos PORCENTAJE cambian el precio; además tienen que estar
+    activos y dentro de su ventana de fechas.
+    """
+    porcentaje_vigente = select(Descuento.valor).where(
+        Descuento.id == Producto.descuento_id,
+        Descuento.activo.is_(True),
+        Descuento.tipo == TipoDescuento.PORCENTAJE,
+        Descuento.fecha_inicio <= ahora,
+        or_(Descuento.fecha_fin.is_(None), Descuento.fecha_fin > ahora),
+    ).scalar_subquery()
+    return Producto.precio * (1 - func.coalesce(porcentaje_vigente, 0) / 100.0)
+
+def recalcular_precios_finales(db: Session, *filtros) -> int:
+    """
+    Recalcula `precio_final` con un único UPDATE sobre los productos que
+    cumplen los filtros y cuyo precio guardado quedó desactualizado. No
+    confirma la transacción; devuelve la cantidad de productos modificados.
+    """
+    nuevo_precio = expresion_precio_final(ahora_local())
+    actualizados = db.query(Producto).filter(
+        *filtros,
+        or_(Producto.precio_final.is_(None), Producto.precio_final != nuevo_precio)
+    ).update({Producto.precio_final: nuevo_precio}, synchronize_session=False)
+    if actualizados:
+        incrementar_version(db, "productos")
+        repreciar_carritos(db, *filtros)
+        # Los totales filtrados por precio_min/precio_max dependen del precio final
+        invalidar_conteos("productos")
+    return actualizados
+
+def repreciar_carritos(db: Session, *filtros) -> int:
+    """
+    Lleva el subtotal de las líneas de carrito de los productos que cumplen
+    los filtros al `precio_final` actual, con un único UPDATE. Se llama cada
+    vez que cambia un precio final, así los carritos abiertos coinciden con
+    el checkout. No confirma la transacción; devuelve las líneas modificadas.
+    """
+    precio = select(func.coalesce(Producto.precio_final, Producto.precio))\
+        .where(Producto.id == CarritoDetalle.producto_id)\
+        .scalar_subquery()
+    nuevo_subtotal = CarritoDetalle.cantidad * precio
+    # Solo los carritos abiertos; el estado se compara como en obtener_carrito_por_usuario
+    abiertos = select(Carrito.id).where(Carrito.estado == schemas.EstadoCarritoEnum.PENDIENTE)
+    return db.query(CarritoDetalle).filter(
+        CarritoDetalle.carrito_id.in_(abiertos),
+        CarritoDetalle.producto_id.in_(select(Producto.id).where(*filtros)),
+        or_(CarritoDetalle.subtotal.is_(None), CarritoDetalle.subtotal != nuevo_subtotal),
+    ).update({CarritoDetalle.subtotal: nuevo_subtotal}, synchronize_session=False)
+
+def actualizar_precios_vigentes(db: Session) -> int:
+    """Aplica las ventanas de descuento que abrieron o cerraron."""
+    actualizados = recalcular_precios_finales(db)
+    if actualizados:
+        db.commit()
+        cache_productos.limpiar()
+    return actualizados
+
+def proximo_cambio_de_descuento(db: Session) -> Optional[datetime]:
+    """Momento en que abre o cierra la próxima ventana de un descuento activo."""
+    ahora = ahora_local()
+    inicio = db.query(func.min(Descuento.fecha_inicio))\
+               .filter(Descuento.activo.is_(True), Descuento.fecha_inicio > ahora)\
+               .scalar()
+    fin = db.query(func.min(Descuento.fecha_fin))\
+            .filter(Descuento.activo.is_(True), Descuento.fecha_fin > ahora)\
+            .scalar()
+    return min([fecha for fecha in (inicio, fin) if fecha is not None], default=None)
+
+#BUSQUEDA DE PRODUCTOS
+#---------------------------------------------------------------------------------------------------------
+# Documento indexado en PostgreSQL; la consulta debe repetir la misma
+# expresión para que el planificador use el índice GIN.
+DOCUMENTO_BUSQUEDA_PG = (
+    "setweight(to_tsvector('spanish', coalesce(nombre, '')), 'A') || "
+    "setweight(to_tsvector('spanish', coalesce(descripcion, '')), 'B')"
+)
+
+def crear_indice_busqueda(db: Session):
+    """
+    Crea el índice de texto completo sobre nombre y descripción de productos.
+    En SQLite es una tabla FTS5 sincronizada por triggers con `productos`, de
+    modo que crear, actualizar o eliminar un producto actualiza el índice en la
+    misma transacción. En PostgreSQL es un índice GIN sobre un tsvector.
+    """
+    dialect_name = db.bind.dialect.name
+
+    if dialect_name == "sqlite":
+        existe = db.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'productos_fts'"
+        )).first()
+        db.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS productos_fts USING fts5("
+            "nombre, descripcion, content='productos', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2')"
+        ))
+        db.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS productos_fts_ai AFTER INSERT ON productos BEGIN "
+            "INSERT INTO productos_fts(rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion); "
+            "END"
+        ))
+        db.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS productos_fts_ad AFTER DELETE ON productos BEGIN "
+            "INSERT INTO productos_fts(productos_fts, rowid, nombre, descripcion) VALUES ('delete', old.id, old.nombre, old.descripcion); "
+            "END"
+        ))
+        db.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS productos_fts_au AFTER UPDATE OF nombre, descripcion ON productos BEGIN "
+            "INSERT INTO productos_fts(productos_fts, rowid, nombre, descripcion) VALUES ('delete', old.id, old.nombre, old.descripcion); "
+            "INSERT INTO productos_fts(rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion); "
+            "END"
+        ))
+        if not existe:
+            # Indexar los productos que ya estaban cargados
+            db.execute(text("INSERT INTO productos_fts(productos_fts) VALUES ('rebuild')"))
+    else:  # PostgreSQL
+        db.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_productos_busqueda ON productos USING GIN (({DOCUMENTO_BUSQUEDA_PG}))"
+        ))
+    db.commit()
+
+def buscar_productos(db: Session, q: str, limite: int = 20) -> dict:
+    """
+    Busca productos por texto completo y los devuelve ordenados por relevancia.
+    Cada palabra se busca como prefijo, así "clor past" encuentra "Cloro en pastillas".
+    """
+    terminos = re.findall(r"\w+", q or "")
+    if not terminos:
+        return {"total": 0, "productos": []}
+
+    dialect_name = db.bind.dialect.name
+
+    if dialect_name == "sqlite":
+        consulta = " ".join('"' + t.replace('"', '""') + '"*' for t in terminos)
+        filas = db.execute(text(
+            "SELECT rowid AS id FROM productos_fts WHERE productos_fts MATCH :consulta "
+            "ORDER BY bm25(productos_fts, 10.0, 1.0) LIMIT :limite"
+        ), {"consulta": consulta, "limite": limite}).all()
+    else:  # PostgreSQL
+        consulta = " & ".join(f"{t}:*" for t in terminos)
+        filas = db.execute(text(
+            f"SELECT id FROM productos WHERE ({DOCUMENTO_BUSQUEDA_PG}) @@ to_tsquery('spanish', :consulta) "
+            f"ORDER BY ts_rank(({DOCUMENTO_BUSQUEDA_PG}), to_tsquery('spanish', :consulta)) DESC LIMIT :limite"
+        ), {"consulta": consulta, "limite": limite}).all()
+
+    ids = [fila.id for fila in filas]
+    productos = (db.query(Producto)
+                 .options(selectinload(Producto.descuento))
+                 .filter(Producto.id.in_(ids))
+                 .all())
+    # Respetar el orden por relevancia
+    por_id = {producto.id: producto for producto in productos}
+    ordenados = [por_id[i] for i in ids if i in por_id]
+    return {"total": len(ordenados), "productos": ordenados}
+
 #ENVIO
 #---------------------------------------------------------------------------------------------------------
 #Crear un envio
@@ -453,17 +846,13 @@ def crear_envio(db: Session,  envio: schemas.EnvioCreate) -> Envio:
     nuevo_envio = Envio(**envio.dict())
     db.add(nuevo_envio)
     db.commit()
+    invalidar_conteos("envios")
     db.refresh(nuevo_envio)
     return nuevo_envio
 
 #Listar envios
-def listar_envios(db: Session, pagina: int, tamanio: int) -> dict:
-    total = db.query(Envio).count()
-    envios = (db.query(Envio)
-                .offset((pagina - 1) * tamanio)
-                .limit(tamanio)
-                .all())
-    return {"total": total, "pagina": pagina, "tamanio": tamanio, "envios": envios}
+def listar_envios(db: Session, pagina: int, tamanio: int, after: Optional[str] = None, total: str = "exact") -> dict:
+    return paginar(db.query(Envio), [(Envio.id, False)], pagina, tamanio, after, "envios", total=total)
 
 #Obtener envios por id
 def obtener_envio_por_id(db: Session, envio_id: int) -> Envio:
@@ -486,6 +875,7 @@ def eliminar_envio(db: Session, envio_id: int) -> None:
     envio = obtener_envio_por_id(db, envio_id)
     db.delete(envio)
     db.commit()
+    invalidar_conteos("envios")
     
 # ============================================================
 # Crear una nueva empresa
@@ -518,19 +908,15 @@ def crear_empresa(
     )
     db.add(nueva_empresa)
     db.commit()
+    invalidar_conteos("empresas")
     db.refresh(nueva_empresa)
     return nueva_empresa
 
 # ============================================================
 # Listar todas las empresas
 # ============================================================
-def listar_empresas(db: Session, pagina: int, tamanio: int) -> dict:
-    total = db.query(Empresa).count()
-    empresas = (db.query(Empresa)
-                .offset((pagina - 1) * tamanio)
-                .limit(tamanio)
-                .all())
-    return {"total": total, "pagina": pagina, "tamanio": tamanio, "empresas": empresas}
+def listar_empresas(db: Session, pagina: int, tamanio: int, after: Optional[str] = None) -> dict:
+    return paginar(db.query(Empresa), [(Empresa.id, False)], pagina, tamanio, after, "empresas")
 
 # ============================================================
 # Obtener una empresa por ID
@@ -582,6 +968,7 @@ def eliminar_empresa(db: Session, empresa_id: int):
     empresa = obtener_empresa_por_id(db, empresa_id)
     db.delete(empresa)
     db.commit()
+    invalidar_conteos("empresas")
     
 #PAGO
 #-------------------------------------------------------------------------------------
@@ -590,17 +977,13 @@ def crear_pago(db: Session, pago: schemas.PagoBase):
     nuevo_pago = Pago(**pago.dict())
     db.add(nuevo_pago)
     db.commit()
+    invalidar_conteos("pagos")
     db.refresh(nuevo_pago)
     return nuevo_pago
 
 #Listar Pago
-def listar_pagos(db: Session, pagina: int, tamanio: int) -> dict:
-    total = db.query(Pago).count()
-    pagos = (db.query(Pago)
-                .offset((pagina - 1) * tamanio)
-                .limit(tamanio)
-                .all())
-    return {"total": total, "pagina": pagina, "tamanio": tamanio, "pagos": pagos}
+def listar_pagos(db: Session, pagina: int, tamanio: int, after: Optional[str] = None, total: str = "exact") -> dict:
+    return paginar(db.query(Pago), [(Pago.id, False)], pagina, tamanio, after, "pagos", total=total)
 
 #Obtener Pago
 def obtener_pago(db: Session, pago_id: int):
@@ -616,6 +999,7 @@ def eliminar_pago(db: Session, pago_id: int):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pago no encontrado")
     db.delete(pago)
     db.commit()
+    invalidar_conteos("pagos")
     return None
 
 #METODO DE PAGO
@@ -649,6 +1033,8 @@ def crear_metodo_pago(
     )
     db.add(nuevo_metodo_pago)
     db.commit()
+    invalidar_conteos("metodospagos")
+    invalidar_catalogo("metodos_pago")
     db.refresh(nuevo_metodo_pago)
     return nuevo_metodo_pago
 
@@ -683,19 +1069,19 @@ def actualizar_metodo_pago(
 
     # Guardar los cambios en la base de datos
     db.commit()
+    invalidar_catalogo("metodos_pago")
     db.refresh(metodo_pago)
     
     return metodo_pago
 
 
 # Listar Métodos de Pago
-def listar_metodos_pago(db: Session, pagina: int, tamanio: int) -> dict:
-    total = db.query(MetodoPago).count()
-    metodosPago = (db.query(MetodoPago)
-                .offset((pagina - 1) * tamanio)
-                .limit(tamanio)
-                .all())
-    return {"total": total, "pagina": pagina, "tamanio": tamanio, "metodosPago": metodosPago}
+def listar_metodos_pago(db: Session, pagina: int, tamanio: int, after: Optional[str] = None) -> dict:
+    def consultar():
+        resultado = paginar(db.query(MetodoPago), [(MetodoPago.id, False)], pagina, tamanio, after, "metodosPago")
+        resultado["metodosPago"] = [schemas.MetodoPago.model_validate(m) for m in resultado["metodosPago"]]
+        return resultado
+    return cache_catalogo.obtener_o_calcular(("metodos_pago", pagina, tamanio, after), consultar)
 
 # Obtener Método de Pago por ID
 def obtener_metodo_pago(db: Session, metodo_pago_id: int):
@@ -711,6 +1097,8 @@ def eliminar_metodo_pago(db: Session, metodo_pago_id: int):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Método de pago no encontrado")
     db.delete(metodo_pago)
     db.commit()
+    invalidar_conteos("metodospagos")
+    invalidar_catalogo("metodos_pago")
     return None
 
 #Obtener metodo de pago por id
@@ -720,92 +1108,448 @@ def obtener_metodo_pago_por_id(db: Session, metodo_pago_id: int) -> MetodoPago:
         raise HTTPException(status_code=404, detail="metodo pago no encontrado")
     return metodo_pago
 
-#PEDIDO
+#CORREO
 #--------------------------------------------------------------------------------------
-# Crear Pedido
 def enviar_correo(destinatario: str, asunto: str, cuerpo: str):
-    """Función para enviar un correo electrónico."""
-    # Configura tus credenciales de correo (ajústalas a tu proveedor)
-    remitente = "franciscoterrondg19@gmail.com"  # Reemplaza con tu correo
-    password = "cgsz yehy botw vxtz"           # Reemplaza con tu contraseña o clave de aplicación
-
-    # Crea el mensaje
-    msg = MIMEMultipart()
-    msg['From'] = remitente
-    msg['To'] = destinatario
-    msg['Subject'] = asunto
-    msg.attach(MIMEText(cuerpo, 'html'))  # Cambiado de 'plain' a 'html'
-
-    # Configura el servidor SMTP (ejemplo con Gmail, ajusta según tu proveedor)
+    """
+    Envía un correo electrónico por el pool SMTP compartido (ver utils/correo).
+    Los errores se propagan para que la bandeja de salida reintente el envío.
+    """
+    enviador.enviar(destinatario, asunto, cuerpo)
+
+#BANDEJA DE SALIDA DE CORREOS
+#------------------------------------------------------------------------------------------------------------
+CORREO_MAX_INTENTOS = 6
+CORREO_ESPERA_BASE = 30  # segundos; se duplica en cada reintento
+CORREO_ESPERA_MAXIMA = 3600
+CORREO_RESERVA = 300  # segundos que un worker se reserva un correo mientras lo envía
+
+def encolar_correo(db: Session, destinatario: str, asunto: str, cuerpo: str) -> CorreoPendiente:
+    """Guarda el correo en la bandeja de salida; se envía al confirmar la transacción."""
+    correo = CorreoPendiente(
+        destinatario=destinatario,
+        asunto=asunto,
+        cuerpo=cuerpo,
+        proximo_intento=ahora_local()
+    )
+    db.add(correo)
+    return correo
+
+def reservar_correos_pendientes(db: Session, limite: int = 20) -> List[CorreoPendiente]:
+    """
+    Toma los correos cuyo próximo intento ya venció. Cada uno se reserva
+    corriendo su próximo intento con un UPDATE condicional, así otro worker
+    que lea la misma fila no lo envía dos veces.
+    """
+    ahora = ahora_local()
+    candidatos = db.query(CorreoPendiente.id, CorreoPendiente.proximo_intento)\
+                   .filter(CorreoPendiente.estado == EstadoCorreo.PENDIENTE,
+                           CorreoPendiente.proximo_intento <= ahora)\
+                   .order_by(CorreoPendiente.proximo_intento)\
+                   .limit(limite)\
+                   .all()
+    reservados = []
+    for correo_id, proximo_intento in candidatos:
+        tomado = db.query(CorreoPendiente).filter(
+            CorreoPendiente.id == correo_id,
+            CorreoPendiente.proximo_intento == proximo_intento
+        ).update({CorreoPendiente.proximo_intento: ahora + timedelta(seconds=CORREO_RESERVA)},
+                 synchronize_session=False)
+        if tomado:
+            reservados.append(correo_id)
+    db.commit()
+    return db.query(CorreoPendiente).filter(CorreoPendiente.id.in_(reservados)).all()
+
+def registrar_envio_correo(correo: CorreoPendiente, error: Optional[Exception] = None):
+    """
+    Marca el correo como enviado o programa su reintento con espera
+    exponencial. No confirma la transacción.
+    """
+    correo.intentos += 1
+    if error is None:
+        correo.estado = EstadoCorreo.ENVIADO
+        correo.fecha_envio = ahora_local()
+        correo.ultimo_error = None
+    else:
+        correo.ultimo_error = str(error)[:500]
+        if correo.intentos >= CORREO_MAX_INTENTOS:
+            correo.estado = EstadoCorreo.FALLIDO
+        else:
+            espera = min(CORREO_ESPERA_BASE * 2 ** (correo.intentos - 1), CORREO_ESPERA_MAXIMA)
+            correo.proximo_intento = ahora_local() + timedelta(seconds=espera)
+
+def enviar_correos_pendientes(db: Session, limite: int = 20) -> int:
+    """Envía un lote de la bandeja de salida; devuelve cuántos se procesaron."""
+    # Sin credenciales SMTP los correos esperan en la bandeja sin gastar intentos
+    if not enviador.habilitado:
+        return 0
+    correos = reservar_correos_pendientes(db, limite)
+    if not correos:
+        return 0
+    # Todo el lote sale por la misma conexión del pool
+    resultados = enviador.enviar_lote(
+        [(correo.destinatario, correo.asunto, correo.cuerpo) for correo in correos]
+    )
+    for correo, error in zip(correos, resultados):
+        registrar_envio_correo(correo, error)
+    db.commit()
+    invalidar_conteos("correos_pendientes")
+    return len(correos)
+
+def listar_correos(db: Session, pagina: int, tamanio: int, estado: Optional[EstadoCorreo] = None, after: Optional[str] = None) -> dict:
+    query = db.query(CorreoPendiente)
+    if estado:
+        query = query.filter(CorreoPendiente.estado == estado)
+    return paginar(query, [(CorreoPendiente.id, False)], pagina, tamanio, after, "correos", filtros=(estado,))
+
+def reintentar_correo(db: Session, correo_id: int) -> CorreoPendiente:
+    """Vuelve a poner en cola un correo, por ejemplo uno que agotó sus intentos."""
+    correo = db.query(CorreoPendiente).filter(CorreoPendiente.id == correo_id).first()
+    if not correo:
+        raise HTTPException(status_code=404, detail="Correo no encontrado")
+    correo.estado = EstadoCorreo.PENDIENTE
+    correo.intentos = 0
+    correo.proximo_intento = ahora_local()
+    db.commit()
+    invalidar_conteos("correos_pendientes")
+    db.refresh(correo)
+    return correo
+
+#IDEMPOTENCIA
+#------------------------------------------------------------------------------------------------------------
+# Las claves se reservan con su propia sesión y se confirman al instante, así
+# una solicitud duplicada que llega en paralelo ve la reserva enseguida. La
+# respuesta, en cambio, se guarda dentro de la transacción de la operación
+# cuando esta lo permite: si el proceso cae después del commit la clave ya
+# quedó completada y un reintento no puede repetir la operación
+IDEMPOTENCIA_ESPERA_MAXIMA = 30      # segundos que un duplicado espera a la ejecución en curso
+IDEMPOTENCIA_INTERVALO = 0.1         # segundos entre consultas mientras espera
+IDEMPOTENCIA_EN_CURSO_MAXIMO = 300   # una reserva más vieja se considera abandonada (proceso caído)
+IDEMPOTENCIA_VIGENCIA = timedelta(hours=24)
+
+def huella_solicitud(alcance: str, datos) -> str:
+    """Hash del cuerpo de la solicitud: una clave solo puede repetir la misma solicitud."""
+    contenido = json.dumps({"alcance": alcance, "datos": datos}, sort_keys=True, default=str)
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+def reservar_clave_idempotencia(clave: str, alcance: str, huella: str) -> Optional[tuple]:
+    """
+    Reserva la clave para ejecutar la solicitud y devuelve None. Si la clave ya
+    tiene respuesta devuelve (codigo_estado, respuesta); si otra solicitud la
+    está ejecutando espera a que termine.
+    """
+    limite = time.monotonic() + IDEMPOTENCIA_ESPERA_MAXIMA
+    while True:
+        db = SessionLocal()
+        try:
+            db.add(ClaveIdempotencia(alcance=alcance, clave=clave, huella=huella, estado=EstadoIdempotencia.EN_CURSO))
+            try:
+                db.commit()
+                return None
+            except IntegrityError:
+                db.rollback()
+
+            existente = db.get(ClaveIdempotencia, (alcance, clave))
+            if existente is None:
+                # La ejecución anterior falló y liberó la clave: se vuelve a intentar
+                continue
+            antiguedad = ahora_local() - existente.fecha_creacion
+            vencida = antiguedad > IDEMPOTENCIA_VIGENCIA or (
+                existente.estado == EstadoIdempotencia.EN_CURSO
+                and antiguedad > timedelta(seconds=IDEMPOTENCIA_EN_CURSO_MAXIMO)
+            )
+            if vencida:
+                db.delete(existente)
+                db.commit()
+                continue
+            if existente.huella != huella:
+                raise exceptions.ClaveIdempotenciaReutilizada()
+            if existente.estado == EstadoIdempotencia.COMPLETADA:
+                return existente.codigo_estado, json.loads(existente.respuesta)
+        finally:
+            db.close()
+
+        if time.monotonic() >= limite:
+            raise exceptions.SolicitudIdempotenteEnCurso()
+        time.sleep(IDEMPOTENCIA_INTERVALO)
+
+def guardar_respuesta_idempotente(db: Session, clave: str, alcance: str, codigo_estado: int, respuesta) -> None:
+    """Marca la clave como completada en la transacción de `db`, sin confirmarla."""
+    db.query(ClaveIdempotencia).filter(
+        ClaveIdempotencia.alcance == alcance, ClaveIdempotencia.clave == clave
+    ).update({
+        ClaveIdempotencia.estado: EstadoIdempotencia.COMPLETADA,
+        ClaveIdempotencia.codigo_estado: codigo_estado,
+        ClaveIdempotencia.respuesta: json.dumps(respuesta),
+        ClaveIdempotencia.fecha_completada: now(),
+    }, synchronize_session=False)
+
+def completar_clave_idempotencia(clave: str, alcance: str, codigo_estado: int, respuesta) -> None:
+    db = SessionLocal()
     try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)  # Cambia si usas otro servicio
-        server.starttls()  # Inicia conexión segura
-        server.login(remitente, password)  # Autenticación
-        server.sendmail(remitente, destinatario, msg.as_string())  # Envía el correo
-        server.quit()  # Cierra la conexión
-        print("Correo enviado exitosamente")
-    except Exception as e:
-        print(f"Error al enviar correo: {e}")
-        # Aquí podrías lanzar una excepción o manejarlo según tu lógica
-def crear_pedido(db: Session, pedido: schemas.PedidoCreate) -> Pedido:
+        guardar_respuesta_idempotente(db, clave, alcance, codigo_estado, respuesta)
+        db.commit()
+    finally:
+        db.close()
+
+def liberar_clave_idempotencia(clave: str, alcance: str) -> None:
+    """Borra la reserva de una ejecución que falló para que el cliente pueda reintentar."""
+    db = SessionLocal()
+    try:
+        db.query(ClaveIdempotencia).filter(
+            ClaveIdempotencia.alcance == alcance,
+            ClaveIdempotencia.clave == clave,
+            ClaveIdempotencia.estado == EstadoIdempotencia.EN_CURSO,
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def respuesta_idempotente(codigo_estado: int, contenido, repetida: bool = False) -> JSONResponse:
+    respuesta = JSONResponse(content=contenido, status_code=codigo_estado)
+    if repetida:
+        respuesta.headers["Idempotent-Replayed"] = "true"
+    return respuesta
+
+def ejecutar_idempotente(clave: str, alcance: str, datos, ejecutar, codigo_estado: int = status.HTTP_200_OK) -> JSONResponse:
+    """
+    Ejecuta `ejecutar(guardar)` una sola vez por clave. Los reintentos con la
+    misma clave reciben la respuesta guardada sin volver a ejecutar nada.
+    La operación puede llamar `guardar(db, respuesta)` antes de su commit para
+    que la clave se complete en su misma transacción; si no lo hace, la clave
+    se completa al terminar.
+    """
+    guardada = reservar_clave_idempotencia(clave, alcance, huella_solicitud(alcance, datos))
+    if guardada is not None:
+        return respuesta_idempotente(*guardada, repetida=True)
+    guardadas = []
+
+    def guardar(sesion: Session, respuesta) -> None:
+        guardadas.append(jsonable_encoder(respuesta))
+        guardar_respuesta_idempotente(sesion, clave, alcance, codigo_estado, guardadas[-1])
+
+    try:
+        contenido = jsonable_encoder(ejecutar(guardar))
+    except BaseException:
+        liberar_clave_idempotencia(clave, alcance)
+        raise
+    if guardadas:
+        # Se responde lo mismo que recibirán los reintentos
+        contenido = guardadas[-1]
+    else:
+        completar_clave_idempotencia(clave, alcance, codigo_estado, contenido)
+    return respuesta_idempotente(codigo_estado, contenido)
+
+#RESERVAS DE STOCK
+#------------------------------------------------------------------------------------------------------------
+# Minutos que se aparta el stock del carrito mientras el cliente paga
+RESERVA_STOCK_MINUTOS = float(os.getenv("RESERVA_STOCK_MINUTOS", "15"))
+
+def stock_reservado_por_otros(usuario_id: int, ahora: datetime):
+    """Subconsulta correlacionada: unidades de cada producto reservadas por otros usuarios."""
+    return select(func.coalesce(func.sum(ReservaStock.cantidad), 0))\
+        .where(
+            ReservaStock.producto_id == Producto.id,
+            ReservaStock.usuario_id != usuario_id,
+            ReservaStock.vence > ahora,
+        )\
+        .scalar_subquery()
+
+def cantidades_del_carrito(db: Session, usuario_id: int) -> dict:
+    return dict(
+        db.query(CarritoDetalle.producto_id, func.sum(CarritoDetalle.cantidad))
+          .join(Carrito, Carrito.id == CarritoDetalle.carrito_id)
+          .filter(Carrito.usuario_id == usuario_id)
+          .group_by(CarritoDetalle.producto_id)
+    )
+
+def productos_sin_disponibilidad(db: Session, usuario_id: int, cantidades: dict) -> List[int]:
+    """Productos cuyo stock, descontando lo reservado por otros, no cubre la cantidad pedida."""
+    ahora = ahora_local()
+    disponibles = dict(
+        db.query(Producto.id, Producto.stock - stock_reservado_por_otros(usuario_id, ahora))
+          .filter(Producto.id.in_(cantidades))
+    )
+    return [
+        producto_id for producto_id, cantidad in cantidades.items()
+        if disponibles.get(producto_id, 0) < cantidad
+    ]
+
+def tomar_bloqueo_escritura_sqlite(db: Session) -> None:
+    """
+    En SQLite abre la transacción con BEGIN IMMEDIATE, que toma el bloqueo de
+    escritura antes de la primera lectura (esperando busy_timeout si otro lo
+    tiene). Una transacción diferida que ya leyó y después quiere escribir
+    falla en WAL con "database is locked" si otro escribió en el medio. Si la
+    transacción ya está abierta no hace nada; en otros motores tampoco.
+    """
+    conexion = db.connection()
+    if conexion.dialect.name != "sqlite":
+        return
+    if not conexion.connection.dbapi_connection.in_transaction:
+        db.execute(text("BEGIN IMMEDIATE"))
+
+def reservar_stock(db: Session, usuario_id: int) -> int:
     """
-    Crea y guarda un nuevo pedido en la base de datos, asegura que el stock se descuente
-    correctamente y envía un correo con el detalle del pedido.
+    Aparta el contenido del carrito del usuario por RESERVA_STOCK_MINUTOS,
+    reemplazando su reserva anterior, y devuelve cuántos productos apartó.
+    Antes de sumar las reservas ajenas se bloquean las filas de los productos
+    (SELECT ... FOR UPDATE, en orden de id para no cruzarse): dos checkouts
+    sobre el mismo producto se atienden de a uno. En SQLite el FOR UPDATE no
+    existe: la transacción entera corre con el bloqueo de escritura de la
+    base tomado desde el principio (ver tomar_bloqueo_escritura_sqlite).
+    """
+    tomar_bloqueo_escritura_sqlite(db)
+    cantidades = cantidades_del_carrito(db, usuario_id)
+    if not cantidades:
+        db.rollback()
+        raise exceptions.CarritoVacio()
+
+    db.query(Producto.id)\
+      .filter(Producto.id.in_(cantidades))\
+      .order_by(Producto.id)\
+      .with_for_update()\
+      .all()
+    vence = ahora_local() + timedelta(minutes=RESERVA_STOCK_MINUTOS)
+    db.query(ReservaStock).filter(ReservaStock.usuario_id == usuario_id).delete(synchronize_session=False)
+    # Un solo INSERT para todas las líneas, igual que los detalles del pedido
+    db.execute(insert(ReservaStock), [
+        {"producto_id": producto_id, "usuario_id": usuario_id, "cantidad": cantidad, "vence": vence}
+        for producto_id, cantidad in cantidades.items()
+    ])
+
+    faltantes = productos_sin_disponibilidad(db, usuario_id, cantidades)
+    if faltantes:
+        db.rollback()
+        raise exceptions.StockInsuficiente(faltantes)
+    db.commit()
+    return len(cantidades)
+
+def liberar_reservas_usuario(db: Session, usuario_id: int) -> int:
+    liberadas = db.query(ReservaStock)\
+                  .filter(ReservaStock.usuario_id == usuario_id)\
+                  .delete(synchronize_session=False)
+    db.commit()
+    return liberadas
+
+def liberar_reservas_vencidas(db: Session) -> int:
+    """Borra de una vez todas las reservas vencidas."""
+    liberadas = db.query(ReservaStock)\
+                  .filter(ReservaStock.vence <= ahora_local())\
+                  .delete(synchronize_session=False)
+    db.commit()
+    return liberadas
+
+#PEDIDO
+#--------------------------------------------------------------------------------------
+# Crear Pedido
+def crear_pedido(
+    db: Session, pedido: schemas.PedidoCreate, al_confirmar: Optional[Callable[[Session, Pedido], None]] = None
+) -> Pedido:
+    """
+    Guarda el pedido con sus detalles, descuenta el stock, vacía el carrito y
+    encola el correo de confirmación, todo en una sola transacción. Si algún
+    producto no tiene stock suficiente se rechaza el pedido completo.
+    `al_confirmar(db, pedido)` corre justo antes del commit, dentro de la
+    misma transacción (ej. para guardar la respuesta idempotente).
     """
     # Obtener el carrito del usuario
-    carrito = db.query(Carrito).filter(Carrito.usuario_id == pedido.usuario_id).first()
+    carrito = db.query(Carrito)\
+                .options(selectinload(Carrito.carritoDetalle))\
+                .filter(Carrito.usuario_id == pedido.usuario_id)\
+                .first()
     if not carrito or not carrito.carritoDetalle:
-        raise ValueError("El carrito está vacío o no existe.")
+        raise exceptions.CarritoVacio()
+
+    # Cantidad total pedida de cada producto
+    cantidades = defaultdict(int)
+    for item in carrito.carritoDetalle:
+        cantidades[item.producto_id] += item.cantidad
+
+    # Los subtotales de cada detalle y el total salen de la misma consulta,
+    # con los precios vigentes (como calcular_totales_carrito), no de lo que
+    # quedó guardado en el carrito ni de lo que mande el cliente
+    descuento_vigente, precio_unitario = precio_con_descuento_vigente(ahora_local())
+    lineas = db.query(
+        CarritoDetalle.producto_id,
+        CarritoDetalle.cantidad,
+        precio_unitario,
+        CarritoDetalle.cantidad * func.coalesce(Producto.costo_envio, 0),
+    ).join(Producto, Producto.id == CarritoDetalle.producto_id)\
+     .outerjoin(Descuento, descuento_vigente)\
+     .filter(CarritoDetalle.carrito_id == carrito.id)\
+     .all()
+    subtotal = sum(cantidad * precio for _, cantidad, precio, _ in lineas)
+    envio = sum(costo_envio for *_, costo_envio in lineas)
 
     # Crear el nuevo pedido
     nuevo_pedido = Pedido(
-        total=pedido.total,
+        total=round(subtotal + envio, 2),
         usuario_id=pedido.usuario_id
     )
     db.add(nuevo_pedido)
     db.flush()  # Para obtener el ID del pedido antes de hacer commit
 
-    # Procesar los productos en el carrito
-    for item in carrito.carritoDetalle:
-        producto = db.query(Producto).filter(Producto.id == item.producto_id).first()
-        
-        if not producto:
-            raise ValueError(f"El producto con ID {item.producto_id} no existe.")
-        
-        # Verificar que haya suficiente stock
-        if producto.stock < item.cantidad:
-            raise ValueError(f"Stock insuficiente para el producto {producto.nombre} (ID {producto.id}).")
-
-        # Restar la cantidad comprada del stock
-        producto.stock -= item.cantidad
-        db.add(producto)
-
-        # Agregar el detalle del pedido
-        nuevo_detalle = PedidoDetalle(
-            cantidad=item.cantidad,
-            subtotal=item.subtotal,
-            precio_unitario=(item.subtotal / item.cantidad) if item.cantidad > 0 else 0,
-            pedido_id=nuevo_pedido.id,
-            producto_id=item.producto_id
-        )
-        db.add(nuevo_detalle)
+    # Descontar el stock con un único UPDATE condicional: la verificación y la
+    # resta ocurren en la misma sentencia, así dos compras simultáneas no
+    # pueden vender el mismo stock. Lo reservado por otros usuarios durante su
+    # checkout no está disponible. Si no se actualizaron todas las filas,
+    # algún producto no existe o no alcanza.
+    cantidad_pedida = case(cantidades, value=Producto.id)
+    reservado = stock_reservado_por_otros(pedido.usuario_id, ahora_local())
+    actualizados = db.query(Producto)\
+                     .filter(Producto.id.in_(cantidades), Producto.stock - reservado >= cantidad_pedida)\
+                     .update({Producto.stock: Producto.stock - cantidad_pedida}, synchronize_session=False)
+    if actualizados != len(cantidades):
+        db.rollback()
+        raise exceptions.StockInsuficiente(productos_sin_disponibilidad(db, pedido.usuario_id, cantidades))
+
+    # La reserva del usuario ya se convirtió en descuento real de stock
+    db.query(ReservaStock).filter(ReservaStock.usuario_id == pedido.usuario_id).delete(synchronize_session=False)
+
+    # Agregar los detalles del pedido
+    db.execute(insert(PedidoDetalle), [
+        {
+            "cantidad": cantidad,
+            "subtotal": cantidad * precio,
+            "precio_unitario": precio,
+            "pedido_id": nuevo_pedido.id,
+            "producto_id": producto_id,
+        }
+        for producto_id, cantidad, precio, _ in lineas
+    ])
 
     # Vaciar el carrito después de generar el pedido
     db.query(CarritoDetalle).filter(CarritoDetalle.carrito_id == carrito.id).delete()
+    marcar_carrito_modificado(db, carrito.id)
+
+    # El correo de confirmación sale por la bandeja de salida
+    correo = armar_correo_pedido(db, nuevo_pedido)
+    if correo:
+        encolar_correo(db, correo[0], "Confirmación de Pedido", correo[1])
 
     # Confirmar los cambios en la base de datos
+    incrementar_version(db, "productos")
+    if al_confirmar:
+        al_confirmar(db, nuevo_pedido)
     db.commit()
+    invalidar_conteos("pedidos", "correos_pendientes")
+    invalidar_productos_cacheados(*cantidades)
     db.refresh(nuevo_pedido)
-    print("ACAA");
+    return nuevo_pedido
 
-    # --- Nueva lógica para enviar el correo ---
-    # Obtener el correo del usuario
-    usuario = db.query(Usuario).filter(Usuario.id == pedido.usuario_id).first()
-    if not usuario or not hasattr(usuario, 'email') or not usuario.email:
-        raise ValueError("El usuario no tiene un correo electrónico registrado.")
+def armar_correo_pedido(db: Session, nuevo_pedido: Pedido) -> Optional[tuple[str, str]]:
+    """Devuelve el destinatario y el cuerpo del correo de confirmación."""
+    # Obtener el correo del usuario; sin correo registrado no hay a quién avisar
+    usuario = db.query(Usuario).filter(Usuario.id == nuevo_pedido.usuario_id).first()
+    if not usuario or not usuario.email:
+        return None
 
     # Obtener los detalles del pedido
-    detalles = db.query(PedidoDetalle).filter(PedidoDetalle.pedido_id == nuevo_pedido.id).all()
+    detalles = db.query(PedidoDetalle)\
+                 .options(joinedload(PedidoDetalle.producto))\
+                 .filter(PedidoDetalle.pedido_id == nuevo_pedido.id)\
+                 .all()
     detalle_texto = "\n".join(
         [f"{d.cantidad} x {d.producto.nombre} - ${d.subtotal}" for d in detalles]
     )
@@ -821,21 +1565,12 @@ def crear_pedido(db: Session, pedido: schemas.PedidoCreate) -> Pedido:
 
     Su pedido será procesado pronto. Gracias por elegirnos.
     """
-    print("ACAA");
-    # Enviar el correo
-    enviar_correo(usuario.email, "Confirmación de Pedido", cuerpo)
-
-    return nuevo_pedido
+    return usuario.email, cuerpo
 
 #Listar pedidos
 
-def listar_pedidos(db: Session, pagina: int, tamanio: int) -> dict:
-    total = db.query(Pedido).count()
-    pedidos = (db.query(Pedido)
-                .offset((pagina - 1) * tamanio)
-                .limit(tamanio)
-                .all())
-    return {"total": total, "pagina": pagina, "tamanio": tamanio, "pedidos": pedidos}
+def listar_pedidos(db: Session, pagina: int, tamanio: int, after: Optional[str] = None, total: str = "exact") -> dict:
+    return paginar(db.query(Pedido), [(Pedido.id, False)], pagina, tamanio, after, "pedidos", total=total)
 
 
 #Obtener pedido por ID
@@ -849,6 +1584,19 @@ def obtener_pedido_por_id(db: Session, pedido_id: int) -> Pedido:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pedido no encontrado")
     return pedido
 
+def obtener_pedido_historico(db: Session, pedido_id: int):
+    """
+    Como `obtener_pedido_por_id`, pero encuentra también los pedidos
+    archivados. Solo para lectura: los archivados no se modifican.
+    """
+    historicos = pedidos_historicos()
+    pedido = db.query(
+        historicos.id, historicos.fecha_creacion, historicos.total, historicos.estado, historicos.usuario_id,
+    ).filter(historicos.id == pedido_id).first()
+    if not pedido:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pedido no encontrado")
+    return pedido
+
 #Actualizar pedido
 def actualizar_pedido(db: Session, pedido_id: int, pedido_update: schemas.PedidoUpdate) -> Pedido:
     """
@@ -871,6 +1619,7 @@ def eliminar_pedido(db: Session, pedido_id: int) -> None:
     pedido = obtener_pedido_por_id(db, pedido_id)
     db.delete(pedido)
     db.commit()
+    invalidar_conteos("pedidos")
     
 #Obtener pedidos de un usuario
 def obtener_pedidos_por_usuario(db: Session, usuario_id: int):
@@ -879,12 +1628,54 @@ def obtener_pedidos_por_usuario(db: Session, usuario_id: int):
     """
     return db.query(Pedido).filter(Pedido.usuario_id == usuario_id).all()
 
+def listar_pedidos_completos_usuario(db: Session, usuario_id: int, pagina: int, tamanio: int, after: Optional[str] = None) -> dict:
+    """
+    Historial del usuario, del pedido más nuevo al más viejo, incluidos los
+    pedidos archivados. Los detalles, sus productos y los envíos de la página
+    se traen con una consulta cada uno: la cantidad de consultas es fija sin
+    importar cuántos pedidos tenga la página.
+    """
+    historicos = pedidos_historicos()
+    query = db.query(historicos.id).filter(historicos.usuario_id == usuario_id)
+    resultado = paginar(query, [(historicos.id, True)], pagina, tamanio, after, "pedidos", filtros=("usuario", usuario_id))
+    ids = resultado["pedidos"]
+    if not ids:
+        return resultado
+
+    pedidos = {
+        fila.id: {**fila._asdict(), "pedidoDetalle": [], "envio": []}
+        for fila in db.query(
+            historicos.id, historicos.fecha_creacion, historicos.total, historicos.estado, historicos.usuario_id,
+        ).filter(historicos.id.in_(ids))
+    }
+    detalles = detalles_historicos()
+    filas_detalle = db.query(
+        detalles.id, detalles.cantidad, detalles.subtotal, detalles.precio_unitario, detalles.pedido_id, detalles.producto_id,
+    ).filter(detalles.pedido_id.in_(ids)).order_by(detalles.id).all()
+    productos = {
+        producto.id: producto
+        for producto in db.query(Producto.id, Producto.nombre, Producto.imagen)
+                          .filter(Producto.id.in_({fila.producto_id for fila in filas_detalle}))
+    }
+    for fila in filas_detalle:
+        pedidos[fila.pedido_id]["pedidoDetalle"].append({**fila._asdict(), "producto": productos.get(fila.producto_id)})
+
+    envios = envios_historicos()
+    for fila in db.query(envios.id, envios.estado, envios.codigoSeguimiento, envios.empresa_id, envios.pedido_id)\
+                  .filter(envios.pedido_id.in_(ids)).order_by(envios.id):
+        pedidos[fila.pedido_id]["envio"].append(fila)
+
+    resultado["pedidos"] = [pedidos[pedido_id] for pedido_id in ids]
+    return resultado
+
 #Actualizar el estado de un pedido
 def actualizar_estado_pedido(db: Session, pedido_id: int, nuevo_estado: schemas.EstadoPedidoEnum) -> Pedido:
     """
-    Actualiza únicamente el estado de un pedido.
+    Actualiza únicamente el estado de un pedido. A diferencia del cambio
+    masivo no aplica TRANSICIONES_PEDIDO: el administrador puede corregir un
+    pedido a cualquier estado. La fila se bloquea mientras se modifica.
     """
-    pedido = db.query(Pedido).filter(Pedido.id == pedido_id).first()
+    pedido = db.query(Pedido).filter(Pedido.id == pedido_id).with_for_update().first()
     if not pedido:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pedido no encontrado")
     
@@ -908,6 +1699,76 @@ def cancelar_pedido(db: Session, pedido_id: int) -> Pedido:
     return pedido
     
 
+# Estados a los que puede pasar un pedido desde cada estado
+TRANSICIONES_PEDIDO = {
+    EstadoPedido.PENDIENTE: {EstadoPedido.ENVIADO, EstadoPedido.CANCELADO},
+    EstadoPedido.ENVIADO: {EstadoPedido.ENTREGADO},
+    EstadoPedido.ENTREGADO: set(),
+    EstadoPedido.CANCELADO: set(),
+}
+
+# Cambiar el estado de muchos pedidos a la vez
+def actualizar_estado_pedidos(db: Session, pedido_ids: List[int], nuevo_estado: schemas.EstadoPedidoEnum, usuario_id: int) -> dict:
+    """
+    Pasa los pedidos indicados a `nuevo_estado` con un único UPDATE que solo
+    toca los que están en un estado de origen válido, y registra una actividad
+    por pedido actualizado en un solo INSERT. Devuelve el resultado de cada id.
+    """
+    destino = EstadoPedido(nuevo_estado.value)
+    ids = list(dict.fromkeys(pedido_ids))
+    origenes = [origen for origen, destinos in TRANSICIONES_PEDIDO.items() if destino in destinos]
+
+    # Las filas quedan bloqueadas desde la lectura (en orden de id, para no
+    # cruzarse con otro cambio masivo): el estado anterior que se informa y se
+    # registra es el que el UPDATE reemplaza. La condición sobre el estado se
+    # mantiene en el UPDATE como resguardo
+    anteriores = dict(
+        db.query(Pedido.id, Pedido.estado)
+          .filter(Pedido.id.in_(ids))
+          .order_by(Pedido.id)
+          .with_for_update()
+    )
+    actualizados = set(db.execute(
+        update(Pedido)
+        .where(Pedido.id.in_(ids), Pedido.estado.in_(origenes))
+        .values(estado=destino)
+        .returning(Pedido.id)
+    ).scalars())
+
+    if actualizados:
+        db.execute(insert(Actividad), [
+            {
+                "tipo_evento": TipoActividad.ACTUALIZACION_PEDIDO,
+                "descripcion": f"Pedido {pedido_id} pasó de {anteriores[pedido_id].value} a {destino.value}",
+                "referencia_id": pedido_id,
+                "usuario_id": usuario_id,
+                "fecha": now(),
+            }
+            for pedido_id in actualizados
+        ])
+    db.commit()
+    if actualizados:
+        invalidar_conteos("actividades")
+
+    resultados = []
+    for pedido_id in ids:
+        anterior = anteriores.get(pedido_id)
+        if pedido_id in actualizados:
+            error = None
+        elif anterior is None:
+            error = "Pedido no encontrado"
+        elif anterior == destino:
+            error = f"El pedido ya está {destino.value}"
+        else:
+            error = f"No se puede pasar de {anterior.value} a {destino.value}"
+        resultados.append({
+            "pedido_id": pedido_id,
+            "actualizado": pedido_id in actualizados,
+            "estado_anterior": anterior.value if anterior else None,
+            "error": error,
+        })
+    return {"estado": destino.value, "actualizados": len(actualizados), "resultados": resultados}
+
 #DETALLE PEDIDO
 #--------------------------------------------------------------------------------------
 # Crear detalle de pedido
@@ -1051,6 +1912,7 @@ def crear_detalle(db: Session, detalle_data: CarritoDetalle, carrito_id: int, pr
         subtotal=detalle_data.subtotal
     )
     db.add(new_detalle)
+    marcar_carrito_modificado(db, carrito_id)
     db.commit()
     db.refresh(new_detalle)
     return new_detalle
@@ -1069,22 +1931,15 @@ def agregar_producto_al_carrito(db: Session, carrito_id: int, producto_id: int,
     """
     Agrega un producto al carrito.
     Si el producto ya existe en el carrito, se suma la cantidad y se actualiza el subtotal.
-    Se calcula el precio con descuento (si aplica y si es de tipo "PORCENTAJE") antes de establecer el subtotal.
+    El subtotal se calcula con el precio final del producto, que ya tiene aplicado
+    el descuento vigente (ver recalcular_precios_finales).
     """
-    # Primero, obtener la información del producto para conocer su precio y posible descuento
+    # Primero, obtener la información del producto para conocer su precio final
     producto = db.query(Producto).filter(Producto.id == producto_id).first()
     if not producto:
         raise Exception("Producto no encontrado")
     
-    # Por defecto, el precio final es el precio original
-    precio_final = producto.precio
-    # Verificar si el producto tiene un descuento asignado
-    if producto.descuento_id and producto.descuento_id > 0:
-        # Consultar el objeto de descuento para validar el tipo
-        descuento_obj = db.query(Descuento).filter(Descuento.id == producto.descuento_id).first()
-        if descuento_obj and descuento_obj.tipo == TipoDescuento.PORCENTAJE:
-            # Aplicar el descuento porcentual
-            precio_final = producto.precio * (1 - descuento_obj.valor / 100)
+    precio_final = producto.precio_final if producto.precio_final is not None else producto.precio
 
     # Calcular el subtotal según la cantidad agregada
     subtotal_calculado = precio_final * detalle_data.cantidad
@@ -1099,6 +1954,7 @@ def agregar_producto_al_carrito(db: Session, carrito_id: int, producto_id: int,
         # Si ya existe, se actualiza la cantidad y se suma el nuevo subtotal calculado
         detalle_existente.cantidad += detalle_data.cantidad
         detalle_existente.subtotal += subtotal_calculado
+        marcar_carrito_modificado(db, carrito_id)
         db.commit()
         db.refresh(detalle_existente)
         return detalle_existente
@@ -1111,6 +1967,7 @@ def agregar_producto_al_carrito(db: Session, carrito_id: int, producto_id: int,
             subtotal=subtotal_calculado
         )
         db.add(nuevo_detalle)
+        marcar_carrito_modificado(db, carrito_id)
         db.commit()
         db.refresh(nuevo_detalle)
         return nuevo_detalle
@@ -1122,7 +1979,7 @@ def agregar_producto_al_carrito(db: Session, carrito_id: int, producto_id: int,
 def actualizar_cantidad_producto(db: Session, carrito_id: int, producto_id: int, nueva_cantidad: int):
     """
     Actualiza la cantidad de un producto en el carrito.
-    Aquí se podría recalcular el subtotal según la lógica de negocio (por ejemplo, multiplicando por el precio unitario).
+    El subtotal se recalcula con el precio final del producto, igual que al agregarlo.
     """
     detalle = db.query(CarritoDetalle).filter(
         CarritoDetalle.carrito_id == carrito_id,
@@ -1133,8 +1990,10 @@ def actualizar_cantidad_producto(db: Session, carrito_id: int, producto_id: int,
     if not detalle:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado en el carrito")
     
+    precio_final = producto.precio_final if producto.precio_final is not None else producto.precio
     detalle.cantidad = nueva_cantidad
-    detalle.subtotal = producto.precio * nueva_cantidad
+    detalle.subtotal = precio_final * nueva_cantidad
+    marcar_carrito_modificado(db, carrito_id)
 
     db.commit()
     db.refresh(detalle)
@@ -1152,6 +2011,7 @@ def eliminar_producto_del_carrito(db: Session, carrito_id: int, producto_id: int
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado en el carrito")
     
     db.delete(detalle)
+    marcar_carrito_modificado(db, carrito_id)
     db.commit()
     return {"detail": "Producto eliminado del carrito"}
 
@@ -1167,17 +2027,204 @@ def obtener_carrito_o_crear(db: Session, usuario_id: int):
 def vaciar_carrito(db: Session, carrito_id: int):
     """Elimina todos los productos de un carrito sin eliminar el carrito."""
     db.query(CarritoDetalle).filter(CarritoDetalle.carrito_id == carrito_id).delete()
+    marcar_carrito_modificado(db, carrito_id)
+    db.commit()
+
+def marcar_carrito_modificado(db: Session, carrito_id: int):
+    """Incrementa la versión del carrito; se llama antes del commit que cambia sus detalles."""
+    db.query(Carrito).filter(Carrito.id == carrito_id).update(
+        {Carrito.version: Carrito.version + 1, Carrito.fecha_actualizacion: ahora_local()},
+        synchronize_session=False,
+    )
+
+def precio_con_descuento_vigente(ahora: datetime):
+    """
+    Condición para unir cada producto con su descuento vigente y el precio
+    unitario resultante. Como en expresion_precio_final, sólo los descuentos
+    PORCENTAJE activos y dentro de su ventana cambian el precio.
+    """
+    descuento_vigente = and_(
+        Descuento.id == Producto.descuento_id,
+        Descuento.activo.is_(True),
+        Descuento.tipo == TipoDescuento.PORCENTAJE,
+        Descuento.fecha_inicio <= ahora,
+        or_(Descuento.fecha_fin.is_(None), Descuento.fecha_fin > ahora),
+    )
+    return descuento_vigente, Producto.precio * (1 - func.coalesce(Descuento.valor, 0) / 100.0)
+
+def precios_vigentes(db: Session, producto_ids, estricto: bool = True) -> dict:
+    """
+    Precio unitario vigente de varios productos, con su descuento, en una sola
+    consulta. Si `estricto`, lanza ProductoNoEncontrado con los ids que no
+    existen; si no, simplemente no aparecen en el resultado.
+    """
+    ids = set(producto_ids)
+    if not ids:
+        return {}
+    descuento_vigente, precio_unitario = precio_con_descuento_vigente(ahora_local())
+    precios = dict(
+        db.query(Producto.id, precio_unitario)
+          .outerjoin(Descuento, descuento_vigente)
+          .filter(Producto.id.in_(ids))
+          .all()
+    )
+    faltantes = sorted(ids - precios.keys())
+    if faltantes and estricto:
+        raise exceptions.ProductoNoEncontrado(faltantes)
+    return precios
+
+# Operaciones en lote sobre el carrito
+def aplicar_operaciones_carrito(db: Session, carrito_id: int, operaciones: List[schemas.OperacionCarrito]) -> List[CarritoDetalle]:
+    """
+    Aplica en orden una lista de operaciones (agregar, actualizar, eliminar)
+    en una sola transacción: una consulta para los precios de todos los
+    productos, otra para las líneas del carrito y un único commit. Si algún
+    producto no existe no se aplica ninguna.
+
+    El subtotal de cada línea tocada se recalcula con el precio vigente.
+    Quitar un producto que no está en el carrito no es un error.
+    """
+    precios = precios_vigentes(db, (operacion.producto_id for operacion in operaciones))
+    lineas = {
+        detalle.producto_id: detalle
+        for detalle in db.query(CarritoDetalle).filter(CarritoDetalle.carrito_id == carrito_id)
+    }
+
+    for operacion in operaciones:
+        detalle = lineas.get(operacion.producto_id)
+        if operacion.tipo == schemas.TipoOperacionCarrito.AGREGAR:
+            cantidad = (detalle.cantidad if detalle else 0) + operacion.cantidad
+        elif operacion.tipo == schemas.TipoOperacionCarrito.ACTUALIZAR:
+            cantidad = operacion.cantidad
+        else:
+            cantidad = 0
+
+        if detalle is None:
+            if cantidad == 0:
+                continue
+            detalle = CarritoDetalle(carrito_id=carrito_id, producto_id=operacion.producto_id)
+            db.add(detalle)
+            lineas[operacion.producto_id] = detalle
+        # Una línea quitada queda en 0 hasta el final: si el lote la vuelve a
+        # agregar se reutiliza la misma fila en lugar de insertar otra
+        detalle.cantidad = cantidad
+        detalle.subtotal = round(precios[operacion.producto_id] * cantidad, 2)
+
+    for producto_id, detalle in list(lineas.items()):
+        if detalle.cantidad == 0:
+            # Una línea creada en este mismo lote todavía no está en la base
+            if detalle in db.new:
+                db.expunge(detalle)
+            else:
+                db.delete(detalle)
+            del lineas[producto_id]
+
+    marcar_carrito_modificado(db, carrito_id)
     db.commit()
+    return sorted(lineas.values(), key=lambda detalle: detalle.id)
+
+# Totales del carrito
+def calcular_totales_carrito(db: Session, carrito_id: int) -> dict:
+    """
+    Subtotal, descuento y envío del carrito calculados por el servidor en una
+    sola consulta agregada sobre los detalles, sus productos y el descuento
+    vigente de cada uno.
+
+    El resultado se cachea por versión del carrito y del catálogo: recargar
+    la página de checkout no vuelve a calcularlo.
+    """
+    version_carrito = db.query(Carrito.version).filter(Carrito.id == carrito_id).scalar()
+    if version_carrito is None:
+        raise exceptions.CarritoVacio()
+    versiones = obtener_versiones(db, "productos", "descuentos")
+    clave = (carrito_id, version_carrito, versiones["productos"], versiones["descuentos"])
+
+    def calcular():
+        descuento_vigente, precio_unitario = precio_con_descuento_vigente(ahora_local())
+        fila = db.query(
+            func.count(CarritoDetalle.id),
+            func.coalesce(func.sum(CarritoDetalle.cantidad), 0),
+            func.coalesce(func.sum(CarritoDetalle.cantidad * Producto.precio), 0),
+            func.coalesce(func.sum(CarritoDetalle.cantidad * precio_unitario), 0),
+            func.coalesce(func.sum(CarritoDetalle.cantidad * func.coalesce(Producto.costo_envio, 0)), 0),
+        ).select_from(CarritoDetalle)\
+         .join(Producto, Producto.id == CarritoDetalle.producto_id)\
+         .outerjoin(Descuento, descuento_vigente)\
+         .filter(CarritoDetalle.carrito_id == carrito_id)\
+         .one()
+        lineas, unidades, subtotal_lista, subtotal, envio = fila
+        return {
+            "carrito_id": carrito_id,
+            "lineas": lineas,
+            "unidades": unidades,
+            "subtotal_lista": round(subtotal_lista, 2),
+            "descuento": round(subtotal_lista - subtotal, 2),
+            "subtotal": round(subtotal, 2),
+            "envio": round(envio, 2),
+            "total": round(subtotal + envio, 2),
+        }
+
+    return cache_totales_carrito.obtener_o_calcular(clave, calcular)
+
+# Resumen del carrito para mostrarlo
+def obtener_resumen_carrito(db: Session, carrito_id: int) -> dict:
+    """
+    Líneas del carrito con el nombre, la imagen, el precio vigente y el stock
+    de cada producto, más los totales, salidos de una sola consulta. Los
+    totales se suman con las mismas reglas que calcular_totales_carrito.
+    """
+    descuento_vigente, precio_unitario = precio_con_descuento_vigente(ahora_local())
+    filas = db.query(
+        CarritoDetalle.id,
+        CarritoDetalle.producto_id,
+        CarritoDetalle.cantidad,
+        Producto.nombre,
+        Producto.imagen,
+        Producto.precio,
+        precio_unitario.label("precio_final"),
+        Producto.stock,
+        func.coalesce(Producto.costo_envio, 0).label("costo_envio"),
+    ).join(Producto, Producto.id == CarritoDetalle.producto_id)\
+     .outerjoin(Descuento, descuento_vigente)\
+     .filter(CarritoDetalle.carrito_id == carrito_id)\
+     .order_by(CarritoDetalle.id)\
+     .all()
+
+    items = [
+        {
+            "detalle_id": fila.id,
+            "producto_id": fila.producto_id,
+            "nombre": fila.nombre,
+            "imagen": fila.imagen,
+            "cantidad": fila.cantidad,
+            "precio": fila.precio,
+            "precio_final": round(fila.precio_final, 2),
+            "subtotal": round(fila.precio_final * fila.cantidad, 2),
+            "stock": fila.stock,
+        }
+        for fila in filas
+    ]
+    subtotal_lista = sum(fila.precio * fila.cantidad for fila in filas)
+    subtotal = sum(fila.precio_final * fila.cantidad for fila in filas)
+    envio = sum(fila.costo_envio * fila.cantidad for fila in filas)
+    return {
+        "items": items,
+        "totales": {
+            "carrito_id": carrito_id,
+            "lineas": len(filas),
+            "unidades": sum(fila.cantidad for fila in filas),
+            "subtotal_lista": round(subtotal_lista, 2),
+            "descuento": round(subtotal_lista - subtotal, 2),
+            "subtotal": round(subtotal, 2),
+            "envio": round(envio, 2),
+            "total": round(subtotal + envio, 2),
+        },
+    }
 
 #ACTIVIDADES
 #------------------------------------------------------------------------------------------------------------
-def listar_actividades(db: Session, pagina: int, tamanio: int):
-    total = db.query(Actividad).count()
-    actividades = (db.query(Actividad)
-                .offset((pagina - 1) * tamanio)
-                .limit(tamanio)
-                .all())
-    return {"total": total, "pagina": pagina, "tamanio": tamanio, "actividades": actividades}
+def listar_actividades(db: Session, pagina: int, tamanio: int, after: Optional[str] = None, total: str = "exact"):
+    return paginar(db.query(Actividad), [(Actividad.id, False)], pagina, tamanio, after, "actividades", total=total)
 
 def registrar_actividad(db: Session, actividad_data: schemas.ActividadCreate):
     nueva_actividad = Actividad(
@@ -1188,12 +2235,225 @@ def registrar_actividad(db: Session, actividad_data: schemas.ActividadCreate):
     )
     db.add(nueva_actividad)
     db.commit()
+    invalidar_conteos("actividades")
     db.refresh(nueva_actividad)
     return nueva_actividad
 
+#ARCHIVO DE PEDIDOS
+#---------------------------------------------------------------------------------------------
+# Pedidos terminados con más de estos días pasan al archivo
+PEDIDOS_ARCHIVO_DIAS = int(os.getenv("PEDIDOS_ARCHIVO_DIAS", "365"))
+# Pedidos movidos por transacción: acota cuánto se bloquean las tablas
+PEDIDOS_ARCHIVO_LOTE = int(os.getenv("PEDIDOS_ARCHIVO_LOTE", "500"))
+ESTADOS_PEDIDO_FINALES = (EstadoPedido.ENTREGADO, EstadoPedido.CANCELADO)
+
+# (tabla activa, tabla de archivo, columna que la vincula con el pedido)
+TABLAS_ARCHIVO_PEDIDOS = (
+    (Pedido, PedidoArchivado, Pedido.id),
+    (PedidoDetalle, PedidoDetalleArchivado, PedidoDetalle.pedido_id),
+    (Envio, EnvioArchivado, Envio.pedido_id),
+    (Pago, PagoArchivado, Pago.pedido_id),
+)
+
+def archivar_pedidos(db: Session, dias: Optional[int] = None, lote: Optional[int] = None) -> int:
+    """
+    Mueve al archivo los pedidos ENTREGADOS o CANCELADOS más viejos que
+    `dias`, junto con sus detalles, envíos y pagos. Cada lote se copia y se
+    borra en su propia transacción. Devuelve la cantidad de pedidos movidos.
+    """
+    dias = PEDIDOS_ARCHIVO_DIAS if dias is None else dias
+    lote = lote or PEDIDOS_ARCHIVO_LOTE
+    limite = ahora_local() - timedelta(days=dias)
+    archivados = 0
+    while True:
+        ids = [pedido_id for (pedido_id,) in db.query(Pedido.id)
+               .filter(Pedido.estado.in_(ESTADOS_PEDIDO_FINALES), Pedido.fecha_creacion < limite)
+               .order_by(Pedido.id)
+               .limit(lote)]
+        if not ids:
+            break
+
+        fecha_archivado = literal(ahora_local(), DateTime)
+        for activa, archivo, columna in TABLAS_ARCHIVO_PEDIDOS:
+            columnas = list(activa.__table__.columns)
+            db.execute(
+                insert(archivo).from_select(
+                    [c.name for c in columnas] + ["fecha_archivado"],
+                    select(*columnas, fecha_archivado).where(columna.in_(ids)),
+                )
+            )
+        # Primero las tablas hijas, al final el pedido
+        for activa, _, columna in reversed(TABLAS_ARCHIVO_PEDIDOS):
+            db.query(activa).filter(columna.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        archivados += len(ids)
+
+    if archivados:
+        invalidar_conteos("pedidos")
+    return archivados
+
+def reservar_ids_archivados(db: Session) -> None:
+    """
+    En SQLite, lleva la secuencia AUTOINCREMENT de cada tabla activa por
+    encima del mayor id archivado. Hace falta una vez para las bases que
+    archivaron pedidos antes de tener AUTOINCREMENT: sin esto, las filas
+    nuevas podrían repetir ids que ya están en el archivo.
+    """
+    if db.bind.dialect.name != "sqlite":
+        return
+    for activa, archivo, _ in TABLAS_ARCHIVO_PEDIDOS:
+        nombre = activa.__tablename__
+        maximo = max(
+            db.query(func.max(activa.id)).scalar() or 0,
+            db.query(func.max(archivo.id)).scalar() or 0,
+        )
+        actual = db.execute(text("SELECT seq FROM sqlite_sequence WHERE name = :nombre"), {"nombre": nombre}).scalar()
+        if actual is None:
+            db.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:nombre, :seq)"), {"nombre": nombre, "seq": maximo})
+        elif actual < maximo:
+            db.execute(text("UPDATE sqlite_sequence SET seq = :seq WHERE name = :nombre"), {"nombre": nombre, "seq": maximo})
+    db.commit()
+
+def _union_activa_y_archivo(activa, archivo, nombre: str):
+    columnas = [c.name for c in activa.__table__.columns]
+    return union_all(
+        select(*[activa.__table__.c[c] for c in columnas]),
+        select(*[archivo.__table__.c[c] for c in columnas]),
+    ).subquery(nombre)
+
+def pedidos_historicos():
+    """`Pedido` leído sobre la tabla activa y el archivo, para los reportes."""
+    return aliased(Pedido, _union_activa_y_archivo(Pedido, PedidoArchivado, "pedidos_historicos"), adapt_on_names=True)
+
+def detalles_historicos():
+    """`PedidoDetalle` leído sobre la tabla activa y el archivo, para los reportes."""
+    return aliased(
+        PedidoDetalle,
+        _union_activa_y_archivo(PedidoDetalle, PedidoDetalleArchivado, "pedidodetalles_historicos"),
+        adapt_on_names=True,
+    )
+
+def envios_historicos():
+    """`Envio` leído sobre la tabla activa y el archivo, para el historial."""
+    return aliased(Envio, _union_activa_y_archivo(Envio, EnvioArchivado, "envios_historicos"), adapt_on_names=True)
+
+#CARRITOS ABANDONADOS
+#---------------------------------------------------------------------------------------------
+# Carritos PENDIENTES sin cambios durante estos días se consideran abandonados
+CARRITOS_ABANDONO_DIAS = int(os.getenv("CARRITOS_ABANDONO_DIAS", "30"))
+# Carritos borrados por transacción: acota cuánto se bloquean las tablas
+CARRITOS_BARRIDO_LOTE = int(os.getenv("CARRITOS_BARRIDO_LOTE", "500"))
+
+def barrer_carritos_abandonados(
+    db: Session,
+    dias: Optional[int] = None,
+    lote: Optional[int] = None,
+    excluir_usuarios=(),
+) -> int:
+    """
+    Borra los carritos PENDIENTES sin cambios hace más de `dias`, con sus
+    detalles, de a `lote` carritos por transacción. Lo que se llevó cada lote
+    queda en `carritos_abandonados` para los reportes. Los carritos de
+    `excluir_usuarios` (los que el almacén tiene en memoria) no se tocan.
+    Devuelve la cantidad de carritos borrados.
+    """
+    dias = CARRITOS_ABANDONO_DIAS if dias is None else dias
+    lote = lote or CARRITOS_BARRIDO_LOTE
+    limite = ahora_local() - timedelta(days=dias)
+    # Los carritos anteriores a fecha_actualizacion sólo tienen la de creación.
+    # El estado se compara igual que en obtener_carrito_por_usuario, que es
+    # lo que define al carrito activo de cada usuario
+    abandonado = and_(
+        Carrito.estado == schemas.EstadoCarritoEnum.PENDIENTE,
+        func.coalesce(Carrito.fecha_actualizacion, Carrito.fecha_creacion) < limite,
+    )
+    if excluir_usuarios:
+        abandonado = and_(abandonado, Carrito.usuario_id.notin_(list(excluir_usuarios)))
+
+    barridos = set()
+    ultimo_id = 0
+    while True:
+        candidatos = [carrito_id for (carrito_id,) in db.query(Carrito.id)
+                      .filter(abandonado, Carrito.id > ultimo_id)
+                      .order_by(Carrito.id)
+                      .limit(lote)]
+        if not candidatos:
+            break
+        ultimo_id = candidatos[-1]
+
+        # La condición se vuelve a evaluar al tomar las filas: si el usuario
+        # cambió el carrito desde la consulta anterior, no se borra
+        ids = db.execute(
+            update(Carrito)
+            .where(Carrito.id.in_(candidatos), abandonado)
+            .values(version=Carrito.version + 1)
+            .returning(Carrito.id)
+        ).scalars().all()
+        if ids:
+            carritos_con_productos, lineas, unidades, valor = db.query(
+                func.count(func.distinct(CarritoDetalle.carrito_id)),
+                func.count(CarritoDetalle.id),
+                func.coalesce(func.sum(CarritoDetalle.cantidad), 0),
+                func.coalesce(func.sum(CarritoDetalle.subtotal), 0),
+            ).filter(CarritoDetalle.carrito_id.in_(ids)).one()
+            db.query(CarritoDetalle).filter(CarritoDetalle.carrito_id.in_(ids)).delete(synchronize_session=False)
+            db.query(Carrito).filter(Carrito.id.in_(ids)).delete(synchronize_session=False)
+            db.add(CarritosAbandonados(
+                fecha=ahora_local(),
+                carritos=len(ids),
+                carritos_con_productos=carritos_con_productos,
+                lineas=lineas,
+                unidades=unidades,
+                valor=round(valor, 2),
+            ))
+        db.commit()
+        barridos.update(ids)
+
+    if barridos:
+        # Un id borrado puede volver a usarse; sus totales no deben sobrevivir
+        cache_totales_carrito.invalidar_si(lambda clave: clave[0] in barridos)
+    return len(barridos)
+
+def reporte_carritos_abandonados(db: Session, dias: int = 30) -> dict:
+    """Carritos abandonados que se borraron en los últimos `dias`, por día y en total."""
+    desde = ahora_local() - timedelta(days=dias)
+    dia = func.date(CarritosAbandonados.fecha)
+    filas = db.query(
+        dia.label("dia"),
+        func.sum(CarritosAbandonados.carritos).label("carritos"),
+        func.sum(CarritosAbandonados.carritos_con_productos).label("carritos_con_productos"),
+        func.sum(CarritosAbandonados.lineas).label("lineas"),
+        func.sum(CarritosAbandonados.unidades).label("unidades"),
+        func.sum(CarritosAbandonados.valor).label("valor"),
+    ).filter(CarritosAbandonados.fecha >= desde)\
+     .group_by(dia)\
+     .order_by(dia)\
+     .all()
+
+    por_dia = [
+        {
+            "fecha": str(fila.dia),
+            "carritos": fila.carritos,
+            "carritos_con_productos": fila.carritos_con_productos,
+            "lineas": fila.lineas,
+            "unidades": fila.unidades,
+            "valor": round(fila.valor, 2),
+        }
+        for fila in filas
+    ]
+    return {
+        "dias": dias,
+        "carritos": sum(dia["carritos"] for dia in por_dia),
+        "carritos_con_productos": sum(dia["carritos_con_productos"] for dia in por_dia),
+        "unidades": sum(dia["unidades"] for dia in por_dia),
+        "valor": round(sum(dia["valor"] for dia in por_dia), 2),
+        "por_dia": por_dia,
+    }
+
 #REPORTES
 #---------------------------------------------------------------------------------------------
 def obtener_top_usuarios_mas_activos(db: Session):
+    Pedido = pedidos_historicos()
     top_usuarios = (
         db.query(
             Usuario.nombre, func.count(Pedido.id).label("compras")
@@ -1234,6 +2494,7 @@ def generar_reporte_ventas_por_periodo(db: Session, tipo_periodo: str, fecha_ini
         raise ValueError("Tipo de período no válido")
 
     # Consulta optimizada
+    Pedido = pedidos_historicos()
     query = db.query(
         trunc_func(Pedido.fecha_creacion).label("periodo"),
         func.sum(Pedido.total).label("total_ventas"),
@@ -1256,11 +2517,13 @@ def generar_reporte_ventas_por_periodo(db: Session, tipo_periodo: str, fecha_ini
 
 
 def calcular_estacionalidad_productos(db: Session, anio: int):
+    Pedido = pedidos_historicos()
+    PedidoDetalle = detalles_historicos()
     subquery = db.query(
         PedidoDetalle.producto_id,
         func.extract('month', Pedido.fecha_creacion).label("mes"),
         func.sum(PedidoDetalle.cantidad).label("ventas")
-    ).join(Pedido).filter(
+    ).join(Pedido, Pedido.id == PedidoDetalle.pedido_id).filter(
         func.extract('year', Pedido.fecha_creacion) == anio,
         Pedido.estado == "ENTREGADO"
     ).group_by(PedidoDetalle.producto_id, "mes").subquery()
@@ -1286,13 +2549,16 @@ def calcular_estacionalidad_productos(db: Session, anio: int):
     return list(reporte.values())
 
 def calcular_costos_ganancias(db: Session, producto_id: Optional[int], categoria_id: Optional[int]):
+    Pedido = pedidos_historicos()
+    PedidoDetalle = detalles_historicos()
     query = db.query(
         Producto.id,
         Producto.nombre,
         Producto.precio,
         Producto.costo_compra,
         func.sum(PedidoDetalle.cantidad).label("unidades_vendidas")
-    ).join(PedidoDetalle).join(Pedido).filter(
+    ).join(PedidoDetalle, PedidoDetalle.producto_id == Producto.id)\
+     .join(Pedido, Pedido.id == PedidoDetalle.pedido_id).filter(
         Pedido.estado == "ENTREGADO"
     )
 
@@ -1315,6 +2581,7 @@ def calcular_metricas_cancelaciones(db: Session, meses_historial: int = 3):
     """
     Calcula el porcentaje de pedidos cancelados y su evolución histórica en los últimos `meses_historial` meses.
     """
+    Pedido = pedidos_historicos()
     try:
         # Obtener el total de pedidos y cancelaciones
         total_pedidos = db.query(func.count(Pedido.id)).scalar() or 0
@@ -1427,7 +2694,13 @@ def crear_descuento(
         )
 
         db.add(nuevo_descuento)
+        db.flush()
+        # Productos que apuntan a este id (por ejemplo, de un descuento borrado cuyo id se reutilizó)
+        recalcular_precios_finales(db, Producto.descuento_id == nuevo_descuento.id)
+        incrementar_version(db, "descuentos")
         db.commit()
+        invalidar_conteos("descuentos")
+        invalidar_productos_con_descuento(db, nuevo_descuento.id)
         db.refresh(nuevo_descuento)
         return nuevo_descuento
 
@@ -1439,10 +2712,8 @@ def crear_descuento(
         raise HTTPException(status_code=400, detail=str(e))
 
 # Listar descuentos con paginación
-def listar_descuentos(db: Session, pagina: int, tamanio: int) -> dict:
-    total = db.query(Descuento).count()
-    descuentos = db.query(Descuento).offset((pagina - 1) * tamanio).limit(tamanio).all()
-    return {"total": total, "pagina": pagina, "tamanio": tamanio, "descuentos": descuentos}
+def listar_descuentos(db: Session, pagina: int, tamanio: int, after: Optional[str] = None) -> dict:
+    return paginar(db.query(Descuento), [(Descuento.id, False)], pagina, tamanio, after, "descuentos")
 
 # Obtener un descuento por ID
 def obtener_descuento_por_id(db: Session, descuento_id: int) -> Descuento:
@@ -1478,26 +2749,41 @@ def actualizar_descuento(
     descuento.producto_id = producto_id
     descuento.metodo_pago_id = metodo_pago_id
 
+    db.flush()
+    recalcular_precios_finales(db, Producto.descuento_id == descuento_id)
+    incrementar_version(db, "descuentos")
     db.commit()
+    invalidar_productos_con_descuento(db, descuento_id)
     db.refresh(descuento)
     return descuento
 
 
 
+# Los productos cacheados incluyen su descuento
+def invalidar_productos_con_descuento(db: Session, descuento_id: int):
+    ids = db.query(Producto.id).filter(Producto.descuento_id == descuento_id).all()
+    invalidar_productos_cacheados(*(producto_id for (producto_id,) in ids))
+
 # Eliminar un descuento
 def eliminar_descuento(db: Session, descuento_id: int):
     descuento = obtener_descuento_por_id(db, descuento_id)
+    # Al borrar el descuento, el flush deja en NULL el descuento_id de sus
+    # productos: hay que tomarlos antes para recalcular sus precios
+    producto_ids = [producto_id for (producto_id,) in db.query(Producto.id).filter(Producto.descuento_id == descuento_id)]
     db.delete(descuento)
+    db.flush()
+    if producto_ids:
+        recalcular_precios_finales(db, Producto.id.in_(producto_ids))
+    incrementar_version(db, "descuentos")
     db.commit()
+    invalidar_conteos("descuentos")
+    invalidar_productos_cacheados(*producto_ids)
 
 
-def obtener_productos_descuento(db: Session, pagina: int, tamanio: int) -> dict:
-    offset = (pagina - 1) * tamanio
+def obtener_productos_descuento(db: Session, pagina: int, tamanio: int, after: Optional[str] = None) -> dict:
     # Hacemos eager load de la relación "descuento"
     query = db.query(Producto).options(joinedload(Producto.descuento)).filter(Producto.descuento_id.isnot(None))
-    total = query.count()
-    productos = query.offset(offset).limit(tamanio).all()
-    return {"total": total, "productos": productos}
+    return paginar(query, [(Producto.id, False)], pagina, tamanio, after, "productos", filtros=("con_descuento",))
 
 # ============================================================
 # Crear una nueva dirección de envío
@@ -0,0 +1,165 @@
+"""
+Versiones asíncronas de los servicios de las rutas más concurridas.
+
+La lógica de negocio sigue viviendo en `services`: acá se ejecuta sobre la
+conexión asíncrona con `AsyncSession.run_sync`, así la espera de la base no
+ocupa un hilo del threadpool. El trabajo de CPU (bcrypt) se deriva al
+threadpool para no frenar el event loop.
+"""
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, List, Optional
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.gestion import schemas, services
+from src.database import SessionLocal
+from src.gestion.almacen_carritos import almacen_carritos
+from src.gestion.models import Usuario, Rol, Pedido
+from src.utils.jwt import create_access_token
+
+
+async def _ejecutar(db: AsyncSession, servicio: Callable, *args, **kwargs) -> Any:
+    """Ejecuta un servicio sincrónico sobre la sesión asíncrona."""
+    return await db.run_sync(lambda sesion: servicio(sesion, *args, **kwargs))
+
+async def _ejecutar_almacen(db: AsyncSession, operacion: Callable, *args) -> Any:
+    """
+    Ejecuta una operación del almacén de carritos. `run_sync` corre en el hilo
+    del event loop: ahí los locks de hilo del almacén en memoria no separan a
+    dos corrutinas (son reentrantes) y esperar uno frenaría todo el loop. Ese
+    almacén se atiende en el threadpool con una sesión sincrónica propia.
+    """
+    if not almacen_carritos.usa_hilos:
+        return await _ejecutar(db, operacion, *args)
+
+    def ejecutar():
+        # Como la sesión asíncrona: los objetos se serializan después del commit
+        with SessionLocal(expire_on_commit=False) as sesion:
+            return operacion(sesion, *args)
+    return await run_in_threadpool(ejecutar)
+
+#VERSIONES
+#------------------------------------------------------------------------------------------------
+async def obtener_versiones(db: AsyncSession, *tablas: str) -> dict:
+    return await _ejecutar(db, services.obtener_versiones, *tablas)
+
+#IDEMPOTENCIA
+#------------------------------------------------------------------------------------------------
+async def ejecutar_idempotente(
+    clave: str, alcance: str, datos: Any, ejecutar: Callable[[Callable], Awaitable[Any]],
+    codigo_estado: int = status.HTTP_200_OK
+) -> JSONResponse:
+    """Igual que `services.ejecutar_idempotente`; la espera de un duplicado corre en el threadpool."""
+    huella = services.huella_solicitud(alcance, datos)
+    guardada = await run_in_threadpool(services.reservar_clave_idempotencia, clave, alcance, huella)
+    if guardada is not None:
+        return services.respuesta_idempotente(*guardada, repetida=True)
+    guardadas = []
+
+    def guardar(sesion, respuesta) -> None:
+        guardadas.append(jsonable_encoder(respuesta))
+        services.guardar_respuesta_idempotente(sesion, clave, alcance, codigo_estado, guardadas[-1])
+
+    try:
+        contenido = jsonable_encoder(await ejecutar(guardar))
+    except BaseException:
+        await run_in_threadpool(services.liberar_clave_idempotencia, clave, alcance)
+        raise
+    if guardadas:
+        # Se responde lo mismo que recibirán los reintentos
+        contenido = guardadas[-1]
+    else:
+        await run_in_threadpool(services.completar_clave_idempotencia, clave, alcance, codigo_estado, contenido)
+    return services.respuesta_idempotente(codigo_estado, contenido)
+
+#USUARIOS
+#------------------------------------------------------------------------------------------------
+async def obtener_usuario_por_id(db: AsyncSession, usuario_id: int):
+    return await db.get(Usuario, usuario_id)
+
+async def autenticar_usuario(db: AsyncSession, nombreUsuario: str, password: str) -> str:
+    resultado = await db.execute(select(Usuario).where(Usuario.nombreUsuario == nombreUsuario))
+    user = resultado.scalars().first()
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Nombre de usuario incorrecto",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    # bcrypt es costoso a propósito: se verifica fuera del event loop
+    if not await run_in_threadpool(user.verify_password, password):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Contraseña incorrecta",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    access_token_expires = timedelta(minutes=services.ACCESS_TOKEN_EXPIRE_MINUTES)
+
+    rol = await db.get(Rol, user.rol_id)
+
+    return create_access_token(
+        data={"sub": str(user.id), "email": user.email, "name": user.nombre, "rol": rol.nombre}, expires_delta=access_token_expires
+    )
+
+#PRODUCTOS
+#------------------------------------------------------------------------------------------------
+async def listar_productos(db: AsyncSession, *args, **kwargs) -> dict:
+    return await _ejecutar(db, services.listar_productos, *args, **kwargs)
+
+async def obtener_producto_cacheado(db: AsyncSession, producto_id: int, versiones: Optional[dict] = None) -> schemas.ProductoOut:
+    return await _ejecutar(db, services.obtener_producto_cacheado, producto_id, versiones)
+
+async def buscar_productos(db: AsyncSession, q: str, limite: int = 20) -> dict:
+    return await _ejecutar(db, services.buscar_productos, q, limite)
+
+#CARRITO
+#------------------------------------------------------------------------------------------------
+async def obtener_carrito_o_crear(db: AsyncSession, usuario_id: int):
+    return await _ejecutar(db, services.obtener_carrito_o_crear, usuario_id)
+
+# Las modificaciones pasan por el almacén de carritos configurado (ver almacen_carritos)
+async def agregar_al_carrito(db: AsyncSession, usuario_id: int, producto_id: int, cantidad: int):
+    return await _ejecutar_almacen(db, almacen_carritos.agregar, usuario_id, producto_id, cantidad)
+
+async def actualizar_cantidad_en_carrito(db: AsyncSession, usuario_id: int, producto_id: int, cantidad: int):
+    return await _ejecutar_almacen(db, almacen_carritos.actualizar_cantidad, usuario_id, producto_id, cantidad)
+
+async def eliminar_del_carrito(db: AsyncSession, usuario_id: int, producto_id: int):
+    return await _ejecutar_almacen(db, almacen_carritos.eliminar, usuario_id, producto_id)
+
+async def listar_carrito(db: AsyncSession, usuario_id: int):
+    return await _ejecutar_almacen(db, almacen_carritos.listar, usuario_id)
+
+async def vaciar_carrito(db: AsyncSession, usuario_id: int):
+    return await _ejecutar_almacen(db, almacen_carritos.vaciar, usuario_id)
+
+async def aplicar_operaciones_carrito(db: AsyncSession, usuario_id: int, operaciones: List[schemas.OperacionCarrito]):
+    return await _ejecutar_almacen(db, almacen_carritos.aplicar_operaciones, usuario_id, operaciones)
+
+async def volcar_carrito(db: AsyncSession, usuario_id: int) -> int:
+    """Escribe en la base los cambios pendientes del carrito antes de leerlo con SQL."""
+    return await _ejecutar_almacen(db, almacen_carritos.volcar, usuario_id)
+
+async def calcular_totales_carrito(db: AsyncSession, carrito_id: int) -> dict:
+    return await _ejecutar(db, services.calcular_totales_carrito, carrito_id)
+
+async def obtener_resumen_carrito(db: AsyncSession, carrito_id: int) -> dict:
+    return await _ejecutar(db, services.obtener_resumen_carrito, carrito_id)
+
+#PEDIDOS
+#------------------------------------------------------------------------------------------------
+async def crear_pedido(
+    db: AsyncSession, pedido: schemas.PedidoCreate, al_confirmar: Optional[Callable] = None
+) -> Pedido:
+    # El correo de confirmación queda en la bandeja de salida; no se espera al SMTP
+    # El almacén vuelca el carrito antes y descarta su copia después del pedido
+    return await _ejecutar_almacen(
+        db, almacen_carritos.confirmar_pedido, pedido.usuario_id,
+        lambda sesion: services.crear_pedido(sesion, pedido, al_confirmar),
+    )
+
+async def registrar_actividad(db: AsyncSession, actividad_data: schemas.ActividadCreate):
+    return await _ejecutar(db, services.registrar_actividad, actividad_data)
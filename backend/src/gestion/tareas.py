@@ -0,0 +1,163 @@
+"""
+Tareas en segundo plano que se lanzan desde el lifespan de la aplicación.
+
+Cada worker corre su propia copia; las tareas son idempotentes, así que no
+hace falta coordinarlas entre procesos.
+"""
+import asyncio
+import logging
+import os
+from fastapi.concurrency import run_in_threadpool
+from src.database import SessionLocal
+from src.gestion import services
+from src.gestion.almacen_carritos import almacen_carritos
+
+logger = logging.getLogger(__name__)
+
+# Tope de espera entre dos revisiones de precios: acota cuánto tarda en
+# programarse una ventana de descuento creada desde otro worker
+PRECIOS_ESPERA_MAXIMA = float(os.getenv("PRECIOS_ESPERA_MAXIMA", "60"))
+
+# Cada cuántos segundos se revisa la bandeja de salida de correos
+CORREOS_INTERVALO = float(os.getenv("CORREOS_INTERVALO", "5"))
+
+# Cada cuántos segundos se liberan las reservas de stock vencidas
+RESERVAS_INTERVALO = float(os.getenv("RESERVAS_INTERVALO", "60"))
+
+# Cada cuántos segundos se vuelcan a la base los carritos modificados en memoria
+CARRITOS_VOLCADO_INTERVALO = float(os.getenv("CARRITOS_VOLCADO_INTERVALO", "5"))
+
+# Cada cuántos segundos se borran los carritos abandonados
+CARRITOS_BARRIDO_INTERVALO = float(os.getenv("CARRITOS_BARRIDO_INTERVALO", "3600"))
+
+# Cada cuántos segundos se archivan los pedidos viejos (una vez por día)
+PEDIDOS_ARCHIVO_INTERVALO = float(os.getenv("PEDIDOS_ARCHIVO_INTERVALO", "86400"))
+
+
+def actualizar_precios() -> float:
+    """Aplica los descuentos vigentes y devuelve los segundos hasta la próxima ventana."""
+    db = SessionLocal()
+    try:
+        actualizados = services.actualizar_precios_vigentes(db)
+        if actualizados:
+            logger.info("Precio final actualizado en %s productos", actualizados)
+        proximo = services.proximo_cambio_de_descuento(db)
+    finally:
+        db.close()
+    if proximo is None:
+        return PRECIOS_ESPERA_MAXIMA
+    espera = (proximo - services.ahora_local()).total_seconds()
+    return min(max(espera, 0), PRECIOS_ESPERA_MAXIMA)
+
+
+async def programar_precios_finales():
+    """Recalcula `precio_final` justo cuando abre o cierra una ventana de descuento."""
+    while True:
+        try:
+            espera = await run_in_threadpool(actualizar_precios)
+        except Exception:
+            logger.exception("No se pudieron actualizar los precios finales")
+            espera = PRECIOS_ESPERA_MAXIMA
+        await asyncio.sleep(espera)
+
+
+def enviar_correos() -> int:
+    """Envía los correos pendientes hasta vaciar lo que ya venció."""
+    db = SessionLocal()
+    try:
+        total = 0
+        while True:
+            procesados = services.enviar_correos_pendientes(db)
+            total += procesados
+            if not procesados:
+                return total
+    finally:
+        db.close()
+
+
+async def procesar_bandeja_de_correos():
+    """Worker de la bandeja de salida: reintenta con espera exponencial."""
+    while True:
+        try:
+            await run_in_threadpool(enviar_correos)
+        except Exception:
+            logger.exception("Error al procesar la bandeja de correos")
+        await asyncio.sleep(CORREOS_INTERVALO)
+
+
+def liberar_reservas() -> int:
+    db = SessionLocal()
+    try:
+        return services.liberar_reservas_vencidas(db)
+    finally:
+        db.close()
+
+
+async def liberar_reservas_vencidas():
+    """Limpia las reservas de stock de checkouts que no terminaron en pedido."""
+    while True:
+        try:
+            liberadas = await run_in_threadpool(liberar_reservas)
+            if liberadas:
+                logger.info("Se liberaron %s reservas de stock vencidas", liberadas)
+        except Exception:
+            logger.exception("No se pudieron liberar las reservas de stock")
+        await asyncio.sleep(RESERVAS_INTERVALO)
+
+
+def archivar_pedidos() -> int:
+    db = SessionLocal()
+    try:
+        return services.archivar_pedidos(db)
+    finally:
+        db.close()
+
+
+async def archivar_pedidos_viejos():
+    """Mueve al archivo los pedidos terminados que superaron el horizonte."""
+    while True:
+        try:
+            archivados = await run_in_threadpool(archivar_pedidos)
+            if archivados:
+                logger.info("Se archivaron %s pedidos", archivados)
+        except Exception:
+            logger.exception("No se pudieron archivar los pedidos")
+        await asyncio.sleep(PEDIDOS_ARCHIVO_INTERVALO)
+
+
+def volcar_carritos() -> int:
+    db = SessionLocal()
+    try:
+        return almacen_carritos.volcar(db)
+    finally:
+        db.close()
+
+
+async def volcar_carritos_periodicamente():
+    """Lleva a la base los carritos que cambiaron en memoria (almacén `memoria`)."""
+    while True:
+        await asyncio.sleep(CARRITOS_VOLCADO_INTERVALO)
+        try:
+            await run_in_threadpool(volcar_carritos)
+        except Exception:
+            logger.exception("No se pudieron volcar los carritos")
+
+
+def barrer_carritos() -> int:
+    db = SessionLocal()
+    try:
+        return almacen_carritos.barrer_abandonados(db)
+    finally:
+        db.close()
+
+
+async def barrer_carritos_abandonados():
+    """Borra por lotes los carritos pendientes que nadie toca hace tiempo."""
+    while True:
+        try:
+            borrados = await run_in_threadpool(barrer_carritos)
+            if borrados:
+                logger.info("Se borraron %s carritos abandonados", borrados)
+        except Exception:
+            logger.exception("No se pudieron borrar los carritos abandonados")
+        await asyncio.sleep(CARRITOS_BARRIDO_INTERVALO)
@@ -1,4 +1,5 @@
 import os
+import asyncio
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI
@@ -6,11 +7,15 @@ from fastapi.middleware.cors import CORSMiddleware
 import cloudinary
 
 # Importamos la conexión a la base de datos y los modelos
-from src.database import engine, SessionLocal
+from src.database import engine, SessionLocal, async_engine
 from src.models import BaseModel
 from src.gestion.router import router as gestion_router # Importamos los routers desde nuestros módulos
-from src.gestion.services import verificar_y_crear_roles 
+from src.gestion.services import verificar_y_crear_roles, crear_indice_busqueda, reservar_ids_archivados
 from src.pagos.router import router as pagos_router
+from src.gestion.tareas import programar_precios_finales, procesar_bandeja_de_correos, liberar_reservas_vencidas, archivar_pedidos_viejos, volcar_carritos_periodicamente, volcar_carritos, barrer_carritos_abandonados
+from src.gestion.almacen_carritos import almacen_carritos
+from src.utils.esquema import agregar_columnas_faltantes, activar_autoincremento_sqlite
+from src.utils.correo import enviador
 
 load_dotenv()
 
@@ -27,14 +32,37 @@ cloudinary.config(
 @asynccontextmanager
 async def db_creation_lifespan(app: FastAPI):
     BaseModel.metadata.create_all(bind=engine)  # Crear tablas si no existen
+    agregar_columnas_faltantes(engine, BaseModel.metadata)  # Y columnas nuevas en tablas existentes
+    activar_autoincremento_sqlite(engine, BaseModel.metadata)  # Ids que no se reutilizan (pedidos archivados)
     
     # Verificar y crear roles
     db = SessionLocal()
     verificar_y_crear_roles(db)
+    crear_indice_busqueda(db)
+    reservar_ids_archivados(db)
+    # Cambios de carritos que quedaron en el diario si el proceso se cortó
+    almacen_carritos.recuperar(db)
     db.close()
+
+    # La primera pasada completa precio_final en productos existentes
+    tareas = [
+        asyncio.create_task(programar_precios_finales()),
+        asyncio.create_task(procesar_bandeja_de_correos()),
+        asyncio.create_task(liberar_reservas_vencidas()),
+        asyncio.create_task(archivar_pedidos_viejos()),
+        asyncio.create_task(volcar_carritos_periodicamente()),
+        asyncio.create_task(barrer_carritos_abandonados()),
+    ]
     
     yield
 
+    for tarea in tareas:
+        tarea.cancel()
+    await asyncio.gather(*tareas, return_exceptions=True)
+    volcar_carritos()
+    enviador.cerrar()
+    await async_engine.dispose()
+
 app = FastAPI(root_path=ROOT_PATH, lifespan=db_creation_lifespan)
 
 # Asociamos los routers a la app
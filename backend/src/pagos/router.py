@@ -1,9 +1,12 @@
 import os
 import mercadopago
-from fastapi import APIRouter, HTTPException, Depends
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Header
 from sqlalchemy.orm import Session
 from src.database import get_db
-from src.gestion.models import Usuario, Carrito, CarritoDetalle
+from src.gestion.models import Usuario, Carrito
+from src.gestion import services
+from src.gestion.almacen_carritos import almacen_carritos
 
 router = APIRouter()
 
@@ -12,32 +15,33 @@ ACCESS_TOKEN =os.getenv("MERCADOPAGO_ACCESS_TOKEN")
 sdk = mercadopago.SDK(ACCESS_TOKEN)
 
 @router.post("/crear_preferencia/{usuario_id}")
-def crear_preferencia(usuario_id: int, db: Session = Depends(get_db)):
+def crear_preferencia(
+    usuario_id: int,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    # Con la cabecera, los reintentos reciben la misma preferencia en vez de crear otra en Mercado Pago
+    if not idempotency_key:
+        return generar_preferencia(db, usuario_id)
+    return services.ejecutar_idempotente(
+        idempotency_key, "POST /crear_preferencia", {"usuario_id": usuario_id},
+        lambda guardar: generar_preferencia(db, usuario_id)
+    )
+
+def generar_preferencia(db: Session, usuario_id: int) -> dict:
+    # Los cambios del carrito que siguen en memoria tienen que estar en la base
+    almacen_carritos.volcar(db, usuario_id)
+
     # Obtener el carrito y verificar que existe
     carrito = db.query(Carrito).filter(Carrito.usuario_id == usuario_id).first()
     if not carrito:
         raise HTTPException(status_code=404, detail="Carrito no encontrado")
 
-    # Obtener los productos dentro del carrito
-    detalles = db.query(CarritoDetalle).filter(CarritoDetalle.carrito_id == carrito.id).all()
-
-    if not detalles:
+    # Subtotal con descuentos y envío en una sola consulta, igual que el pedido
+    totales = services.calcular_totales_carrito(db, carrito.id)
+    if not totales["lineas"]:
         raise HTTPException(status_code=400, detail="El carrito está vacío")
-
-    # Calcular el subtotal de la compra sumando los subtotales de los productos
-    total_compra = sum(detalle.subtotal for detalle in detalles)
-
-    # Calcular el costo total de envío.
-    # Se asume que CarritoDetalle tiene una relación con el modelo Producto
-    total_envio = sum(
-        detalle.producto.costo_envio * detalle.cantidad
-        for detalle in detalles
-        if detalle.producto and detalle.producto.costo_envio is not None
-    )
-    
-
-    # Sumar el subtotal y el costo de envío para obtener el total final
-    total_final = total_compra + total_envio
+    total_final = totales["total"]
 
     # Obtener el usuario para armar el título del ítem
     usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
@@ -62,8 +66,12 @@ def crear_preferencia(usuario_id: int, db: Session = Depends(get_db)):
         "auto_return": "approved"
     }
 
+    # Apartar el stock del carrito mientras el cliente paga
+    services.reservar_stock(db, usuario_id)
+
     try:
         preference_response = sdk.preference().create(preference_data)
         return {"preference_id": preference_response["response"]["id"]}
     except Exception as e:
+        services.liberar_reservas_usuario(db, usuario_id)
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+_AUSENTE = object()
+
+
+class CacheLRU:
+    """
+    Cache en memoria acotada por cantidad de entradas (LRU) y por antigüedad (TTL).
+
+    Es segura entre hilos: las rutas síncronas de FastAPI corren en el
+    threadpool y comparten la misma instancia dentro de un proceso. Cada
+    proceso tiene su propia copia, por eso el TTL acota cuánto puede tardar
+    en verse un cambio hecho desde otro worker.
+    """
+
+    def __init__(self, nombre: str, max_entradas: int = 1024, ttl: Optional[float] = 300):
+        self.nombre = nombre
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.invalidaciones = 0
+
+    def obtener(self, clave: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entrada = self._datos.get(clave, _AUSENTE)
+            if entrada is _AUSENTE:
+                self.fallos += 1
+                return default
+            vence, valor = entrada
+            if vence < time.monotonic():
+                del self._datos[clave]
+                self.desalojos += 1
+                self.fallos += 1
+                return default
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return valor
+
+    def guardar(self, clave: Hashable, valor: Any) -> None:
+        vence = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            self._datos[clave] = (vence, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+                self.desalojos += 1
+
+    def obtener_o_calcular(self, clave: Hashable, calcular: Callable[[], Any]) -> Any:
+        """Devuelve el valor cacheado o lo calcula y lo guarda (read-through)."""
+        valor = self.obtener(clave, _AUSENTE)
+        if valor is _AUSENTE:
+            valor = calcular()
+            self.guardar(clave, valor)
+        return valor
+
+    def invalidar(self, clave: Hashable) -> None:
+        with self._lock:
+            if self._datos.pop(clave, _AUSENTE) is not _AUSENTE:
+                self.invalidaciones += 1
+
+    def invalidar_si(self, condicion: Callable[[Hashable], bool]) -> None:
+        """Elimina todas las entradas cuya clave cumple la condición."""
+        with self._lock:
+            claves = [clave for clave in self._datos if condicion(clave)]
+            for clave in claves:
+                del self._datos[clave]
+            self.invalidaciones += len(claves)
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self.invalidaciones += len(self._datos)
+            self._datos.clear()
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "nombre": self.nombre,
+                "entradas": len(self._datos),
+                "max_entradas": self.max_entradas,
+                "ttl": self.ttl,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "desalojos": self.desalojos,
+                "invalidaciones": self.invalidaciones,
+            }
@@ -0,0 +1,224 @@
+import logging
+import os
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Errores tras los cuales la conexión ya no sirve y hay que abrir otra
+ERRORES_DE_CONEXION = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+Mensaje = Tuple[str, str, str]  # (destinatario, asunto, cuerpo HTML)
+
+
+class SMTPNoDisponible(Exception):
+    """No se pudo abrir o autenticar una conexión con el servidor."""
+
+
+class PoolSMTP:
+    """
+    Mantiene abiertas unas pocas conexiones SMTP ya autenticadas y las
+    reutiliza para muchos mensajes, evitando el connect + STARTTLS + AUTH de
+    cada envío. Una conexión que estuvo inactiva más de `inactividad_max`
+    segundos se verifica con NOOP antes de usarla, y si el servidor la cortó
+    se abre otra y se reintenta el mensaje una vez. Sin `habilitado` no se
+    conecta: todos los mensajes se informan como fallidos.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        puerto: int,
+        usuario: Optional[str],
+        password: Optional[str],
+        remitente: str,
+        starttls: bool = True,
+        tamanio: int = 2,
+        inactividad_max: float = 60,
+        timeout: float = 30,
+        habilitado: bool = True,
+    ):
+        self.host = host
+        self.puerto = puerto
+        self.usuario = usuario
+        self.password = password
+        self.remitente = remitente
+        self.starttls = starttls
+        self.inactividad_max = inactividad_max
+        self.timeout = timeout
+        self.habilitado = habilitado
+        self._libres: List[Tuple[smtplib.SMTP, float]] = []
+        self._lock = threading.Lock()
+        self._cupos = threading.BoundedSemaphore(tamanio)
+        self.enviados = 0
+        self.fallidos = 0
+        self.conexiones_abiertas = 0
+        self.reconexiones = 0
+        self._inicio = time.monotonic()
+
+    def _conectar(self) -> smtplib.SMTP:
+        servidor = smtplib.SMTP(self.host, self.puerto, timeout=self.timeout)
+        try:
+            if self.starttls:
+                servidor.starttls()
+            if self.usuario:
+                servidor.login(self.usuario, self.password)
+        except Exception:
+            servidor.close()
+            raise
+        with self._lock:
+            self.conexiones_abiertas += 1
+        return servidor
+
+    def _descartar(self, servidor: smtplib.SMTP) -> None:
+        try:
+            servidor.quit()
+        except Exception:
+            servidor.close()
+
+    def _sigue_viva(self, servidor: smtplib.SMTP) -> bool:
+        try:
+            return servidor.noop()[0] == 250
+        except Exception:
+            return False
+
+    @contextmanager
+    def conexion(self):
+        """Presta una conexión del pool durante el bloque."""
+        self._cupos.acquire()
+        try:
+            with self._lock:
+                servidor, ultimo_uso = self._libres.pop() if self._libres else (None, 0)
+            if servidor is not None and time.monotonic() - ultimo_uso > self.inactividad_max:
+                if not self._sigue_viva(servidor):
+                    self._descartar(servidor)
+                    servidor = None
+            if servidor is None:
+                try:
+                    servidor = self._conectar()
+                except Exception as e:
+                    raise SMTPNoDisponible(str(e)) from e
+            try:
+                yield servidor
+            except BaseException:
+                self._descartar(servidor)
+                raise
+            else:
+                with self._lock:
+                    self._libres.append((servidor, time.monotonic()))
+        finally:
+            self._cupos.release()
+
+    def _armar(self, destinatario: str, asunto: str, cuerpo: str) -> str:
+        msg = MIMEMultipart()
+        msg['From'] = self.remitente
+        msg['To'] = destinatario
+        msg['Subject'] = asunto
+        msg.attach(MIMEText(cuerpo, 'html'))
+        return msg.as_string()
+
+    def enviar_lote(self, mensajes: Iterable[Mensaje]) -> List[Optional[Exception]]:
+        """
+        Envía los mensajes por una misma conexión. Devuelve, en el mismo
+        orden, None para cada mensaje enviado o el error que lo impidió.
+        """
+        resultados: List[Optional[Exception]] = []
+        pendientes = list(mensajes)
+        if not self.habilitado:
+            logger.warning("Envío de correos deshabilitado: no se envían %s mensajes", len(pendientes))
+            return [SMTPNoDisponible("El envío de correos está deshabilitado") for _ in pendientes]
+        reintento_usado = False
+        while pendientes:
+            try:
+                with self.conexion() as servidor:
+                    while pendientes:
+                        destinatario, asunto, cuerpo = pendientes[0]
+                        try:
+                            servidor.sendmail(self.remitente, destinatario, self._armar(destinatario, asunto, cuerpo))
+                        except ERRORES_DE_CONEXION:
+                            raise
+                        except Exception as e:
+                            # Rechazo del mensaje (destinatario inválido, etc.): la conexión sigue sirviendo
+                            resultados.append(e)
+                            self._contar(fallido=True)
+                        else:
+                            resultados.append(None)
+                            self._contar(fallido=False)
+                        pendientes.pop(0)
+                        reintento_usado = False
+            except ERRORES_DE_CONEXION as e:
+                if reintento_usado:
+                    # La conexión nueva también falló: el mensaje se informa como fallido
+                    resultados.append(e)
+                    self._contar(fallido=True)
+                    pendientes.pop(0)
+                    reintento_usado = False
+                else:
+                    reintento_usado = True
+                    with self._lock:
+                        self.reconexiones += 1
+            except SMTPNoDisponible as e:
+                # No se pudo conectar o autenticar: fallan todos los pendientes
+                resultados.extend(e for _ in pendientes)
+                for _ in pendientes:
+                    self._contar(fallido=True)
+                pendientes.clear()
+        return resultados
+
+    def enviar(self, destinatario: str, asunto: str, cuerpo: str) -> None:
+        """Envía un mensaje y lanza la excepción si no se pudo."""
+        error = self.enviar_lote([(destinatario, asunto, cuerpo)])[0]
+        if error is not None:
+            raise error
+
+    def _contar(self, fallido: bool) -> None:
+        with self._lock:
+            if fallido:
+                self.fallidos += 1
+            else:
+                self.enviados += 1
+
+    def cerrar(self) -> None:
+        with self._lock:
+            libres, self._libres = self._libres, []
+        for servidor, _ in libres:
+            self._descartar(servidor)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            minutos = max(time.monotonic() - self._inicio, 1) / 60
+            return {
+                "host": self.host,
+                "habilitado": self.habilitado,
+                "conexiones_libres": len(self._libres),
+                "conexiones_abiertas": self.conexiones_abiertas,
+                "reconexiones": self.reconexiones,
+                "enviados": self.enviados,
+                "fallidos": self.fallidos,
+                "enviados_por_minuto": round(self.enviados / minutos, 2),
+            }
+
+
+# Transporte compartido por todo el proceso, configurado por variables de entorno.
+# Las credenciales no tienen valor por defecto: sin ellas no se envía nada
+SMTP_USUARIO = os.getenv("SMTP_USUARIO")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+if not (SMTP_USUARIO and SMTP_PASSWORD):
+    logger.warning("SMTP_USUARIO o SMTP_PASSWORD sin configurar: el envío de correos queda deshabilitado")
+
+enviador = PoolSMTP(
+    host=os.getenv("SMTP_HOST", "smtp.gmail.com"),
+    puerto=int(os.getenv("SMTP_PORT", "587")),
+    usuario=SMTP_USUARIO,
+    password=SMTP_PASSWORD,
+    remitente=os.getenv("SMTP_REMITENTE", SMTP_USUARIO),
+    starttls=os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "si", "yes"),
+    tamanio=int(os.getenv("SMTP_POOL_TAMANIO", "2")),
+    inactividad_max=float(os.getenv("SMTP_INACTIVIDAD_MAX", "60")),
+    habilitado=bool(SMTP_USUARIO and SMTP_PASSWORD),
+)
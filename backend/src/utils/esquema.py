@@ -0,0 +1,73 @@
+import logging
+from sqlalchemy import MetaData, inspect, literal
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
+
+logger = logging.getLogger(__name__)
+
+
+def agregar_columnas_faltantes(engine: Engine, metadata: MetaData) -> None:
+    """
+    `create_all` crea las tablas que faltan pero no modifica las existentes.
+    Como el proyecto no usa migraciones, esta función agrega con ALTER TABLE
+    las columnas de los modelos que todavía no están en la base y los índices
+    que falten. Sólo sirve para columnas nuevas; no renombra ni cambia tipos.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for tabla in metadata.tables.values():
+            if not inspector.has_table(tabla.name):
+                continue
+            existentes = {columna["name"] for columna in inspector.get_columns(tabla.name)}
+            nuevas = [columna for columna in tabla.columns if columna.name not in existentes]
+            for columna in nuevas:
+                definicion = f"{columna.name} {columna.type.compile(dialect=engine.dialect)}"
+                if columna.default is not None and columna.default.is_scalar:
+                    valor = literal(columna.default.arg, columna.type).compile(
+                        dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+                    )
+                    definicion += f" DEFAULT {valor}"
+                    if not columna.nullable:
+                        definicion += " NOT NULL"
+                conn.exec_driver_sql(f"ALTER TABLE {tabla.name} ADD COLUMN {definicion}")
+            # También los índices nuevos sobre columnas que ya existían. Un
+            # índice único que los datos actuales no cumplen se informa y se
+            # saltea, sin frenar el arranque
+            for indice in tabla.indexes:
+                try:
+                    with conn.begin_nested():
+                        indice.create(conn, checkfirst=True)
+                except IntegrityError as e:
+                    logger.warning("No se pudo crear el índice %s: %s", indice.name, e.orig)
+
+
+def activar_autoincremento_sqlite(engine: Engine, metadata: MetaData) -> None:
+    """
+    En SQLite, una tabla con `sqlite_autoincrement=True` no reutiliza los ids
+    de filas borradas. Las tablas creadas antes de declararlo no lo tienen y
+    SQLite no permite agregarlo con ALTER TABLE: se reconstruyen copiando las
+    filas a una tabla nueva con el esquema del modelo. Se llama después de
+    agregar_columnas_faltantes, así ambas tablas tienen las mismas columnas.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        for tabla in metadata.tables.values():
+            if not tabla.dialect_options["sqlite"].get("autoincrement"):
+                continue
+            sql = conn.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla.name,)
+            ).scalar()
+            if sql is None or "AUTOINCREMENT" in sql.upper():
+                continue
+            logger.info("Reconstruyendo %s con AUTOINCREMENT", tabla.name)
+            nueva = f"{tabla.name}__nueva"
+            ddl = str(CreateTable(tabla).compile(dialect=engine.dialect))
+            conn.exec_driver_sql(ddl.replace(f"CREATE TABLE {tabla.name} ", f"CREATE TABLE {nueva} ", 1))
+            columnas = ", ".join(columna.name for columna in tabla.columns)
+            conn.exec_driver_sql(f"INSERT INTO {nueva} ({columnas}) SELECT {columnas} FROM {tabla.name}")
+            conn.exec_driver_sql(f"DROP TABLE {tabla.name}")
+            conn.exec_driver_sql(f"ALTER TABLE {nueva} RENAME TO {tabla.name}")
+            for indice in tabla.indexes:
+                indice.create(conn, checkfirst=True)
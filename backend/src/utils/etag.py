@@ -0,0 +1,20 @@
+import hashlib
+import json
+from typing import Any, Optional
+
+
+def calcular_etag(*partes: Any) -> str:
+    """ETag fuerte a partir de las partes que determinan la respuesta."""
+    crudo = json.dumps(partes, separators=(",", ":"), sort_keys=True, default=str)
+    return '"' + hashlib.sha1(crudo.encode()).hexdigest() + '"'
+
+
+def coincide_etag(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Indica si el encabezado If-None-Match incluye el ETag. Para este
+    encabezado la comparación es débil, así que se ignora el prefijo W/.
+    """
+    if not if_none_match:
+        return False
+    candidatos = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidatos or any(c.removeprefix("W/") == etag for c in candidatos)
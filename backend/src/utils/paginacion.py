@@ -0,0 +1,126 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+from sqlalchemy import and_, or_, text
+from sqlalchemy.orm import Query
+from src.exceptions import BadRequest
+from src.utils.cache import CacheLRU
+
+# Cada criterio de orden es (expresion, descendente)
+Orden = Sequence[Tuple[Any, bool]]
+
+# Totales de los listados, por tabla y filtros. Los servicios que crean o
+# eliminan filas invalidan su tabla; el TTL cubre los cambios de otros workers.
+conteos = CacheLRU("conteos", max_entradas=512, ttl=60)
+
+
+class CursorInvalido(BadRequest):
+    DETAIL = "El cursor de paginación no es válido."
+
+
+def codificar_cursor(valores: Sequence[Any]) -> str:
+    """Codifica los valores de la clave de orden en un cursor opaco."""
+    serializados = [
+        {"dt": v.isoformat()} if isinstance(v, datetime) else v
+        for v in valores
+    ]
+    crudo = json.dumps(serializados, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str, cantidad: int) -> List[Any]:
+    """Decodifica un cursor generado por `codificar_cursor`."""
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        if not isinstance(valores, list) or len(valores) != cantidad:
+            raise CursorInvalido()
+        return [
+            datetime.fromisoformat(v["dt"]) if isinstance(v, dict) else v
+            for v in valores
+        ]
+    except (ValueError, TypeError, KeyError):
+        raise CursorInvalido()
+
+
+def _condicion_posterior(orden: Orden, valores: Sequence[Any]):
+    """Arma la condición "fila posterior al cursor" para una clave compuesta."""
+    alternativas = []
+    for i, (expresion, descendente) in enumerate(orden):
+        iguales = [orden[j][0] == valores[j] for j in range(i)]
+        siguiente = expresion < valores[i] if descendente else expresion > valores[i]
+        alternativas.append(and_(*iguales, siguiente))
+    return or_(*alternativas)
+
+
+def invalidar_conteos(*tablas: str) -> None:
+    """Descarta los totales cacheados de las tablas indicadas."""
+    conteos.invalidar_si(lambda clave: clave[0] in tablas)
+
+
+def estimar_filas(query: Query, tabla: str) -> Optional[int]:
+    """
+    Estima la cantidad de filas de una tabla sin recorrerla: en PostgreSQL
+    usa las estadísticas del planificador y en SQLite el rowid más alto.
+    Devuelve None si no hay estimación disponible.
+    """
+    db = query.session
+    if db.bind.dialect.name == "sqlite":
+        estimado = db.execute(text(f"SELECT max(rowid) FROM {tabla}")).scalar()
+        return estimado or 0
+    estimado = db.execute(
+        text("SELECT reltuples FROM pg_class WHERE relname = :tabla"), {"tabla": tabla}
+    ).scalar()
+    # reltuples vale -1 mientras la tabla no fue analizada
+    return int(estimado) if estimado is not None and estimado >= 0 else None
+
+
+def contar(query: Query, filtros: tuple = (), total: str = "exact") -> int:
+    """Total de filas de la consulta, cacheado por tabla y filtros."""
+    tabla = query.column_descriptions[0]["entity"].__tablename__
+    if total == "estimate" and not filtros:
+        estimado = estimar_filas(query, tabla)
+        if estimado is not None:
+            return estimado
+    return conteos.obtener_o_calcular((tabla, filtros), lambda: query.order_by(None).count())
+
+
+def paginar(
+    query: Query,
+    orden: Orden,
+    pagina: int,
+    tamanio: int,
+    after: Optional[str] = None,
+    nombre: str = "items",
+    filtros: tuple = (),
+    total: str = "exact",
+) -> dict:
+    """
+    Pagina una consulta por desplazamiento (`pagina`) o por cursor (`after`).
+
+    El modo por cursor busca directamente sobre la clave de orden, así que el
+    costo no crece con la profundidad de la página. En ambos modos se devuelve
+    `next_cursor` para continuar desde la última fila entregada.
+
+    `filtros` identifica los filtros aplicados a `query` para cachear su
+    total; con `total="estimate"` se usa la estimación del motor.
+    """
+    expresiones = [expresion for expresion, _ in orden]
+    consulta = query.add_columns(*expresiones).order_by(
+        *[e.desc() if descendente else e.asc() for e, descendente in orden]
+    )
+
+    if after:
+        valores = decodificar_cursor(after, len(orden))
+        filas = consulta.filter(_condicion_posterior(orden, valores)).limit(tamanio + 1).all()
+        resultado = {"tamanio": tamanio}
+    else:
+        filas = consulta.offset((pagina - 1) * tamanio).limit(tamanio + 1).all()
+        resultado = {"total": contar(query, filtros, total), "pagina": pagina, "tamanio": tamanio}
+
+    hay_mas = len(filas) > tamanio
+    filas = filas[:tamanio]
+    resultado[nombre] = [fila[0] for fila in filas]
+    resultado["next_cursor"] = codificar_cursor(list(filas[-1][1:])) if hay_mas and filas else None
+    return resultado
@@ -0,0 +1,134 @@
+"""
+Configuración común de las pruebas.
+
+Las pruebas corren contra una base SQLite temporal. La aplicación se usa sin
+el lifespan, así las tareas en segundo plano no ejecutan consultas mientras
+se cuentan sentencias.
+"""
+import os
+import sys
+import tempfile
+import zlib
+
+DIRECTORIO = tempfile.mkdtemp(prefix="ma_piscinas_tests_")
+os.environ["DB_URL"] = f"sqlite:///{os.path.join(DIRECTORIO, 'test.db')}"
+os.environ["CARRITOS_DIARIO"] = os.path.join(DIRECTORIO, "carritos_diario.jsonl")
+os.environ.setdefault("ENV", "dev")
+os.environ.setdefault("ROOT_PATH_DEV", "")
+os.environ.setdefault("SECRET_KEY", "clave-de-pruebas")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("MERCADOPAGO_ACCESS_TOKEN", "TEST")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from src.database import SessionLocal, engine, async_engine
+from src.main import app
+from src.models import BaseModel
+from src.gestion import services
+from src.gestion.models import CategoriaProducto, Producto
+from src.utils.esquema import agregar_columnas_faltantes
+from src.utils.paginacion import conteos
+
+BaseModel.metadata.create_all(bind=engine)
+agregar_columnas_faltantes(engine, BaseModel.metadata)
+with SessionLocal() as _db:
+    services.crear_indice_busqueda(_db)
+
+PASSWORD = "Secreto12!"
+
+
+@pytest.fixture(autouse=True)
+def base_limpia():
+    """Vacía todas las tablas y los caches antes de cada prueba."""
+    with engine.begin() as conn:
+        for tabla in reversed(BaseModel.metadata.sorted_tables):
+            conn.execute(tabla.delete())
+    for cache in (services.cache_productos, services.cache_catalogo, services.cache_totales_carrito, conteos):
+        cache.limpiar()
+    with SessionLocal() as db:
+        services.verificar_y_crear_roles(db)
+    yield
+
+
+@pytest.fixture
+def db():
+    sesion = SessionLocal()
+    try:
+        yield sesion
+    finally:
+        sesion.close()
+
+
+@pytest.fixture
+def cliente():
+    return TestClient(app)
+
+
+class ContadorSentencias:
+    """Cuenta las sentencias SQL que se ejecutan en los motores sincrónico y asíncrono."""
+
+    def __init__(self):
+        self.total = 0
+
+    def __call__(self, *args):
+        self.total += 1
+
+    def reiniciar(self):
+        self.total = 0
+
+
+@pytest.fixture
+def sentencias():
+    contador = ContadorSentencias()
+    motores = (engine, async_engine.sync_engine)
+    for motor in motores:
+        event.listen(motor, "before_cursor_execute", contador)
+    yield contador
+    for motor in motores:
+        event.remove(motor, "before_cursor_execute", contador)
+
+
+def crear_productos(db, cantidad: int, stock: int = 10) -> list:
+    """Crea `cantidad` productos más con precio 100 * i y devuelve sus ids."""
+    inicio = db.query(Producto).count()
+    categoria = CategoriaProducto(nombre="Cloro", descripcion="Cloro para piscinas", imagen="imagen")
+    db.add(categoria)
+    db.flush()
+    productos = [
+        Producto(
+            codigo=f"PROD-{i:03d}", nombre=f"Producto {i}", descripcion="piscina",
+            precio=100 * i, precio_final=100 * i, stock=stock, imagen="imagen",
+            categoria_id=categoria.id, costo_envio=5,
+        )
+        for i in range(inicio + 1, inicio + cantidad + 1)
+    ]
+    db.add_all(productos)
+    db.commit()
+    return [producto.id for producto in productos]
+
+
+def registrar_usuario(cliente, nombre: str = "cliente") -> tuple:
+    """Registra un usuario, inicia sesión y devuelve (usuario_id, cabeceras)."""
+    respuesta = cliente.post("/registrar", json={
+        "nombre": nombre, "apellido": "Prueba", "nombreUsuario": nombre,
+        "email": f"{nombre}@ejemplo.com", "telefono": 10000000 + zlib.crc32(nombre.encode()) % 90000000, "password": PASSWORD,
+    })
+    assert respuesta.status_code == 200, respuesta.text
+    token = cliente.post("/login", json={"nombreUsuario": nombre, "password": PASSWORD}).json()["access_token"]
+    return respuesta.json()["id"], {"Authorization": f"Bearer {token}"}
+
+
+def en_hilo(funcion, errores: list, resultados: list = None):
+    """Envuelve `funcion(sesion)` para correrla en otro hilo con su propia sesión."""
+    def ejecutar():
+        try:
+            with SessionLocal() as sesion:
+                resultado = funcion(sesion)
+            if resultados is not None:
+                resultados.append(resultado)
+        except Exception as e:  # pragma: no cover - se informa en el assert final
+            errores.append(e)
+    return ejecutar
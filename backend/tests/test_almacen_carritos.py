@@ -0,0 +1,230 @@
+import asyncio
+import json
+import os
+import threading
+from datetime import timedelta
+
+import pytest
+
+from src.database import AsyncSessionLocal
+from src.gestion import schemas, services, services_async
+from src.gestion.almacen_carritos import AlmacenCarritos, AlmacenCarritosMemoria
+from src.gestion.models import Carrito, CarritoDetalle, PedidoDetalle
+from tests.conftest import crear_productos, en_hilo, registrar_usuario
+
+
+@pytest.fixture
+def almacen(tmp_path):
+    return AlmacenCarritosMemoria(str(tmp_path / "carritos_diario.jsonl"))
+
+
+@pytest.fixture
+def usuario_id(cliente):
+    return registrar_usuario(cliente)[0]
+
+
+def escribir_diario(ruta: str, registros: list, resto: str = "") -> None:
+    with open(ruta, "w", encoding="utf-8") as archivo:
+        for registro in registros:
+            archivo.write(json.dumps(registro) + "\n")
+        archivo.write(resto)
+
+
+def lineas_en_base(db, carrito_id: int) -> dict:
+    db.expire_all()
+    return {
+        detalle.producto_id: detalle.cantidad
+        for detalle in db.query(CarritoDetalle).filter(CarritoDetalle.carrito_id == carrito_id)
+    }
+
+
+def test_la_base_es_abstracta():
+    with pytest.raises(TypeError):
+        AlmacenCarritos()
+
+
+def test_recuperar_aplica_volcando_y_luego_el_diario(db, almacen, usuario_id):
+    p1, p2, p3 = crear_productos(db, 3)
+    carrito_id = services.obtener_carrito_o_crear(db, usuario_id).id
+    escribir_diario(almacen.ruta_volcando, [
+        {"u": usuario_id, "c": carrito_id, "p": p1, "n": 2, "s": 200},
+        {"u": usuario_id, "c": carrito_id, "p": p2, "n": 1, "s": 200},
+    ])
+    # El diario vivo es posterior a `.volcando` y termina en una línea a medio escribir
+    escribir_diario(almacen.ruta_diario, [
+        {"u": usuario_id, "c": carrito_id, "p": p1, "n": 5, "s": 500},
+        {"u": usuario_id, "c": carrito_id, "p": p2, "n": 0, "s": 0},
+        {"u": usuario_id, "c": carrito_id, "p": p3, "n": 1, "s": 300},
+    ], resto='{"u": %d, "c": %d, "p": %d, "n"' % (usuario_id, carrito_id, p2))
+
+    assert almacen.recuperar(db) == 1
+
+    assert lineas_en_base(db, carrito_id) == {p1: 5, p3: 1}
+    assert not os.path.exists(almacen.ruta_diario)
+    assert not os.path.exists(almacen.ruta_volcando)
+
+
+def test_recuperar_vaciar_parte_de_un_carrito_vacio(db, almacen, usuario_id):
+    p1, p2 = crear_productos(db, 2)
+    carrito_id = services.obtener_carrito_o_crear(db, usuario_id).id
+    db.add(CarritoDetalle(carrito_id=carrito_id, producto_id=p1, cantidad=4, subtotal=400))
+    db.commit()
+    escribir_diario(almacen.ruta_diario, [
+        {"u": usuario_id, "c": carrito_id, "vaciar": True},
+        {"u": usuario_id, "c": carrito_id, "p": p2, "n": 1, "s": 200},
+    ])
+
+    almacen.recuperar(db)
+
+    assert lineas_en_base(db, carrito_id) == {p2: 1}
+
+
+def test_recuperar_ignora_lo_anterior_a_descartar(db, almacen, usuario_id):
+    p1, p2 = crear_productos(db, 2)
+    carrito_id = services.obtener_carrito_o_crear(db, usuario_id).id
+    db.add(CarritoDetalle(carrito_id=carrito_id, producto_id=p1, cantidad=1, subtotal=100))
+    db.commit()
+    # Cambios que el pedido ya consumió: después del descarte no deben volver
+    escribir_diario(almacen.ruta_diario, [
+        {"u": usuario_id, "c": carrito_id, "p": p2, "n": 3, "s": 600},
+        {"u": usuario_id, "descartar": True},
+    ])
+
+    assert almacen.recuperar(db) == 0
+
+    assert lineas_en_base(db, carrito_id) == {p1: 1}
+
+
+def test_recuperar_despues_de_un_corte(db, almacen, usuario_id):
+    p1, p2 = crear_productos(db, 2)
+    almacen.agregar(db, usuario_id, p1, 2)
+    almacen.agregar(db, usuario_id, p2, 1)
+    almacen.actualizar_cantidad(db, usuario_id, p1, 3)
+    carrito_id = services.obtener_carrito_por_usuario(db, usuario_id).id
+    assert lineas_en_base(db, carrito_id) == {}
+
+    # Otro proceso arranca con el mismo diario
+    nuevo = AlmacenCarritosMemoria(almacen.ruta_diario)
+    nuevo.recuperar(db)
+
+    assert lineas_en_base(db, carrito_id) == {p1: 3, p2: 1}
+
+
+def test_un_volcado_en_curso_no_duplica_lineas_del_checkout(db, almacen, usuario_id):
+    (p1,) = crear_productos(db, 1)
+    almacen.agregar(db, usuario_id, p1, 2)
+
+    escribiendo, seguir = threading.Event(), threading.Event()
+    escribir_original = almacen._escribir
+
+    def escribir_lento(sesion, instantanea):
+        if threading.current_thread().name == "volcado-periodico":
+            escribiendo.set()
+            assert seguir.wait(5)
+        return escribir_original(sesion, instantanea)
+
+    almacen._escribir = escribir_lento
+    errores = []
+
+    volcado = threading.Thread(target=en_hilo(almacen.volcar, errores), name="volcado-periodico")
+    volcado.start()
+    assert escribiendo.wait(5)
+
+    # Mientras el volcado escribe la instantánea vieja, el cliente suma una unidad y paga
+    almacen.agregar(db, usuario_id, p1, 1)
+    pedidos = []
+    checkout = threading.Thread(target=en_hilo(lambda sesion: almacen.confirmar_pedido(
+        sesion, usuario_id, lambda s: services.crear_pedido(s, schemas.PedidoCreate(usuario_id=usuario_id)).id
+    ), errores, pedidos))
+    checkout.start()
+    checkout.join(0.3)
+    assert checkout.is_alive(), "el checkout tiene que esperar al volcado en curso"
+
+    seguir.set()
+    volcado.join(5)
+    checkout.join(5)
+    assert not errores
+
+    db.expire_all()
+    vendidas = db.query(PedidoDetalle.cantidad).filter(PedidoDetalle.pedido_id == pedidos[0]).all()
+    assert vendidas == [(3,)]
+    assert db.query(CarritoDetalle).count() == 0
+
+    # Un volcado posterior no revive las líneas compradas
+    almacen.volcar(db)
+    assert db.query(CarritoDetalle).count() == 0
+    assert almacen.listar(db, usuario_id) == []
+
+
+def test_el_barrido_no_borra_un_carrito_que_se_esta_cargando(db, almacen, usuario_id, monkeypatch):
+    (p1,) = crear_productos(db, 1)
+    carrito = services.obtener_carrito_o_crear(db, usuario_id)
+    carrito.fecha_actualizacion = services.ahora_local() - timedelta(days=60)
+    db.commit()
+
+    barriendo, seguir = threading.Event(), threading.Event()
+    barrer_original = services.barrer_carritos_abandonados
+
+    def barrer_lento(*args, **kwargs):
+        barriendo.set()
+        assert seguir.wait(5)
+        return barrer_original(*args, **kwargs)
+
+    monkeypatch.setattr(services, "barrer_carritos_abandonados", barrer_lento)
+    errores, borrados = [], []
+    barrido = threading.Thread(target=en_hilo(almacen.barrer_abandonados, errores, borrados))
+    barrido.start()
+    assert barriendo.wait(5)
+
+    # El usuario vuelve mientras el barrido ya eligió qué carritos no tocar
+    carga = threading.Thread(target=en_hilo(lambda sesion: almacen.agregar(sesion, usuario_id, p1, 1), errores))
+    carga.start()
+    carga.join(0.3)
+    assert carga.is_alive(), "la carga tiene que esperar al barrido en curso"
+
+    seguir.set()
+    barrido.join(5)
+    carga.join(5)
+    assert not errores
+    assert borrados == [1]
+
+    # El carrito en memoria es uno nuevo, que sigue en la base al volcarlo
+    almacen.volcar(db)
+    db.expire_all()
+    carrito_id = almacen._carritos[usuario_id].carrito_id
+    assert db.get(Carrito, carrito_id) is not None
+    assert lineas_en_base(db, carrito_id) == {p1: 1}
+
+
+def test_dos_corrutinas_no_vuelcan_a_la_vez(db, almacen, usuario_id, monkeypatch):
+    (p1,) = crear_productos(db, 1)
+    monkeypatch.setattr(services_async, "almacen_carritos", almacen)
+    almacen.agregar(db, usuario_id, p1, 2)
+
+    # Cuenta cuántas secciones protegidas por el lock de volcado corren a la vez
+    activos, maximo = [0], [0]
+    volcar_original = almacen._volcar
+
+    def volcar_contando(sesion, usuario):
+        activos[0] += 1
+        maximo[0] = max(maximo[0], activos[0])
+        try:
+            return volcar_original(sesion, usuario)
+        finally:
+            activos[0] -= 1
+
+    almacen._volcar = volcar_contando
+
+    async def carrera():
+        async with AsyncSessionLocal() as uno, AsyncSessionLocal() as otro:
+            return await asyncio.gather(
+                services_async.volcar_carrito(uno, usuario_id),
+                services_async.crear_pedido(otro, schemas.PedidoCreate(usuario_id=usuario_id)),
+            )
+
+    volcados, pedido = asyncio.run(carrera())
+
+    assert maximo[0] == 1
+    db.expire_all()
+    assert db.query(PedidoDetalle.cantidad).filter(PedidoDetalle.pedido_id == pedido.id).all() == [(2,)]
+    assert db.query(CarritoDetalle).count() == 0
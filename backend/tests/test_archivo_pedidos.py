@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, text
+
+from src.gestion import services
+from src.gestion.models import Empresa, Envio, EstadoPedido, Pedido, PedidoArchivado, PedidoDetalle
+from src.utils.esquema import activar_autoincremento_sqlite
+from tests.conftest import crear_productos, registrar_usuario
+
+
+def crear_pedido_viejo(db, usuario_id: int, producto_id: int) -> int:
+    pedido = Pedido(
+        total=100, usuario_id=usuario_id, estado=EstadoPedido.ENTREGADO,
+        fecha_creacion=services.ahora_local() - timedelta(days=30),
+    )
+    db.add(pedido)
+    db.flush()
+    db.add(PedidoDetalle(cantidad=1, subtotal=100, precio_unitario=100, pedido_id=pedido.id, producto_id=producto_id))
+    db.commit()
+    return pedido.id
+
+
+def test_los_ids_archivados_no_se_reutilizan(db, cliente):
+    usuario_id, _ = registrar_usuario(cliente)
+    (producto_id,) = crear_productos(db, 1)
+    archivado = crear_pedido_viejo(db, usuario_id, producto_id)
+    assert services.archivar_pedidos(db, dias=1) == 1
+
+    nuevo = crear_pedido_viejo(db, usuario_id, producto_id)
+    assert nuevo > archivado
+    # La segunda pasada no choca con el archivo
+    assert services.archivar_pedidos(db, dias=1) == 1
+    assert db.query(PedidoArchivado).count() == 2
+
+
+def test_los_archivados_siguen_en_el_historial_del_usuario(db, cliente):
+    usuario_id, _ = registrar_usuario(cliente)
+    (producto_id,) = crear_productos(db, 1)
+    archivado = crear_pedido_viejo(db, usuario_id, producto_id)
+    empresa = Empresa(nombre="Correo", direccion="Centro", telefono=1, imagen="")
+    db.add(empresa)
+    db.flush()
+    db.add(Envio(direccion="Calle 1", empresa_id=empresa.id, codigoSeguimiento="AB1", pedido_id=archivado))
+    db.commit()
+    assert services.archivar_pedidos(db, dias=1) == 1
+    db.add(Pedido(total=50, usuario_id=usuario_id, estado=EstadoPedido.PENDIENTE))
+    db.commit()
+
+    historial = cliente.get(f"/pedidos/usuario/{usuario_id}/completo").json()
+    assert historial["total"] == 2
+    viejo = historial["pedidos"][-1]
+    assert viejo["id"] == archivado and viejo["estado"] == "ENTREGADO"
+    assert [d["producto"]["id"] for d in viejo["detalles"]] == [producto_id]
+    assert [e["codigoSeguimiento"] for e in viejo["envios"]] == ["AB1"]
+
+    respuesta = cliente.get(f"/pedidos/{archivado}")
+    assert respuesta.status_code == 200
+    assert respuesta.json()["total"] == 100
+
+
+def test_archivar_rechaza_cero_dias(cliente):
+    _, cabeceras = registrar_usuario(cliente)
+    respuesta = cliente.post("/pedidos/archivar", params={"dias": 0}, headers=cabeceras)
+    assert respuesta.status_code == 422
+
+
+def test_reconstruye_tablas_viejas_con_autoincrement(tmp_path):
+    motor = create_engine(f"sqlite:///{tmp_path / 'vieja.db'}")
+    with motor.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE pedidos (id INTEGER NOT NULL PRIMARY KEY, nombre VARCHAR)")
+        conn.exec_driver_sql("INSERT INTO pedidos (id, nombre) VALUES (1, 'a'), (2, 'b')")
+    metadata = MetaData()
+    Table("pedidos", metadata, Column("id", Integer, primary_key=True, index=True), Column("nombre", String),
+          sqlite_autoincrement=True)
+
+    activar_autoincremento_sqlite(motor, metadata)
+
+    with motor.begin() as conn:
+        sql = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'pedidos'").scalar()
+        assert "AUTOINCREMENT" in sql
+        assert conn.execute(text("SELECT id, nombre FROM pedidos ORDER BY id")).all() == [(1, "a"), (2, "b")]
+        conn.exec_driver_sql("DELETE FROM pedidos WHERE id = 2")
+        conn.exec_driver_sql("INSERT INTO pedidos (nombre) VALUES ('c')")
+        assert conn.execute(text("SELECT max(id) FROM pedidos")).scalar() == 3
@@ -0,0 +1,46 @@
+"""Las caches por proceso no sirven datos viejos cuando otro worker cambió la base."""
+from src.gestion import services
+from src.gestion.models import CategoriaProducto, Producto
+from tests.conftest import crear_productos
+
+
+def cambio_de_otro_worker(db, tabla: str, *sentencias) -> None:
+    """Escribe y sube la versión sin pasar por las invalidaciones de este proceso."""
+    for sentencia in sentencias:
+        db.execute(sentencia)
+    services.incrementar_version(db, tabla)
+    db.commit()
+
+
+def test_producto_cacheado_sigue_la_version(db, cliente):
+    (producto_id,) = crear_productos(db, 1)
+    primera = cliente.get(f"/productos/{producto_id}")
+    assert primera.json()["nombre"] == "Producto 1"
+
+    cambio_de_otro_worker(db, "productos", Producto.__table__.update().values(nombre="Renombrado"))
+
+    segunda = cliente.get(f"/productos/{producto_id}", headers={"If-None-Match": primera.headers["ETag"]})
+    assert segunda.status_code == 200
+    assert segunda.json()["nombre"] == "Renombrado"
+    assert segunda.headers["ETag"] != primera.headers["ETag"]
+
+
+def test_listado_de_categorias_sigue_la_version(db, cliente):
+    crear_productos(db, 1)
+    assert [c["nombre"] for c in cliente.get("/categorias").json()["categorias"]] == ["Cloro"]
+
+    cambio_de_otro_worker(db, "categorias", CategoriaProducto.__table__.update().values(nombre="Químicos"))
+
+    assert [c["nombre"] for c in cliente.get("/categorias").json()["categorias"]] == ["Químicos"]
+
+
+def test_total_por_precio_sigue_el_recalculo_de_precios(db, cliente):
+    (producto_id,) = crear_productos(db, 1)
+    assert cliente.get("/productos", params={"precio_max": 150}).json()["total"] == 1
+
+    # Como al borrar un descuento: cambia el precio final sin crear ni borrar productos
+    db.query(Producto).update({Producto.precio: 200})
+    services.recalcular_precios_finales(db, Producto.id == producto_id)
+    db.commit()
+
+    assert cliente.get("/productos", params={"precio_max": 150}).json()["total"] == 0
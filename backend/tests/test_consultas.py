@@ -0,0 +1,98 @@
+"""
+La cantidad de sentencias de las rutas más usadas no depende de cuántas filas
+devuelven: cada prueba mide con una fila y con varias y exige el mismo número.
+"""
+import pytest
+
+import src.pagos.router as pagos
+from src.gestion import services
+from src.gestion.models import Pedido, PedidoDetalle
+from src.utils.paginacion import conteos
+from tests.conftest import crear_productos, registrar_usuario
+
+VARIAS = 6
+
+
+def contar(sentencias, solicitud) -> int:
+    """Sentencias de una solicitud con los caches vacíos, para medir la base."""
+    for cache in (services.cache_productos, services.cache_catalogo, services.cache_totales_carrito, conteos):
+        cache.limpiar()
+    sentencias.reiniciar()
+    respuesta = solicitud()
+    assert respuesta.status_code < 300, respuesta.text
+    return sentencias.total
+
+
+def llenar_carrito(cliente, cabeceras: dict, producto_ids: list) -> None:
+    for producto_id in producto_ids:
+        respuesta = cliente.post(
+            "/carritos/productos", params={"producto_id": producto_id},
+            json={"cantidad": 1, "subtotal": 0}, headers=cabeceras,
+        )
+        assert respuesta.status_code == 201, respuesta.text
+
+
+def test_listado_de_productos(db, cliente, sentencias):
+    crear_productos(db, 1)
+    una = contar(sentencias, lambda: cliente.get("/productos", params={"tamanio": 50}))
+    crear_productos(db, VARIAS)
+    varias = contar(sentencias, lambda: cliente.get("/productos", params={"tamanio": 50}))
+    assert una == varias
+
+
+def test_detalle_de_producto(db, cliente, sentencias):
+    (producto_id,) = crear_productos(db, 1)
+    una = contar(sentencias, lambda: cliente.get(f"/productos/{producto_id}"))
+    crear_productos(db, VARIAS)
+    varias = contar(sentencias, lambda: cliente.get(f"/productos/{producto_id}"))
+    assert una == varias
+
+
+def test_listado_del_carrito(db, cliente, sentencias):
+    _, cabeceras = registrar_usuario(cliente)
+    producto_ids = crear_productos(db, VARIAS)
+    llenar_carrito(cliente, cabeceras, producto_ids[:1])
+    una = contar(sentencias, lambda: cliente.get("/carritos/detalles", headers=cabeceras))
+    llenar_carrito(cliente, cabeceras, producto_ids[1:])
+    varias = contar(sentencias, lambda: cliente.get("/carritos/detalles", headers=cabeceras))
+    assert una == varias
+
+
+def test_listado_de_pedidos(db, cliente, sentencias):
+    usuario_id, _ = registrar_usuario(cliente)
+    (producto_id,) = crear_productos(db, 1)
+
+    def crear_pedidos(cantidad: int) -> None:
+        for _ in range(cantidad):
+            pedido = Pedido(total=100, usuario_id=usuario_id)
+            db.add(pedido)
+            db.flush()
+            db.add(PedidoDetalle(cantidad=1, subtotal=100, precio_unitario=100, pedido_id=pedido.id, producto_id=producto_id))
+        db.commit()
+
+    crear_pedidos(1)
+    una = contar(sentencias, lambda: cliente.get("/pedidos", params={"tamanio": 50}))
+    crear_pedidos(VARIAS)
+    varias = contar(sentencias, lambda: cliente.get("/pedidos", params={"tamanio": 50}))
+    assert una == varias
+
+
+class PreferenciaFalsa:
+    def create(self, datos):
+        return {"response": {"id": "preferencia-de-prueba"}}
+
+
+class SDKFalso:
+    def preference(self):
+        return PreferenciaFalsa()
+
+
+def test_crear_preferencia(db, cliente, sentencias, monkeypatch):
+    monkeypatch.setattr(pagos, "sdk", SDKFalso())
+    usuario_id, cabeceras = registrar_usuario(cliente)
+    producto_ids = crear_productos(db, VARIAS)
+    llenar_carrito(cliente, cabeceras, producto_ids[:1])
+    una = contar(sentencias, lambda: cliente.post(f"/crear_preferencia/{usuario_id}"))
+    llenar_carrito(cliente, cabeceras, producto_ids[1:])
+    varias = contar(sentencias, lambda: cliente.post(f"/crear_preferencia/{usuario_id}"))
+    assert una == varias
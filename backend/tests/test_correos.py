@@ -0,0 +1,23 @@
+import pytest
+
+from src.gestion.models import Rol, Usuario
+from tests.conftest import registrar_usuario
+
+RUTAS = [("get", "/correos"), ("get", "/correos/estadisticas"), ("post", "/correos/1/reintentar")]
+
+
+@pytest.mark.parametrize("metodo, ruta", RUTAS)
+def test_la_bandeja_de_salida_es_solo_para_administradores(db, cliente, metodo, ruta):
+    _, cabeceras = registrar_usuario(cliente)
+    assert getattr(cliente, metodo)(ruta).status_code == 401
+    assert getattr(cliente, metodo)(ruta, headers=cabeceras).status_code == 403
+
+
+def test_el_administrador_ve_la_bandeja_de_salida(db, cliente):
+    usuario_id, cabeceras = registrar_usuario(cliente, "admin")
+    administrador = db.query(Rol).filter(Rol.nombre == "administrador").one()
+    db.query(Usuario).filter(Usuario.id == usuario_id).update({Usuario.rol_id: administrador.id})
+    db.commit()
+
+    assert cliente.get("/correos", headers=cabeceras).status_code == 200
+    assert cliente.get("/correos/estadisticas", headers=cabeceras).status_code == 200
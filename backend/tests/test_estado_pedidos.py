@@ -0,0 +1,41 @@
+from src.gestion import schemas, services
+from src.gestion.models import EstadoPedido, Pedido
+from tests.conftest import registrar_usuario
+
+
+def crear_pedido(db, usuario_id: int, estado: EstadoPedido) -> int:
+    pedido = Pedido(total=100, usuario_id=usuario_id, estado=estado)
+    db.add(pedido)
+    db.commit()
+    return pedido.id
+
+
+def cambiar_estado(cliente, pedido_id: int, estado: str):
+    return cliente.put(f"/pedidos/{pedido_id}/estado", json={"id": pedido_id, "estado": estado})
+
+
+def test_cambio_de_estado_individual_permite_corregir(db, cliente):
+    usuario_id, _ = registrar_usuario(cliente)
+    pedido_id = crear_pedido(db, usuario_id, EstadoPedido.ENTREGADO)
+
+    # Una corrección del administrador, fuera de TRANSICIONES_PEDIDO
+    respuesta = cambiar_estado(cliente, pedido_id, "PENDIENTE")
+    assert respuesta.status_code == 200
+    assert respuesta.json()["estado"] == "PENDIENTE"
+    db.expire_all()
+    assert db.get(Pedido, pedido_id).estado == EstadoPedido.PENDIENTE
+
+
+def test_cambio_masivo_informa_el_estado_reemplazado(db, cliente):
+    usuario_id, _ = registrar_usuario(cliente)
+    pendiente = crear_pedido(db, usuario_id, EstadoPedido.PENDIENTE)
+    entregado = crear_pedido(db, usuario_id, EstadoPedido.ENTREGADO)
+
+    resultado = services.actualizar_estado_pedidos(
+        db, [pendiente, entregado, 999], schemas.EstadoPedidoEnum.CANCELADO, usuario_id
+    )
+
+    assert resultado["actualizados"] == 1
+    assert [(r["pedido_id"], r["actualizado"], r["estado_anterior"]) for r in resultado["resultados"]] == [
+        (pendiente, True, "PENDIENTE"), (entregado, False, "ENTREGADO"), (999, False, None),
+    ]
@@ -0,0 +1,50 @@
+import pytest
+
+from src.gestion import services_async
+from src.gestion.models import ClaveIdempotencia, EstadoIdempotencia, Pedido
+from tests.conftest import crear_productos, registrar_usuario
+
+
+@pytest.fixture
+def carrito_con_producto(db, cliente):
+    usuario_id, cabeceras = registrar_usuario(cliente)
+    (producto_id,) = crear_productos(db, 1)
+    respuesta = cliente.post("/carritos/productos", params={"producto_id": producto_id}, json={"cantidad": 2, "subtotal": 0}, headers=cabeceras)
+    assert respuesta.status_code == 201, respuesta.text
+    return usuario_id, cabeceras
+
+
+def crear_pedido(cliente, usuario_id: int, cabeceras: dict):
+    return cliente.post("/pedidos", json={"usuario_id": usuario_id}, headers={**cabeceras, "Idempotency-Key": "clave-1"})
+
+
+def test_reintento_devuelve_el_mismo_pedido(db, cliente, carrito_con_producto):
+    usuario_id, cabeceras = carrito_con_producto
+    primera = crear_pedido(cliente, usuario_id, cabeceras)
+    segunda = crear_pedido(cliente, usuario_id, cabeceras)
+
+    assert primera.status_code == segunda.status_code == 201
+    assert segunda.headers["Idempotent-Replayed"] == "true"
+    assert segunda.json() == primera.json()
+    assert db.query(Pedido).count() == 1
+
+
+def test_la_clave_se_completa_con_el_commit_del_pedido(db, cliente, carrito_con_producto, monkeypatch):
+    usuario_id, cabeceras = carrito_con_producto
+
+    # Falla todo lo que viene después del commit del pedido
+    async def caida(*args, **kwargs):
+        raise RuntimeError("proceso caído")
+    monkeypatch.setattr(services_async, "registrar_actividad", caida)
+    with pytest.raises(RuntimeError):
+        crear_pedido(cliente, usuario_id, cabeceras)
+    monkeypatch.undo()
+
+    clave = db.query(ClaveIdempotencia).one()
+    assert clave.estado == EstadoIdempotencia.COMPLETADA
+    pedido = db.query(Pedido).one()
+
+    reintento = crear_pedido(cliente, usuario_id, cabeceras)
+    assert reintento.status_code == 201
+    assert reintento.json()["id"] == pedido.id
+    assert db.query(Pedido).count() == 1
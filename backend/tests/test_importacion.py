@@ -0,0 +1,54 @@
+import io
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from src.gestion import services
+from src.gestion.models import Producto
+from tests.conftest import crear_productos
+
+
+def archivo_jsonl(filas: list, resto: bytes = b"") -> io.BytesIO:
+    contenido = "".join(json.dumps(fila) + "\n" for fila in filas).encode("utf-8")
+    return io.BytesIO(contenido + resto)
+
+
+def fila(categoria_id: int, numero: int) -> dict:
+    return {
+        "nombre": f"Importado {numero}", "descripcion": "piscina", "precio": 100,
+        "stock": 5, "imagen": "https://imagen", "categoria_id": categoria_id,
+    }
+
+
+@pytest.fixture
+def categoria_id(db):
+    (producto_id,) = crear_productos(db, 1)
+    return db.get(Producto, producto_id).categoria_id
+
+
+def test_un_error_de_lectura_no_deja_nada_importado(db, categoria_id, monkeypatch):
+    # Lotes chicos: antes cada lote ya quedaba confirmado al llegar al error
+    monkeypatch.setattr(services, "TAMANIO_LOTE_IMPORTACION", 2)
+    archivo = archivo_jsonl([fila(categoria_id, i) for i in range(5)], resto=b"\xff\xfe roto\n")
+
+    with pytest.raises(HTTPException) as error:
+        services.importar_productos(db, archivo, "jsonl")
+
+    assert error.value.status_code == 400
+    assert db.query(Producto).count() == 1
+
+
+def test_un_codigo_repetido_se_informa_como_error_de_fila(db, categoria_id):
+    # El próximo código generado es PROD-002; el siguiente ya está tomado
+    db.query(Producto).update({Producto.codigo: "PROD-003"})
+    db.commit()
+    archivo = archivo_jsonl([fila(categoria_id, i) for i in range(3)])
+
+    resultado = services.importar_productos(db, archivo, "jsonl")
+
+    assert resultado["importados"] == 2
+    assert [error["fila"] for error in resultado["errores"]] == [2]
+    assert sorted(codigo for (codigo,) in db.query(Producto.codigo)) == ["PROD-002", "PROD-003", "PROD-004"]
+    assert db.query(Producto).filter(Producto.precio_final.is_(None)).count() == 0
+    assert services.obtener_versiones(db, "productos")["productos"] == 1
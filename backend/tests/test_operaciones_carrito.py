@@ -0,0 +1,57 @@
+import pytest
+
+from src.gestion.models import CarritoDetalle
+from tests.conftest import crear_productos, registrar_usuario
+
+
+@pytest.fixture
+def cabeceras(cliente):
+    return registrar_usuario(cliente)[1]
+
+
+def operar(cliente, cabeceras: dict, *operaciones: dict):
+    return cliente.post("/carritos/operaciones", json={"operaciones": list(operaciones)}, headers=cabeceras)
+
+
+@pytest.mark.parametrize("quitar", [
+    {"tipo": "eliminar"},
+    {"tipo": "actualizar", "cantidad": 0},
+])
+def test_quitar_y_volver_a_agregar_en_el_mismo_lote(db, cliente, cabeceras, quitar):
+    (producto_id,) = crear_productos(db, 1)
+    assert operar(cliente, cabeceras, {"tipo": "agregar", "producto_id": producto_id, "cantidad": 2}).status_code == 200
+
+    respuesta = operar(
+        cliente, cabeceras,
+        {**quitar, "producto_id": producto_id},
+        {"tipo": "agregar", "producto_id": producto_id, "cantidad": 3},
+    )
+
+    assert respuesta.status_code == 200, respuesta.text
+    assert [(linea["producto_id"], linea["cantidad"], linea["subtotal"]) for linea in respuesta.json()] == [
+        (producto_id, 3, 300),
+    ]
+    assert db.query(CarritoDetalle).count() == 1
+
+
+def test_agregar_y_quitar_en_el_mismo_lote_no_deja_lineas(db, cliente, cabeceras):
+    (producto_id,) = crear_productos(db, 1)
+
+    respuesta = operar(
+        cliente, cabeceras,
+        {"tipo": "agregar", "producto_id": producto_id, "cantidad": 1},
+        {"tipo": "eliminar", "producto_id": producto_id},
+    )
+
+    assert respuesta.status_code == 200, respuesta.text
+    assert respuesta.json() == []
+    assert db.query(CarritoDetalle).count() == 0
+
+
+def test_agregar_sin_cantidad_es_invalido(db, cliente, cabeceras):
+    (producto_id,) = crear_productos(db, 1)
+
+    respuesta = operar(cliente, cabeceras, {"tipo": "agregar", "producto_id": producto_id})
+
+    assert respuesta.status_code == 422
+    assert db.query(CarritoDetalle).count() == 0
@@ -0,0 +1,38 @@
+from src.gestion import schemas, services
+from src.gestion.models import Carrito, CarritoDetalle, EstadoCarrito, PedidoDetalle, Producto
+from tests.conftest import crear_productos, registrar_usuario
+
+
+def test_el_cambio_de_precio_solo_reprecia_carritos_abiertos(db, cliente):
+    (producto_id,) = crear_productos(db, 1)
+    abierto = services.obtener_carrito_o_crear(db, registrar_usuario(cliente, "abierto")[0])
+    # Un carrito que ya no es el activo de su usuario (ver obtener_carrito_por_usuario)
+    cerrado = Carrito(usuario_id=registrar_usuario(cliente, "cerrado")[0], estado=EstadoCarrito.PENDIENTE)
+    db.add(cerrado)
+    db.flush()
+    for carrito in (abierto, cerrado):
+        db.add(CarritoDetalle(carrito_id=carrito.id, producto_id=producto_id, cantidad=2, subtotal=200))
+    db.commit()
+
+    db.query(Producto).update({Producto.precio: 150})
+    services.recalcular_precios_finales(db, Producto.id == producto_id)
+    db.commit()
+
+    subtotales = dict(db.query(CarritoDetalle.carrito_id, CarritoDetalle.subtotal))
+    assert subtotales == {abierto.id: 300, cerrado.id: 200}
+
+
+def test_el_pedido_usa_el_precio_vigente_en_detalles_y_total(db, cliente):
+    (producto_id,) = crear_productos(db, 1)
+    usuario_id, _ = registrar_usuario(cliente)
+    carrito = services.obtener_carrito_o_crear(db, usuario_id)
+    # Subtotal guardado con un precio que ya no es el vigente
+    db.add(CarritoDetalle(carrito_id=carrito.id, producto_id=producto_id, cantidad=2, subtotal=200))
+    db.query(Producto).update({Producto.precio: 150})
+    db.commit()
+
+    pedido = services.crear_pedido(db, schemas.PedidoCreate(usuario_id=usuario_id))
+
+    detalle = db.query(PedidoDetalle).filter(PedidoDetalle.pedido_id == pedido.id).one()
+    assert (detalle.precio_unitario, detalle.subtotal) == (150, 300)
+    assert pedido.total == detalle.subtotal + 2 * 5
@@ -0,0 +1,51 @@
+import threading
+
+from sqlalchemy import event
+
+from src.database import engine
+from src.gestion import exceptions, services
+from src.gestion.models import CarritoDetalle, ReservaStock
+from tests.conftest import crear_productos, en_hilo, registrar_usuario
+
+
+def test_reservar_toma_el_bloqueo_de_escritura_antes_de_leer(db, cliente):
+    (producto_id,) = crear_productos(db, 1)
+    usuario_id, _ = registrar_usuario(cliente)
+    carrito = services.obtener_carrito_o_crear(db, usuario_id)
+    db.add(CarritoDetalle(carrito_id=carrito.id, producto_id=producto_id, cantidad=1, subtotal=100))
+    db.commit()
+
+    ejecutadas = []
+    def registrar(conn, cursor, sentencia, *args):
+        ejecutadas.append(sentencia)
+    event.listen(engine, "before_cursor_execute", registrar)
+    try:
+        services.reservar_stock(db, usuario_id)
+    finally:
+        event.remove(engine, "before_cursor_execute", registrar)
+
+    assert ejecutadas[0] == "BEGIN IMMEDIATE"
+
+
+def test_reservas_simultaneas_no_fallan_por_bloqueo(db, cliente):
+    (producto_id,) = crear_productos(db, 1, stock=3)
+    usuarios = [registrar_usuario(cliente, f"cliente{i}")[0] for i in range(8)]
+    for usuario_id in usuarios:
+        carrito = services.obtener_carrito_o_crear(db, usuario_id)
+        db.add(CarritoDetalle(carrito_id=carrito.id, producto_id=producto_id, cantidad=1, subtotal=100))
+    db.commit()
+
+    errores, resultados = [], []
+    hilos = [
+        threading.Thread(target=en_hilo(lambda sesion, u=u: services.reservar_stock(sesion, u), errores, resultados))
+        for u in usuarios
+    ]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    # Solo falta stock: ningún checkout cae por "database is locked"
+    assert all(isinstance(error, exceptions.StockInsuficiente) for error in errores), errores
+    assert len(resultados) == 3
+    assert db.query(ReservaStock).count() == 3
@@ -21,7 +21,7 @@ import {
 } from "@chakra-ui/react";
 import { listarPedidoDetalles, listarProductos } from "../../../services/api";
 
-const ListarDetallesPedido = ({ pedidoId, isOpen, onClose }) => {
+const ListarDetallesPedido = ({ pedidoId, isOpen, onClose, detallesPedido }) => {
   const [detalles, setDetalles] = useState([]);
   const [productos, setProductos] = useState([]);
   const [loading, setLoading] = useState(false);
@@ -32,10 +32,15 @@ const ListarDetallesPedido = ({ pedidoId, isOpen, onClose }) => {
 
   useEffect(() => {
     if (isOpen) {
-      cargarDetalles();
-      cargarProductos();
+      // El historial ya trae los detalles con el nombre del producto
+      if (detallesPedido) {
+        setDetalles(detallesPedido);
+      } else {
+        cargarDetalles();
+        cargarProductos();
+      }
     }
-  }, [isOpen]);
+  }, [isOpen, detallesPedido]);
 
   const cargarProductos = async () => {
     try {
@@ -70,8 +75,9 @@ const ListarDetallesPedido = ({ pedidoId, isOpen, onClose }) => {
     }
   };
 
-  const obtenerNombreProducto = (productoId) => {
-    const producto = productos.find((prod) => prod.id === productoId);
+  const obtenerNombreProducto = (detalle) => {
+    if (detalle.producto) return detalle.producto.nombre;
+    const producto = productos.find((prod) => prod.id === detalle.producto_id);
     return producto ? producto.nombre : "Desconocido";
   };
 
@@ -108,7 +114,7 @@ const ListarDetallesPedido = ({ pedidoId, isOpen, onClose }) => {
                 <Tbody>
                   {detallesPaginados.map((detalle) => (
                     <Tr key={detalle.id}>
-                      <Td>{obtenerNombreProducto(detalle.producto_id)}</Td>
+                      <Td>{obtenerNombreProducto(detalle)}</Td>
                       <Td textAlign="center">{detalle.cantidad}</Td>
                       <Td textAlign="right">${detalle.precio_unitario.toFixed(2)}</Td>
                       <Td textAlign="right">${detalle.subtotal.toFixed(2)}</Td>
@@ -17,11 +17,14 @@ import {
   AlertDialogHeader,
   AlertDialogContent,
   AlertDialogOverlay,
+  Checkbox,
+  Flex,
+  Text,
 } from "@chakra-ui/react";
 import { FaEye, FaUser } from "react-icons/fa";
 import ListarDetallesPedido from "./ListarDetallesPedido";
 import VerUsuario from "./VerUsuario";
-import { obtenerUsuarioPorId, actualizarEstadoPedido } from "../../../services/api";
+import { obtenerUsuarioPorId, actualizarEstadoPedido, actualizarEstadoPedidos } from "../../../services/api";
 
 const ListarPedidos = ({ pedidos: pedidosProps }) => {
   const { isOpen: isDetallesOpen, onOpen: onDetallesOpen, onClose: onDetallesClose } = useDisclosure();
@@ -31,6 +34,8 @@ const ListarPedidos = ({ pedidos: pedidosProps }) => {
   const [pedidos, setPedidos] = useState([]);
   const [usuarioSeleccionado, setUsuarioSeleccionado] = useState(null);
   const [estadoCambio, setEstadoCambio] = useState({ pedidoId: null, nuevoEstado: null });
+  const [seleccionados, setSeleccionados] = useState([]);
+  const [cambiandoMasivo, setCambiandoMasivo] = useState(false);
   const toast = useToast();
   const cancelRef = React.useRef();
   
@@ -123,6 +128,51 @@ const ListarPedidos = ({ pedidos: pedidosProps }) => {
     }
   };
 
+  const toggleSeleccion = (pedidoId) => {
+    setSeleccionados((prev) =>
+      prev.includes(pedidoId) ? prev.filter((id) => id !== pedidoId) : [...prev, pedidoId]
+    );
+  };
+
+  const toggleSeleccionTodos = () => {
+    setSeleccionados(seleccionados.length === pedidos.length ? [] : pedidos.map((pedido) => pedido.id));
+  };
+
+  // Cambia el estado de todos los seleccionados en una sola solicitud
+  const cambiarEstadoSeleccionados = async (nuevoEstado) => {
+    setCambiandoMasivo(true);
+    try {
+      const data = await actualizarEstadoPedidos(seleccionados, nuevoEstado);
+      const actualizados = new Set(
+        data.resultados.filter((resultado) => resultado.actualizado).map((resultado) => resultado.pedido_id)
+      );
+      setPedidos((prevPedidos) =>
+        prevPedidos.map((pedido) => (actualizados.has(pedido.id) ? { ...pedido, estado: nuevoEstado } : pedido))
+      );
+      setSeleccionados([]);
+      const rechazados = data.resultados.length - data.actualizados;
+      toast({
+        title: "Estados actualizados",
+        description: rechazados
+          ? `${data.actualizados} pedidos actualizados, ${rechazados} no admiten el cambio a ${nuevoEstado}.`
+          : `${data.actualizados} pedidos pasaron a ${nuevoEstado}.`,
+        status: rechazados ? "warning" : "success",
+        duration: 4000,
+        isClosable: true,
+      });
+    } catch (error) {
+      toast({
+        title: "Error",
+        description: "No se pudieron actualizar los pedidos seleccionados.",
+        status: "error",
+        duration: 3000,
+        isClosable: true,
+      });
+    } finally {
+      setCambiandoMasivo(false);
+    }
+  };
+
   // Función para obtener las opciones disponibles según el estado actual
   const getAvailableOptions = (estadoActual) => {
     const allOptions = ["PENDIENTE", "ENVIADO", "ENTREGADO"];
@@ -161,9 +211,27 @@ const ListarPedidos = ({ pedidos: pedidosProps }) => {
         borderColor="gray.200"
         overflow="hidden"
       >
+        {seleccionados.length > 0 && (
+          <Flex mb={4} align="center" gap={2}>
+            <Text fontSize="sm" color="gray.600">{seleccionados.length} seleccionados</Text>
+            <Button size="sm" colorScheme="orange" onClick={() => cambiarEstadoSeleccionados("ENVIADO")} isLoading={cambiandoMasivo}>
+              Marcar como ENVIADO
+            </Button>
+            <Button size="sm" colorScheme="green" onClick={() => cambiarEstadoSeleccionados("ENTREGADO")} isLoading={cambiandoMasivo}>
+              Marcar como ENTREGADO
+            </Button>
+          </Flex>
+        )}
         <Table variant="simple" minWidth="800px">
           <Thead bg="blue.50">
             <Tr>
+              <Th textAlign="center" width="5%">
+                <Checkbox
+                  isChecked={seleccionados.length === pedidos.length}
+                  isIndeterminate={seleccionados.length > 0 && seleccionados.length < pedidos.length}
+                  onChange={toggleSeleccionTodos}
+                />
+              </Th>
               <Th textAlign="center" color="blue.600" width="10%">ID</Th>
               <Th textAlign="left" color="blue.600" width="20%">Fecha</Th>
               <Th textAlign="right" color="blue.600" width="20%">Total</Th>
@@ -174,6 +242,9 @@ const ListarPedidos = ({ pedidos: pedidosProps }) => {
           <Tbody>
             {pedidos.map((pedido) => (
               <Tr key={pedido.id} _hover={{ bg: "gray.50" }} transition="all 0.2s">
+                <Td textAlign="center">
+                  <Checkbox isChecked={seleccionados.includes(pedido.id)} onChange={() => toggleSeleccion(pedido.id)} />
+                </Td>
                 <Td textAlign="center" fontSize="sm" color="gray.600">#{pedido.id}</Td>
                 <Td color="gray.700">{new Date(pedido.fecha_creacion).toLocaleDateString()}</Td>
                 <Td textAlign="right" fontWeight="bold" color="gray.800">
@@ -26,19 +26,16 @@ import {
 } from "@chakra-ui/react";
 import { FaTrash, FaPlus, FaMinus } from "react-icons/fa";
 import { 
-  obtenerCarrito, 
   eliminarProductoDelCarrito, 
   vaciarCarrito, 
-  listarDetallesCarrito,
-  actualizarCantidadProducto,
-  listarProductos
+  obtenerResumenCarrito,
+  actualizarCantidadProducto
 } from "../../services/api";
 import { useNavigate } from "react-router-dom";
 import { useDisclosure } from "@chakra-ui/react";
 
 const Carrito = ({ onClose  }) => {
   const [carrito, setCarrito] = useState(null);
-  const [productos, setProductos] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [isDeleteAlertOpen, setIsDeleteAlertOpen] = useState(false);
@@ -52,24 +49,14 @@ const Carrito = ({ onClose  }) => {
 
   useEffect(() => {
     cargarCarrito();
-    cargarProductos();
   }, []);
 
-  const cargarProductos = async () => {
-    try {
-      const data = await listarProductos();
-      setProductos(data.productos);
-    } catch (error) {
-      console.error("Error cargando productos", error);
-    }
-  };
-
   const cargarCarrito = async () => {
     try {
       setLoading(true);
-      const detalles = await listarDetallesCarrito();
-      const data = await obtenerCarrito();
-      setCarrito({ ...data, detalles });
+      // Las líneas ya traen nombre, precio vigente y stock del producto
+      const data = await obtenerResumenCarrito();
+      setCarrito({ detalles: data.items, totales: data.totales });
       setError(null);
     } catch (error) {
       console.error("Error al obtener el carrito", error);
@@ -86,18 +73,13 @@ const Carrito = ({ onClose  }) => {
     }
   };
 
-  const obtenerNombreProducto = (productoId) => {
-    const producto = productos.find(p => p.id === productoId);
-    return producto ? producto.nombre : "Producto no encontrado";
-  };
-
   const formatearMonto = (monto) => {
     return new Intl.NumberFormat('es-AR', { style: 'currency', currency: 'ARS' }).format(monto);
   }
 
   const handleActualizarCantidad = async (productoId, nuevaCantidad) => {
     try {
-      const producto = productos.find(p => p.id === productoId);
+      const producto = carrito.detalles.find(detalle => detalle.producto_id === productoId);
       if (!producto) {
         toast({
           title: "Error",
@@ -180,8 +162,7 @@ const Carrito = ({ onClose  }) => {
   };
 
   const calcularTotal = () => {
-    if (!carrito?.detalles?.length) return 0;
-    return carrito.detalles.reduce((total, detalle) => total + detalle.subtotal, 0);
+    return carrito?.totales?.subtotal || 0;
   };
 
   if (loading) return (
@@ -234,8 +215,8 @@ const Carrito = ({ onClose  }) => {
               </Thead>
               <Tbody>
                 {carrito.detalles.map((detalle) => (
-                  <Tr key={detalle.id} _hover={{ bg: "gray.50" }}>
-                    <Td fontWeight="medium">{obtenerNombreProducto(detalle.producto_id)}</Td>
+                  <Tr key={detalle.detalle_id} _hover={{ bg: "gray.50" }}>
+                    <Td fontWeight="medium">{detalle.nombre}</Td>
                     <Td textAlign="center">
                       <Flex align="center" justify="center" gap={2}>
                         <IconButton
@@ -252,11 +233,11 @@ const Carrito = ({ onClose  }) => {
                           size="sm"
                           color={"black"}
                           onClick={() => handleActualizarCantidad(detalle.producto_id, detalle.cantidad + 1)}
-                          isDisabled={detalle.cantidad >= (productos.find(p => p.id === detalle.producto_id)?.stock || 0)}
+                          isDisabled={detalle.cantidad >= detalle.stock}
                         />
                       </Flex>
                     </Td>
-                    <Td textAlign="center">{formatearMonto(detalle.subtotal / detalle.cantidad)}</Td>
+                    <Td textAlign="center">{formatearMonto(detalle.precio_final)}</Td>
                     <Td textAlign="right">{formatearMonto(detalle.subtotal)}</Td>
                     <Td textAlign="right">
                       <IconButton
@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useMemo } from "react";
 import React from 'react';
 import {
   Box, Button, Heading, Text, FormControl, FormLabel, Input, Flex, Grid, GridItem, VStack, HStack, useToast, Container, Radio, RadioGroup, Image, Select,
@@ -254,6 +254,9 @@ const FormularioEnvio = () => {
     setMostrarFormularioDireccion(false);
   };
 
+// Una clave por cada total a pagar: un doble click no crea dos preferencias
+const claveIdempotencia = useMemo(() => crypto.randomUUID(), [total]);
+
 const crearPreferencia = async () => {
   try {
     const totalPagar = total; // total ya es subtotal + costoEnvio
@@ -261,6 +264,7 @@ const crearPreferencia = async () => {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        'Idempotency-Key': claveIdempotencia,
       },
       body: JSON.stringify({ total: totalPagar }), // enviamos el total
     });
@@ -16,6 +16,10 @@ const GraciasPorSuCompra = () => {
   const toast = useToast();
   const [pedidoInfo, setPedidoInfo] = useState({});
   const pedidoCreado = useRef(false);
+  // Mercado Pago vuelve con el payment_id: recargar la página no genera otro pedido
+  const claveIdempotencia = useRef(
+    new URLSearchParams(window.location.search).get("payment_id") || crypto.randomUUID()
+  );
   const [detalles, setDetalles] = useState([]);
   const [productos, setProductos] = useState([]);
   
@@ -68,7 +72,7 @@ const GraciasPorSuCompra = () => {
 
   const crearPedidoEnBackend = async (pedidoData) => {
     try {
-      const nuevoPedido = await crearPedido(pedidoData);
+      const nuevoPedido = await crearPedido(pedidoData, claveIdempotencia.current);
       try {
         const data = await listarPedidoDetalles(nuevoPedido.id);
         setDetalles(data);
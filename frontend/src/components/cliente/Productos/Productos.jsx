@@ -1,4 +1,4 @@
-import React, { useEffect, useState, useMemo, useCallback, useRef } from "react";
+import React, { useEffect, useState, useCallback, useRef } from "react";
 import {
   Container, VStack, HStack, Text, Box, Grid, Image, Button, Badge, useToast,
   Input, Drawer, DrawerBody, DrawerHeader, DrawerOverlay, DrawerContent, DrawerCloseButton,
@@ -6,7 +6,7 @@ import {
   Heading, Divider
 } from "@chakra-ui/react";
 import { FiSearch, FiMenu, FiFilter } from "react-icons/fi";
-import { listarProductos, listarCategorias, listarSubcategorias, obtenerProductosDescuento } from "../../../services/api";
+import { listarProductos, listarCategorias, listarSubcategorias } from "../../../services/api";
 import { useSearchParams, useNavigate } from "react-router-dom";
 import { useCart } from "../../../context/CartContext";
 import 'bootstrap/dist/css/bootstrap.min.css';
@@ -16,6 +16,8 @@ import ProductoItem from './ProductoItem';
 import ProductoModal from './ProductoModal';
 import ProductoSkeleton from "./ProductoSkeleton";
 
+const PRODUCTOS_POR_PAGINA = 12;
+
 const Productos = () => {
   // Estados y hooks
   const [productos, setProductos] = useState([]);
@@ -37,6 +39,7 @@ const Productos = () => {
   const isMobile = useBreakpointValue({ base: true, md: false });
   const [pagina, setPagina] = useState(1);
   const [totalPaginas, setTotalPaginas] = useState(1);
+  const [total, setTotal] = useState(0);
   const navigate = useNavigate();
   const [isAdding, setIsAdding] = useState(false);
   
@@ -48,9 +51,21 @@ const Productos = () => {
   } = useDisclosure();
 
   useEffect(() => {
-    cargarDatos();
+    cargarCategorias();
   }, []);
 
+  // Cada cambio de filtro vuelve a la primera página
+  useEffect(() => {
+    setPagina(1);
+  }, [searchTerm, selectedCategoria, selectedSubcategoria, rangoPrecio, ordenarPor]);
+
+  // El filtrado y el orden se resuelven en el servidor; se espera un momento
+  // para no disparar una consulta por cada tecla del buscador.
+  useEffect(() => {
+    const timeout = setTimeout(cargarProductos, 300);
+    return () => clearTimeout(timeout);
+  }, [pagina, searchTerm, selectedCategoria, selectedSubcategoria, rangoPrecio, ordenarPor]);
+
   useEffect(() => {
     const categoriaFromUrl = searchParams.get("categoria");
     if (categoriaFromUrl) {
@@ -59,23 +74,30 @@ const Productos = () => {
     }
   }, [searchParams]);
 
-  const cargarDatos = async () => {
+  const cargarCategorias = async () => {
     try {
-      setLoading(true);
-      const [productosData, categoriasData, descuentoData] = await Promise.all([
-        listarProductos(),
-        listarCategorias(),
-        obtenerProductosDescuento(pagina, 10)
-      ]);
-      
-      const productosCombinados = productosData.productos.map(prod => {
-        const prodDescuento = descuentoData.productos.find(d => d.id === prod.id);
-        return prodDescuento ? { ...prod, descuento: prodDescuento.descuento } : prod;
-      });
-  
-      setProductos(productosCombinados);
+      const categoriasData = await listarCategorias();
       setCategorias(categoriasData.categorias);
-      setTotalPaginas(Math.ceil(descuentoData.total / 10));
+    } catch (error) {
+      console.error("Error al cargar categorías:", error);
+    }
+  };
+
+  const cargarProductos = async () => {
+    const filtros = {};
+    if (searchTerm.trim()) filtros.q = searchTerm.trim();
+    if (selectedCategoria !== "todas") filtros.categoria_id = selectedCategoria;
+    if (selectedSubcategoria !== "todas") filtros.subcategoria_id = selectedSubcategoria;
+    filtros.precio_min = rangoPrecio[0];
+    filtros.precio_max = rangoPrecio[1];
+    if (ordenarPor !== "relevancia") filtros.ordenar_por = ordenarPor;
+
+    try {
+      setLoading(true);
+      const productosData = await listarProductos(pagina, PRODUCTOS_POR_PAGINA, filtros);
+      setProductos(productosData.productos);
+      setTotal(productosData.total);
+      setTotalPaginas(Math.max(1, Math.ceil(productosData.total / PRODUCTOS_POR_PAGINA)));
     } catch (error) {
       toast({
         title: "Error",
@@ -141,30 +163,8 @@ const Productos = () => {
     openModal(); // Abre el modal
   }, [openModal]);
 
-  const productosFiltrados = useMemo(() => productos
-    .filter(producto => {
-      const matchesSearch = producto.nombre.toLowerCase().includes(searchTerm.toLowerCase());
-      const matchesCategory =
-        selectedCategoria === "todas" ||
-        String(producto.categoria_id) === String(selectedCategoria);
-      const matchesSubcategory =
-        selectedSubcategoria === "todas" ||
-        String(producto.subcategoria_id) === String(selectedSubcategoria);
-      const matchesPrice = producto.precio >= rangoPrecio[0] && producto.precio <= rangoPrecio[1];
-      return matchesSearch && matchesCategory && matchesSubcategory && matchesPrice;
-    })
-    .sort((a, b) => {
-      switch (ordenarPor) {
-        case "precio-bajo":
-          return a.precio - b.precio;
-        case "precio-alto":
-          return b.precio - a.precio;
-        case "descuento":
-          return (b.descuento ? b.descuento.valor : 0) - (a.descuento ? a.descuento.valor : 0);
-        default:
-          return 0;
-      }
-    }), [productos, searchTerm, selectedCategoria, selectedSubcategoria, rangoPrecio, ordenarPor]);
+  // El servidor ya devuelve la página filtrada y ordenada
+  const productosFiltrados = productos;
 
   return (
     <Container maxW="container.xl" py={0} color="black">
@@ -235,7 +235,7 @@ const Productos = () => {
         
         {/* Contador de resultados */}
         <Text textAlign="center" fontSize="sm" mt={2}>
-          {loading ? 'Cargando productos...' : `${productosFiltrados.length} productos encontrados`}
+          {loading ? 'Cargando productos...' : `${total} productos encontrados`}
         </Text>
       </Box>
       
@@ -13,7 +13,7 @@ import {
   useDisclosure,
   useToast,
 } from "@chakra-ui/react";
-import { obtenerPedidosUsuario, cancelarPedido } from "../../services/api"; // Asegúrate de importar cancelarPedido
+import { obtenerHistorialPedidosUsuario, cancelarPedido } from "../../services/api"; // Asegúrate de importar cancelarPedido
 import { useAuth } from "../../context/AuthContext";
 import { FaEye, FaTimes } from "react-icons/fa"; // Agrega FaTimes para el ícono de cancelar
 import ListarDetallesPedido from "../administrativo/gestionPedidos/ListarDetallesPedido";
@@ -26,14 +26,18 @@ const HistorialPedidos = () => {
   const { isOpen: isDetallesOpen, onOpen: onDetallesOpen, onClose: onDetallesClose } = useDisclosure();
   const [pedidoSeleccionado, setPedidoSeleccionado] = useState(null);
   const [pedidoACancelar, setPedidoACancelar] = useState(null); // Estado para el pedido a cancelar
+  const [siguienteCursor, setSiguienteCursor] = useState(null);
+  const [cargandoMas, setCargandoMas] = useState(false);
   const toast = useToast();
 
   // Obtener pedidos del usuario
   useEffect(() => {
     const fetchPedidos = async () => {
       try {
-        const data = await obtenerPedidosUsuario(userId);
-        setPedidos(data);
+        // Los pedidos ya vienen con sus detalles: no hace falta pedirlos uno por uno
+        const data = await obtenerHistorialPedidosUsuario(userId);
+        setPedidos(data.pedidos);
+        setSiguienteCursor(data.next_cursor);
         setIsLoading(false);
       } catch (error) {
         setError("Error al cargar el historial de pedidos.");
@@ -43,6 +47,25 @@ const HistorialPedidos = () => {
     fetchPedidos();
   }, [userId]);
 
+  const handleCargarMas = async () => {
+    setCargandoMas(true);
+    try {
+      const data = await obtenerHistorialPedidosUsuario(userId, 10, siguienteCursor);
+      setPedidos((prevPedidos) => [...prevPedidos, ...data.pedidos]);
+      setSiguienteCursor(data.next_cursor);
+    } catch (error) {
+      toast({
+        title: "Error",
+        description: "No se pudieron cargar más pedidos.",
+        status: "error",
+        duration: 3000,
+        isClosable: true,
+      });
+    } finally {
+      setCargandoMas(false);
+    }
+  };
+
   const handleVerDetalles = (pedidoId) => {
     setPedidoSeleccionado(pedidoId);
     onDetallesOpen();
@@ -167,6 +190,11 @@ const HistorialPedidos = () => {
             </Box>
           ))
         )}
+        {siguienteCursor && !isLoading && (
+          <Button size="sm" colorScheme="teal" variant="outline" alignSelf="center" onClick={handleCargarMas} isLoading={cargandoMas}>
+            Cargar más pedidos
+          </Button>
+        )}
       </VStack>
 
       {/* Modal de confirmación para cancelar el pedido */}
@@ -210,6 +238,7 @@ const HistorialPedidos = () => {
       {pedidoSeleccionado && (
         <ListarDetallesPedido
           pedidoId={pedidoSeleccionado}
+          detallesPedido={pedidos.find((pedido) => pedido.id === pedidoSeleccionado)?.detalles}
           isOpen={isDetallesOpen}
           onClose={onDetallesClose}
         />
@@ -118,11 +118,12 @@ export const crearProducto = async (productoData) => {
   return response.data;
 };
 
-export const listarProductos = async (paginaActual, subProductosPorPagina) => {
+export const listarProductos = async (paginaActual, subProductosPorPagina, filtros = {}) => {
     const response = await api.get("/productos", {
       params: {
         pagina: paginaActual,
-        tamanio: subProductosPorPagina
+        tamanio: subProductosPorPagina,
+        ...filtros
       }
     });
     return response.data;
@@ -394,12 +395,22 @@ export const obtenerPedidosUsuario = async (usuarioId) => {
   return response.data;
 }
 
+// Historial con detalles, productos y envíos embebidos; `after` continúa desde el cursor anterior
+export const obtenerHistorialPedidosUsuario = async (usuarioId, tamanio = 10, after = null) => {
+  const response = await api.get(`/pedidos/usuario/${usuarioId}/completo`, {
+    params: after ? { tamanio, after } : { tamanio }
+  });
+  return response.data;
+}
+
 export const cancelarPedido = async (pedidoId) => {
   await api.put(`/pedidos/${pedidoId}/cancelar`);
 };
 
-export const crearPedido = async (pedidoData) => {
-  const response = await api.post("/pedidos", pedidoData);
+// La clave de idempotencia evita que un reintento cree el pedido dos veces
+export const crearPedido = async (pedidoData, idempotencyKey) => {
+  const config = idempotencyKey ? { headers: { "Idempotency-Key": idempotencyKey } } : undefined;
+  const response = await api.post("/pedidos", pedidoData, config);
   return response.data;
 };
 
@@ -408,8 +419,20 @@ export const actualizarEstadoPedido = async (pedidoId, nuevoEstado) => {
   return response.data;
 }
 
+// Cambia el estado de varios pedidos en una sola solicitud; devuelve el resultado de cada uno
+export const actualizarEstadoPedidos = async (pedidoIds, nuevoEstado) => {
+  const response = await api.post("/pedidos/estado-masivo", { pedido_ids: pedidoIds, estado: nuevoEstado });
+  return response.data;
+}
+
 // Servicios para Carrito
 //---------------------------------------------------------------------
+// Resumen del carrito: líneas con nombre, imagen, precio vigente y stock, más los totales
+export const obtenerResumenCarrito = async () => {
+  const response = await api.get("/carritos/resumen");
+  return response.data;
+};
+
 // Obtener el carrito del usuario autenticado (o crearlo si no existe)
 export const obtenerCarrito = async () => {
   const response = await api.get("/carritos");
@@ -435,6 +458,13 @@ export const eliminarProductoDelCarrito = async (productoId) => {
   await api.delete(`/carritos/productos/${productoId}`);
 };
 
+// Aplicar varias operaciones al carrito en una sola solicitud
+// operaciones: [{ tipo: "agregar" | "actualizar" | "eliminar", producto_id, cantidad }]
+export const aplicarOperacionesCarrito = async (operaciones) => {
+  const response = await api.post("/carritos/operaciones", { operaciones });
+  return response.data;
+};
+
 // Listar detalles del carrito
 export const listarDetallesCarrito = async () => {
   const response = await api.get("/carritos/detalles");
@@ -517,6 +547,28 @@ export const obtenerMetricasCancelaciones = async (mesesHistorial) => {
     };
   }
 };
+
+/**
+ * Obtiene los carritos abandonados que se borraron en los últimos días
+ */
+export const obtenerCarritosAbandonados = async (dias = 30) => {
+  try {
+    const response = await api.get("/reportes/carritos-abandonados", {
+      params: { dias },
+    });
+    return response.data;
+  } catch (error) {
+    console.error("Error obteniendo carritos abandonados:", error);
+    return {
+      dias,
+      carritos: 0,
+      carritos_con_productos: 0,
+      unidades: 0,
+      valor: 0,
+      por_dia: [],
+    };
+  }
+};
 // Crear un descuento
 export const crearDescuento = async (descuentoData) => {
   const response = await api.post("/descuentos/", descuentoData);